@@ -0,0 +1,7 @@
+"""
+Benchmarks of pyptly against an in-process fake aptly API server.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.compare old.json results.json
+    python -m benchmarks.micro --output micro.json
+"""
@@ -0,0 +1,76 @@
+"""
+benchmarks.compare
+------------------
+
+Compare two benchmark result files
+
+    python -m benchmarks.compare baseline.json results.json
+"""
+import sys
+import json
+import argparse
+
+# metrics where bigger is better, for all others smaller is better
+HIGHER_IS_BETTER = ('calls_per_second', 'packages_per_second',
+                    'mb_per_second', 'versions_per_second')
+# context values which are not compared
+IGNORED = ('calls', 'packages', 'changes', 'megabytes', 'workers', 'keys',
+           'versions')
+
+
+def flatten(results, prefix=''):
+    """Return {'dotted.path': number} of nested results"""
+    flat = {}
+    for key, value in results.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            if key not in IGNORED:
+                flat[path] = value
+    return flat
+
+
+def compare(old, new, threshold=0.1):
+    """Return list of (metric, old, new, change, regression flag), change
+    is relative and positive when new is better
+    """
+    old = flatten(old['results'])
+    new = flatten(new['results'])
+    rows = []
+    for path in sorted(set(old) & set(new)):
+        before, after = old[path], new[path]
+        if not before:
+            continue
+        change = (after - before) / float(before)
+        if not path.endswith(HIGHER_IS_BETTER):
+            change = -change
+        rows.append((path, before, after, change, change < -threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('baseline')
+    parser.add_argument('results')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change reported as regression')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as file_pointer:
+        old = json.load(file_pointer)
+    with open(args.results) as file_pointer:
+        new = json.load(file_pointer)
+
+    print('{0} -> {1}'.format(old.get('pyptly'), new.get('pyptly')))
+    regressions = 0
+    for path, before, after, change, regression in compare(
+            old, new, args.threshold):
+        regressions += regression
+        print('{0:<60} {1:>12.4g} {2:>12.4g} {3:>+8.1%}{4}'.format(
+            path, before, after, change, '  REGRESSION' if regression else ''))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
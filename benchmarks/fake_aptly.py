@@ -0,0 +1,228 @@
+"""
+benchmarks.fake_aptly
+---------------------
+
+In-process fake aptly API server serving synthetic data
+"""
+import re
+import json
+import socket
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs, unquote
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+    from urllib import unquote
+
+ARCHITECTURES = ('amd64', 'i386', 'all', 'arm64')
+FILENAME_RE = re.compile(br'filename="([^"]+)"')
+
+
+def make_refs(count, seed=0):
+    """Return count distinct synthetic package references"""
+    refs = []
+    for num in range(count):
+        fileshash = ((num + 1) * 0x9e3779b97f4a7c15 + seed) & (2 ** 64 - 1)
+        refs.append('P{0} pkg{1} 1.{2}-{3} {4:08x}'.format(
+            ARCHITECTURES[num % len(ARCHITECTURES)], num // 2, num % 7,
+            seed, fileshash))
+    return refs
+
+
+def details(ref):
+    """Return synthetic 'details' dict of package reference"""
+    arch, name, version, fileshash = ref[1:].split(' ')
+    return {'Key': ref, 'ShortKey': ref.rsplit(' ', 1)[0],
+            'FilesHash': fileshash, 'Package': name, 'Version': version,
+            'Architecture': arch, 'Maintainer': 'Bench <bench@localhost>',
+            'Installed-Size': '1024', 'Priority': 'optional',
+            'Section': 'misc', 'Size': '65536',
+            'Filename': '{0}_{1}_{2}.deb'.format(name, version, arch),
+            'MD5sum': fileshash[:16] * 2, 'SHA1': fileshash[:10] * 4,
+            'SHA256': fileshash * 4,
+            'Description': 'synthetic package {0}\n used by benchmarks'.format(
+                name)}
+
+
+class FakeAptly(object):
+    """Synthetic aptly state, serialized responses are cached.
+
+    Repo 'repo-<N>' and snapshots 'snap-<N>', 'snap-<N>-new' exist for
+    every size N; the new snapshot differs from the old one in
+    diff_fraction of its packages.
+
+    :param sizes: numbers of packages of the repos and snapshots
+    :param diff_fraction: fraction of changed packages between snapshots
+    :param graph_bytes: size of the graph image
+    """
+
+    def __init__(self, sizes=(1000,), diff_fraction=0.1,
+                 graph_bytes=4 * 1024 * 1024):
+        self.sizes = sizes
+        self.diff_fraction = diff_fraction
+        self.graph = b'\x89PNG\r\n\x1a\n' + b'\0' * (graph_bytes - 8)
+        self.uploaded = {}
+        self._refs = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+
+    def refs(self, name):
+        """Return package references of repo or snapshot"""
+        if name not in self._refs:
+            size = int(name.split('-')[1])
+            refs = make_refs(size)
+            if name.endswith('-new'):
+                changed = int(size * self.diff_fraction)
+                refs = refs[changed:] + make_refs(changed, seed=1)
+            self._refs[name] = refs
+        return self._refs[name]
+
+
+    def _cached(self, key, build):
+        "Serialize response once"
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = json.dumps(build()).encode('utf-8')
+            return self._cache[key]
+
+
+    def listing(self, name, fmt):
+        """Return serialized package listing"""
+        if fmt == 'details':
+            return self._cached(('details', name),
+                                lambda: [details(ref)
+                                         for ref in self.refs(name)])
+        return self._cached(('refs', name), lambda: self.refs(name))
+
+
+    def diff(self, left, right):
+        """Return serialized diff of snapshots, changed packages only
+        (enough for benchmarking decode of a large diff)
+        """
+        def build():
+            old = set(self.refs(left))
+            new = set(self.refs(right))
+            return ([{'Left': ref, 'Right': None}
+                     for ref in sorted(old - new)] +
+                    [{'Left': None, 'Right': ref}
+                     for ref in sorted(new - old)])
+        return self._cached(('diff', left, right), build)
+
+
+    def repos(self):
+        """Return list of repos"""
+        return [{'Name': 'repo-{0}'.format(size), 'Comment': '',
+                 'DefaultDistribution': 'bench', 'DefaultComponent': 'main'}
+                for size in self.sizes]
+
+
+class Handler(BaseHTTPRequestHandler):
+    "Routes of the fake aptly API"
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # headers and body are written separately, avoid Nagle delays
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+    def log_message(self, *args):
+        pass
+
+
+    def _send(self, body, status=200, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _body(self):
+        size = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(size) if size else b''
+
+
+    def _route(self, verb):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = [unquote(part) for part in url.path.split('/')[2:]]
+        body = self._body()
+        fmt = query.get('format', [None])[0]
+
+        if not path:
+            return self._send({'error': 'not found'}, status=404)
+        if path == ['version']:
+            return self._send({'Version': '1.3.0'})
+        if path[0].startswith('graph.'):
+            return self._send(fake.graph, content_type='image/png')
+        if path == ['repos']:
+            return self._send(fake.repos())
+        if path[0] == 'repos' and len(path) == 2:
+            return self._send({'Name': path[1], 'Comment': '',
+                               'DefaultDistribution': 'bench',
+                               'DefaultComponent': 'main'})
+        if path[0] in ('repos', 'snapshots') and path[2:] == ['packages']:
+            if verb == 'GET':
+                return self._send(fake.listing(path[1], fmt))
+            return self._send({'Name': path[1]})
+        if path[0] == 'snapshots' and len(path) == 4 and path[2] == 'diff':
+            return self._send(fake.diff(path[1], path[3]))
+        if path[0] == 'snapshots' and len(path) == 2:
+            return self._send({'Name': path[1], 'Description': '',
+                               'CreatedAt': '2018-01-01T00:00:00Z'})
+        if path[0] == 'packages' and len(path) == 2:
+            return self._send(details(path[1]))
+        if path[0] == 'files' and len(path) == 2 and verb == 'POST':
+            names = [name.decode('utf-8')
+                     for name in FILENAME_RE.findall(body)]
+            fake.uploaded.setdefault(path[1], []).extend(names)
+            return self._send(['{0}/{1}'.format(path[1], name)
+                               for name in names])
+        if path[0] == 'publish':
+            return self._send({'Distribution': path[-1], 'Prefix': '.',
+                               'SourceKind': 'snapshot', 'Sources': []})
+        if path == ['tasks']:
+            return self._send([])
+        return self._send({'error': 'not found'}, status=404)
+
+
+    def do_GET(self):
+        self._route('GET')
+
+
+    def do_POST(self):
+        self._route('POST')
+
+
+    def do_PUT(self):
+        self._route('PUT')
+
+
+    def do_DELETE(self):
+        self._route('DELETE')
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    "Threaded HTTP server"
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start(fake=None, host='127.0.0.1', port=0):
+    """Serve fake aptly in a background thread, return (server, url)"""
+    server = Server((host, port), Handler)
+    server.fake = fake if fake is not None else FakeAptly()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://{0}:{1}'.format(host, server.server_address[1])
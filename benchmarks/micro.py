@@ -0,0 +1,137 @@
+"""
+benchmarks.micro
+----------------
+
+Microbenchmarks of the per-call overhead of pyptly itself: building
+URLs, headers and bodies of API calls, without any network traffic
+
+    python -m benchmarks.micro --output micro.json
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+
+import requests
+from requests.adapters import BaseAdapter
+
+import pyptly
+from pyptly.utils import prefix_sanitized
+
+KEY = 'Pamd64 libfoo 1.2-3+deb9u1 7d2e0c4b1a9f8e36'
+
+
+class CannedAdapter(BaseAdapter):
+    """Transport adapter answering every request with the same JSON
+    body, so only the client side of a call is measured
+    """
+
+    def __init__(self, body=b'{}'):
+        super(CannedAdapter, self).__init__()
+        self.body = body
+
+
+    def send(self, request, **kwargs):
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.headers['Content-Type'] = 'application/json'
+        resp._content = self.body
+        resp.request = request
+        resp.url = request.url
+        return resp
+
+
+    def close(self):
+        pass
+
+
+def timed(func, repeat):
+    """Call func repeat times, return calls per second and mean
+    microseconds per call
+    """
+    for _ in range(max(1, repeat // 100)):
+        func()
+    start = time.time()
+    for _ in range(repeat):
+        func()
+    total = time.time() - start
+    return {'calls': repeat,
+            'calls_per_second': repeat / total if total else None,
+            'us_per_call': total / repeat * 1e6}
+
+
+def calls(api):
+    """(name, function) of the measured API calls"""
+    return [
+        ('show_local_repo', lambda: api.show_local_repo('stable/main')),
+        ('show_repo_packages', lambda: api.show_repo_packages(
+            'stable', q='Name (libfoo)', format='details')),
+        ('add_pkg_bykey', lambda: api.add_pkg_bykey('stable',
+                                                    PackageRefs=[KEY])),
+        ('show_pkg_bykey', lambda: api.show_pkg_bykey(KEY)),
+        ('delete_file', lambda: api.delete_file('incoming', 'foo_1.0.deb')),
+        ('publish', lambda: api.publish(
+            prefix='s3:bucket:debian/main', SourceKind='local',
+            Sources=[{'Name': 'stable'}], Distribution='stable')),
+        ('update_publish', lambda: api.update_publish(
+            'stable', prefix='s3:bucket:debian/main', ForceOverwrite=True)),
+        ('snapshots_diff', lambda: api.snapshots_diff('snap-1', 'snap-2')),
+    ]
+
+
+def bench_build(repeat):
+    """Overhead of building calls, the transport is not invoked"""
+    api = pyptly.Aptly('http://localhost:8080', pkg_memo_size=0)
+    api._call = lambda url, verb, **kwargs: {}
+    return dict((name, timed(func, repeat)) for name, func in calls(api))
+
+
+def bench_canned(repeat):
+    """Overhead of whole calls answered by CannedAdapter"""
+    api = pyptly.Aptly('http://localhost:8080', pkg_memo_size=0)
+    adapter = CannedAdapter()
+    session = api.pool.session
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return dict((name, timed(func, repeat)) for name, func in calls(api))
+
+
+def bench_prefix(repeat):
+    """prefix_sanitized of a few distinct prefixes"""
+    prefixes = ['.', 's3:bucket:debian/main', 'filesystem:www:dists_old/x',
+                'debian/stable-updates']
+    return {'prefix_sanitized': timed(
+        lambda: [prefix_sanitized(prefix) for prefix in prefixes], repeat)}
+
+
+def run(repeat):
+    """Run all microbenchmarks, return results dict"""
+    results = {'build': bench_build(repeat),
+               'canned': bench_canned(max(1, repeat // 10)),
+               'utils': bench_prefix(repeat)}
+    return {'pyptly': pyptly.__version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=100000,
+                        help='calls per benchmark')
+    parser.add_argument('--output', help='JSON file, stdout by default')
+    args = parser.parse_args(argv)
+
+    text = json.dumps(run(args.repeat), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file_pointer:
+            file_pointer.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
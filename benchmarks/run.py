@@ -0,0 +1,286 @@
+"""
+benchmarks.run
+--------------
+
+Run pyptly benchmarks against the fake aptly server, write JSON results
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --sizes 1000,100000,1000000 --output big.json
+"""
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import pyptly
+from pyptly.index import PackageIndex
+from pyptly.diff import SnapshotDiffer
+from pyptly.version import sort_versions
+from pyptly.retention import RetentionPolicy
+from benchmarks import fake_aptly
+
+try:
+    import tracemalloc
+except ImportError:
+    # python < 3.4
+    tracemalloc = None
+
+
+def percentile(values, fraction):
+    """Return percentile of sorted values, nearest rank"""
+    if not values:
+        return None
+    pos = int(round(fraction * (len(values) - 1)))
+    return values[pos]
+
+
+def timed(func, repeat):
+    """Call func repeat times, return calls per second and latency
+    percentiles in milliseconds
+    """
+    latencies = []
+    started = time.time()
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        latencies.append(time.time() - start)
+    total = time.time() - started
+    latencies.sort()
+    return {'calls': repeat,
+            'calls_per_second': repeat / total if total else None,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000}
+
+
+def peak_memory(func):
+    """Return (result of func, seconds, peak traced memory in bytes)"""
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    result = func()
+    elapsed = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_import(repeat=5):
+    """Time of 'import pyptly' in a fresh interpreter"""
+    code = ('import time; start = time.time(); import pyptly; '
+            'print(time.time() - start)')
+    times = sorted(float(subprocess.check_output([sys.executable, '-c', code]))
+                   for _ in range(repeat))
+    return {'import_ms': percentile(times, 0.5) * 1000}
+
+
+def bench_calls(api, size, repeat):
+    """Latency and throughput of single API calls"""
+    repo = 'repo-{0}'.format(size)
+    snapshot = 'snap-{0}'.format(size)
+    key = fake_aptly.make_refs(1)[0]
+    calls = [
+        ('aptly_version', lambda: api.aptly_version),
+        ('get_local_repos', lambda: api.get_local_repos),
+        ('show_local_repo', lambda: api.show_local_repo(repo)),
+        ('show_snapshot', lambda: api.show_snapshot(snapshot)),
+        ('show_pkg_bykey', lambda: api.show_pkg_bykey(key)),
+        ('add_pkg_bykey', lambda: api.add_pkg_bykey(repo,
+                                                    PackageRefs=[key])),
+        ('update_publish', lambda: api.update_publish('bench', prefix='.')),
+        ('get_tasks', lambda: api.get_tasks),
+        ('search_snapshot_packages', lambda: api.search_snapshot_packages(
+            snapshot, 'Name (~ ^pkg1), $Architecture (amd64)')),
+    ]
+    return dict((name, timed(func, repeat)) for name, func in calls)
+
+
+def bench_bulk(api, size, workers):
+    """Throughput of calls fanned out over threads"""
+    keys = fake_aptly.make_refs(min(size, 2000), seed=2)
+    start = time.time()
+    api.show_pkgs_bykeys(keys, workers=workers)
+    elapsed = time.time() - start
+    targets = [('.', 'dist{0}'.format(num), {}) for num in range(40)]
+    publish = timed(lambda: api.update_publish_many(targets, workers=workers,
+                                                    per_storage=workers), 3)
+    return {'show_pkgs_bykeys': {'keys': len(keys), 'workers': workers,
+                                 'calls_per_second': len(keys) / elapsed},
+            'update_publish_many_40': publish}
+
+
+def bench_listing(api, size):
+    """Time and peak memory of package listings"""
+    repo = 'repo-{0}'.format(size)
+    results = {}
+    # warm up the server side cache of serialized listings
+    api.show_repo_packages(repo)
+    api.show_repo_packages(repo, format='details')
+
+    cases = [
+        ('show_repo_packages', lambda: api.show_repo_packages(repo)),
+        ('show_repo_packages_details',
+         lambda: api.show_repo_packages(repo, format='details')),
+        ('iter_repo_packages_count',
+         lambda: sum(1 for _ in api.iter_repo_packages(repo))),
+        ('iter_repo_packages_index',
+         lambda: PackageIndex(api.iter_repo_packages(repo))),
+    ]
+    for name, func in cases:
+        result, elapsed, peak = peak_memory(func)
+        results[name] = {'packages': size, 'seconds': elapsed,
+                         'packages_per_second': size / elapsed,
+                         'peak_bytes': peak}
+        del result
+    return results
+
+
+def bench_diff(api, size):
+    """Server side diff decode against local diff of snapshots"""
+    old, new = 'snap-{0}'.format(size), 'snap-{0}-new'.format(size)
+    results = {}
+    diff, elapsed, peak = peak_memory(lambda: api.snapshots_diff(old, new))
+    results['snapshots_diff'] = {'packages': size, 'changes': len(diff),
+                                 'seconds': elapsed, 'peak_bytes': peak}
+    differ = SnapshotDiffer(api)
+    diff, elapsed, peak = peak_memory(lambda: differ.diff(old, new))
+    results['SnapshotDiffer.diff'] = {'packages': size, 'changes': len(diff),
+                                      'seconds': elapsed, 'peak_bytes': peak}
+    return results
+
+
+def bench_versions(size):
+    """Sorting versions and computing retention of synthetic packages"""
+    refs = fake_aptly.make_refs(size)
+    versions = [ref.split(' ')[2] for ref in refs]
+    results = {}
+    start = time.time()
+    sort_versions(versions)
+    elapsed = time.time() - start
+    results['sort_versions'] = {'versions': size, 'seconds': elapsed,
+                                'versions_per_second': size / elapsed}
+    start = time.time()
+    RetentionPolicy(keep=1).removals(refs)
+    elapsed = time.time() - start
+    results['retention_keep_1'] = {'packages': size, 'seconds': elapsed,
+                                   'packages_per_second': size / elapsed}
+    return results
+
+
+def bench_upload(api, tmpdir, file_size, count, workers):
+    """Upload throughput in MB/s"""
+    files = []
+    for num in range(count):
+        path = os.path.join(tmpdir, 'bench{0}_1.0_amd64.deb'.format(num))
+        with open(path, 'wb') as file_pointer:
+            file_pointer.write(os.urandom(file_size))
+        files.append(path)
+    megabytes = file_size * count / 1048576.0
+
+    results = {}
+    start = time.time()
+    api.upload_files('bench', files)
+    elapsed = time.time() - start
+    results['upload_files'] = {'megabytes': megabytes, 'seconds': elapsed,
+                               'mb_per_second': megabytes / elapsed}
+    start = time.time()
+    api.upload_many('bench', files, workers=workers,
+                    batch_bytes=file_size * 2)
+    elapsed = time.time() - start
+    results['upload_many'] = {'megabytes': megabytes, 'seconds': elapsed,
+                              'workers': workers,
+                              'mb_per_second': megabytes / elapsed}
+    return results
+
+
+def bench_graph(api, repeat):
+    """Graph download throughput in MB/s"""
+    results = {}
+    for name, kwargs in (('get_graph_memory', {'in_memory': True}),
+                         ('get_graph_file', {'fileobj': _Null()})):
+        start = time.time()
+        for _ in range(repeat):
+            size = api.get_graph(**kwargs)['Size']
+        elapsed = time.time() - start
+        results[name] = {'megabytes': size / 1048576.0,
+                         'mb_per_second': size * repeat / 1048576.0 / elapsed}
+    return results
+
+
+class _Null(object):
+    "Writable file object discarding data"
+
+    def write(self, data):
+        return len(data)
+
+
+def run(sizes, repeat, workers, upload_mb, graph_mb):
+    """Run all benchmarks, return results dict"""
+    fake = fake_aptly.FakeAptly(sizes=sizes,
+                                graph_bytes=int(graph_mb * 1048576))
+    server, url = fake_aptly.start(fake)
+    api = pyptly.Aptly(url, pool_maxsize=max(workers, 10), pkg_memo_size=0)
+    tmpdir = tempfile.mkdtemp()
+    results = {'import': bench_import()}
+    try:
+        results['calls'] = bench_calls(api, sizes[0], repeat)
+        results['bulk'] = bench_bulk(api, sizes[0], workers)
+        results['listing'] = dict(('{0}'.format(size),
+                                   bench_listing(api, size))
+                                  for size in sizes)
+        results['diff'] = dict(('{0}'.format(size), bench_diff(api, size))
+                               for size in sizes)
+        results['versions'] = dict(('{0}'.format(size), bench_versions(size))
+                                   for size in sizes)
+        file_size = 4 * 1048576
+        count = max(1, int(upload_mb * 1048576 // file_size))
+        results['upload'] = bench_upload(api, tmpdir, file_size, count,
+                                         workers)
+        results['graph'] = bench_graph(api, 5)
+    finally:
+        api.close()
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmpdir)
+
+    return {'pyptly': pyptly.__version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated package counts of repos')
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='calls per single call benchmark')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--upload-mb', type=float, default=64)
+    parser.add_argument('--graph-mb', type=float, default=8)
+    parser.add_argument('--output', help='JSON file, stdout by default')
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes, args.repeat, args.workers, args.upload_mb,
+                  args.graph_mb)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file_pointer:
+            file_pointer.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,4 +3,10 @@ Python wrapper for the Aptly API
 """
 from pyptly.api import Aptly
 
+try:
+    from pyptly.aio import AsyncAptly
+except (ImportError, SyntaxError):
+    # aiohttp is not installed or python is too old for asyncio
+    pass
+
 __version__ = '1.0.2'
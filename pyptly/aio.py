@@ -0,0 +1,335 @@
+"""
+pyptly.aio
+----------
+
+This module provides an AsyncAptly object to make API calls from an
+asyncio event loop. It requires aiohttp.
+"""
+import ssl
+import time
+import inspect
+import asyncio
+import aiohttp
+from pyptly.api import Aptly, GraphSink
+from pyptly.batch import RepoBatch
+from pyptly.flow import (Blocking, Consume, Sleep, Calls, Done, is_flow,
+                         advance)
+from pyptly.metrics import body_size
+from pyptly.multipart import MultipartEncoder, CHUNK_SIZE
+from pyptly.utils import decode, is_error, JSONArrayParser
+
+
+def _basic_auth(auth):
+    "Convert requests style authentication to aiohttp.BasicAuth"
+    if auth is None or isinstance(auth, aiohttp.BasicAuth):
+        return auth
+    if isinstance(auth, (tuple, list)):
+        return aiohttp.BasicAuth(*auth)
+    if hasattr(auth, 'username') and hasattr(auth, 'password'):
+        return aiohttp.BasicAuth(auth.username, auth.password)
+    raise TypeError('only basic authentication is supported')
+
+
+def _client_timeout(timeout):
+    "Convert requests style timeout to aiohttp.ClientTimeout"
+    if isinstance(timeout, (tuple, list)):
+        connect, read = timeout
+        return aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+    return aiohttp.ClientTimeout(total=timeout)
+
+
+def _ssl_context(verify_ssl):
+    "Convert requests style verify argument to aiohttp ssl argument"
+    if verify_ssl is True:
+        return None
+    if not verify_ssl:
+        return False
+    return ssl.create_default_context(cafile=verify_ssl)
+
+
+def _query(params):
+    "Stringify query parameters the same way requests does"
+    query = []
+    for key, value in (params or {}).items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        query.extend((key, str(val)) for val in values if val is not None)
+    return query
+
+
+class AsyncRepoBatch(RepoBatch):
+    """RepoBatch of AsyncAptly, use it with async with or await flush()
+    """
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            await self.flush()
+        else:
+            self.discard()
+
+
+# get_running_loop appeared in python 3.7, in a coroutine get_event_loop
+# returns the running loop as well
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+async def _stream(body):
+    "Iterate over multipart body, aiohttp writes are buffered so copy"
+    chunk = body.read()
+    while chunk:
+        yield bytes(chunk)
+        chunk = body.read()
+
+
+class AsyncAptly(Aptly):
+    """Asyncio flavour of the Aptly class.
+
+    Provides every method of Aptly, but each call returns a coroutine,
+    properties included, and iter_* methods return async iterators::
+
+        async with AsyncAptly('http://127.0.0.1:8080') as api:
+            version = await api.aptly_version
+            snaps = await asyncio.gather(*[api.show_snapshot(name)
+                                           for name in names])
+
+    All calls share one aiohttp connection pool and at most
+    max_concurrency of them are in flight at the same time. Other
+    keyword arguments are the same as for Aptly, except that the
+    response cache is not supported.
+
+    :param pool_maxsize: max number of connections kept open per host
+    :param max_concurrency: max number of simultaneous API calls
+    """
+
+    TRANSPORT_ERRORS = Aptly.TRANSPORT_ERRORS + (aiohttp.ClientError,)
+
+    def __init__(self, host, auth=None, verify_ssl=True, timeout=None,
+                 pool_maxsize=100, max_concurrency=100, **kwargs):
+        if kwargs.get('cache'):
+            raise ValueError('AsyncAptly does not support response cache')
+        super(AsyncAptly, self).__init__(host, auth=auth,
+                                         verify_ssl=verify_ssl,
+                                         timeout=timeout,
+                                         pool_maxsize=pool_maxsize,
+                                         **kwargs)
+        self.max_concurrency = max_concurrency
+        self._session = None
+        self._semaphore = None
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+    def __enter__(self):
+        raise TypeError('use "async with" with AsyncAptly')
+
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+    async def close(self):
+        """Close all pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+        self._semaphore = None
+
+
+    def _session_pool(self, pool_connections, pool_maxsize):
+        "Calls go over the aiohttp session of _client"
+        return None
+
+
+    async def _run(self, flow):
+        "Run flow of a composite call in the event loop, see pyptly.flow"
+        value = error = None
+        while True:
+            step = advance(flow, value, error)
+            if isinstance(step, Done):
+                flow.close()
+                return step.value
+            value = error = None
+            try:
+                value = await self._step(step)
+            except Exception as err:
+                error = err
+
+
+    async def _item(self, func):
+        "Run item of Calls"
+        if isinstance(func, Blocking):
+            loop = _running_loop()
+            return await loop.run_in_executor(None, func.func)
+        if isinstance(func, Consume):
+            return func.consumer([item async for item in func.func()])
+        result = func()
+        if is_flow(result):
+            return await self._run(result)
+        if inspect.isawaitable(result):
+            return await result
+        return result
+
+
+    async def _step(self, step):
+        "Run step of a flow, return its result"
+        if isinstance(step, Sleep):
+            await asyncio.sleep(step.seconds)
+            return None
+        if not isinstance(step, Calls):
+            return await self._item(step.func)
+
+        funcs = step.funcs
+        limit = asyncio.Semaphore(step.workers or len(funcs) or 1)
+        groups = step.groups or [None] * len(funcs)
+        locks = dict((group, asyncio.Semaphore(step.per_group))
+                     for group in set(groups))
+
+        async def run_item(num):
+            async with locks[groups[num]], limit:
+                return await self._item(funcs[num])
+
+        order = step.order()
+        # let every item finish before raising, like the threads of Aptly
+        done = await asyncio.gather(*[run_item(num) for num in order],
+                                    return_exceptions=True)
+        for result in done:
+            if isinstance(result, BaseException):
+                raise result
+        results = dict(zip(order, done))
+        return [results[num] for num in range(len(funcs))]
+
+
+    def _client(self):
+        "Return aiohttp session, it has to be created inside the loop"
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.pool_maxsize,
+                ssl=_ssl_context(self.verify_ssl))
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                auth=_basic_auth(self.auth),
+                timeout=_client_timeout(self.timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+
+    async def _call(self, url, verb, **kwargs):
+        "Api call wrapper"
+
+        session = self._client()
+        if 'headers' not in kwargs:
+            kwargs['headers'] = self.headers
+        if 'params' in kwargs:
+            kwargs['params'] = _query(kwargs['params'])
+
+        if self.metrics is not None:
+            return await self._measured_call(session, url, verb, **kwargs)
+        async with self._semaphore:
+            async with session.request(verb, url, **kwargs) as request:
+                body = await request.read()
+
+        return decode(body, self.codec)
+
+
+    async def _measured_call(self, session, url, verb, **kwargs):
+        "_call recording metrics"
+        endpoint = self._endpoint(url)
+        sent = body_size(kwargs.get('data'))
+        async with self._semaphore:
+            event = self.metrics.start(endpoint, verb, url)
+            try:
+                async with session.request(verb, url, **kwargs) as request:
+                    body = await request.read()
+            except Exception:
+                self.metrics.finish(event, None, sent)
+                raise
+            self.metrics.finish(event, request.status, sent, len(body))
+
+        start = time.time()
+        try:
+            return decode(body, self.codec)
+        finally:
+            self.metrics.observe_decode(endpoint, time.time() - start)
+
+
+    async def _iter_call(self, url, chunk_size, **kwargs):
+        "Api call wrapper yielding elements of JSON array response"
+
+        session = self._client()
+        parser = JSONArrayParser()
+        async with self._semaphore:
+            async with session.get(url, headers=self.headers,
+                                   params=_query(kwargs.get('params'))
+                                  ) as request:
+                async for chunk in request.content.iter_chunked(chunk_size):
+                    for item in parser.feed(chunk):
+                        yield item
+        for item in parser.close():
+            yield item
+
+
+    def batch(self, name, batch_size=1000):
+        """Return AsyncRepoBatch of local repository :name"""
+        return AsyncRepoBatch(self, name, batch_size=batch_size)
+
+
+    async def upload_files(self, dirname, files, callback=None,
+                           chunk_size=CHUNK_SIZE):
+        """Parameter :dir is upload directory name. Directory would be
+        created if it doesn't exist.
+
+        :param dirname: upload directory name
+        :param files: files to upload. Single file path or list of pathes.
+        :param callback: progress function, called as
+                         callback(bytes_sent, total_bytes)
+        :param chunk_size: size of chunks read from disk
+        """
+        if not isinstance(files, list):
+            files = [files]
+
+        body = MultipartEncoder(files, callback=callback,
+                                chunk_size=chunk_size)
+        headers = dict({'Content-Type': body.content_type,
+                        'Content-Length': str(len(body))}, **self.headers)
+        try:
+            return await self._call(
+                self._url('dir', dirname),
+                'POST',
+                data=_stream(body),
+                headers=headers
+            )
+        finally:
+            body.close()
+
+
+    async def get_graph(self, path='', ext='png', fileobj=None,
+                        in_memory=False, chunk_size=CHUNK_SIZE):
+        """Generate graph of aptly objects, see Aptly.get_graph"""
+        start = time.time()
+        session = self._client()
+        async with self._semaphore:
+            async with session.get(self._url('graph', ext),
+                                   headers=self.headers) as request:
+                if request.status != 200:
+                    msg = decode(await request.read(), self.codec)
+                    if not is_error(msg):
+                        msg = {u'error': 'HTTP {0}'.format(request.status)}
+                    return msg
+                sink = GraphSink(path or 'graph.' + ext, fileobj, in_memory,
+                                 request.headers.get('Content-Length'))
+                with sink:
+                    async for chunk in request.content.iter_chunked(
+                            chunk_size):
+                        sink.write(chunk)
+        if self.metrics is not None:
+            self.metrics.add_received('graph.' + ext, 'GET', sink.size)
+        return sink.report(start)
@@ -4,14 +4,184 @@ pyptly.api
 
 This module provides an Aptly object to make API calls
 """
-import json
-import requests
-from pyptly.utils import prefix_sanitized, response
+import os
+import time
+from pyptly.multipart import MultipartEncoder, CHUNK_SIZE
+from pyptly.session import SessionPool
+from pyptly.cache import ResponseCache, Memo
+from pyptly.batch import RepoBatch
+from pyptly.hashes import FileHasher, package_checksums, find_package
+from pyptly.metrics import body_size
+from pyptly.codec import get_codec
+from pyptly.query import QueryIndex, compile_query
+from pyptly.retention import RetentionPolicy
+from pyptly.compose import merged_packages, pulled_packages, pull_refs
+from pyptly.cleanup import (ReferenceGraph, CleanupPolicy,
+                            merged_description, pulled_description,
+                            filtered_description)
+from pyptly.reconcile import DesiredState
+from pyptly.flow import Call, Calls, Blocking, Consume, Sleep, Done, run
+from pyptly.utils import (prefix_sanitized, response, decode, is_error,
+                          async_params, split_batches,
+                          iter_json_array, publish_storage,
+                          error_message, quote_segment, remember)
+
+BATCH_BYTES = 64 * 1024 * 1024
+# number of snapshots kept searchable by search_snapshot_packages
+SNAPSHOT_INDEXES = 16
+
+TASK_IDLE = 0
+TASK_RUNNING = 1
+TASK_SUCCEEDED = 2
+TASK_FAILED = 3
+
+# URL templates of API calls relative to <host>/api, every field is
+# a single path segment, quoted when the URL is built
+URLS = {'repos': 'repos',
+        'repo': 'repos/{0}',
+        'repo_packages': 'repos/{0}/packages',
+        'repo_snapshots': 'repos/{0}/snapshots',
+        'repo_dir': 'repos/{0}/file/{1}',
+        'repo_file': 'repos/{0}/file/{1}/{2}',
+        'packages': 'packages/{0}',
+        'files': 'files',
+        'dir': 'files/{0}',
+        'file': 'files/{0}/{1}',
+        'publish': 'publish',
+        'publish_prefix': 'publish/{0}',
+        'publish_distr': 'publish/{0}/{1}',
+        'snapshots': 'snapshots',
+        'snapshot': 'snapshots/{0}',
+        'snapshot_packages': 'snapshots/{0}/packages',
+        'snapshots_diff': 'snapshots/{0}/diff/{1}',
+        'tasks': 'tasks',
+        'task': 'tasks/{0}',
+        'task_wait': 'tasks/{0}/wait',
+        'task_output': 'tasks/{0}/output',
+        'task_detail': 'tasks/{0}/detail',
+        'task_return_value': 'tasks/{0}/return_value',
+        'tasks_clear': 'tasks-clear',
+        'version': 'version',
+        'graph': 'graph.{0}'}
+
+
+def task_id(task):
+    """Return ID of task returned by a call with _async=True"""
+    return task['ID'] if isinstance(task, dict) else task
+
+
+def update_tasks(ids, listing, tasks):
+    """Update tasks dict {ID: task} with task listing, return number of
+    tasks which have just finished. Tasks missing in listing (e.g. they
+    were deleted) are finished with an error.
+    """
+    finished = 0
+    present = dict((task['ID'], task) for task in listing)
+    for num in ids:
+        previous = tasks.get(num)
+        if previous is not None and previous.get('State', 0) > TASK_RUNNING:
+            continue
+        task = present.get(num, {u'ID': num, u'State': TASK_FAILED,
+                                 u'error': 'task not found'})
+        tasks[num] = task
+        if task['State'] > TASK_RUNNING:
+            finished += 1
+    return finished
+
+
+# os.replace appeared in python 3.3, rename overwrites on posix as well
+_replace = getattr(os, 'replace', os.rename)
+
+
+class GraphSink(object):
+    """Destination of a streamed graph: file path, file object or
+    memory buffer (preallocated if size is known). A file path is
+    written under a temporary name and renamed when the download
+    completes, a failed download leaves no partial file behind.
+    """
+
+    def __init__(self, path, fileobj=None, in_memory=False, size=None):
+        self.path = None
+        self.size = 0
+        self._buffer = None
+        self._file = None
+        if in_memory:
+            self._buffer = bytearray(int(size)) if size else bytearray()
+        elif fileobj is not None:
+            self._file = fileobj
+        else:
+            self.path = path
+            self._file = open(path + '.part', 'wb')
 
-class Aptly(object):
-    "Aptly class"
 
-    def __init__(self, host, auth=None, verify_ssl=True, timeout=None):
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, *exc_info):
+        if self.path is not None:
+            self._file.close()
+            if exc_type is None:
+                _replace(self.path + '.part', self.path)
+            else:
+                os.remove(self.path + '.part')
+
+
+    def write(self, chunk):
+        """Store next chunk"""
+        end = self.size + len(chunk)
+        if self._buffer is None:
+            self._file.write(chunk)
+        elif end <= len(self._buffer):
+            self._buffer[self.size:end] = chunk
+        else:
+            del self._buffer[self.size:]
+            self._buffer.extend(chunk)
+        self.size = end
+
+
+    def report(self, start):
+        """Return get_graph result, :start is download start time"""
+        report = {u'Size': self.size, u'Time': time.time() - start}
+        if self._buffer is not None:
+            del self._buffer[self.size:]
+            report[u'Content'] = memoryview(self._buffer)
+        elif self.path is not None:
+            report[u'Path'] = self.path
+        return report
+
+
+class Aptly(object):
+    """Aptly class
+
+    HTTP connections are pooled and kept alive between calls. The object
+    may be shared between threads; call close() or use it as a context
+    manager to release the connections.
+
+    :param host: aptly API server address
+    :param auth: requests authentication object or (user, pass) tuple
+    :param verify_ssl: verify server certificate
+    :param timeout: requests timeout in seconds
+    :param pool_connections: number of per-host connection pools to cache
+    :param pool_maxsize: max number of connections kept open per host
+    :param cache: ResponseCache for GET calls, True for default settings
+    :param pkg_memo_size: max number of package details remembered by
+                          show_pkg_bykey, None for unbounded, 0 to disable
+    :param store: PackageStore persisting package details, snapshot
+                  package lists and checksums of local files across
+                  processes
+    :param metrics: Metrics recording latency, sizes and status codes
+                    of API calls
+    :param codec: JSON codec name ('orjson', 'ujson', 'simdjson', 'json')
+                  or JSONCodec, the fastest installed one by default
+    """
+
+    # errors of a failed upload request which are worth a retry
+    TRANSPORT_ERRORS = (IOError, OSError)
+
+    def __init__(self, host, auth=None, verify_ssl=True, timeout=None,
+                 pool_connections=10, pool_maxsize=10, cache=None,
+                 pkg_memo_size=None, store=None, metrics=None, codec=None):
         self.timeout = timeout
         self.headers = {}
         self.auth = auth
@@ -28,27 +198,183 @@ class Aptly(object):
                         'snapshots': self.api + '/snapshots',
                         'publish': self.api + '/publish',
                         'files': self.api + '/files',
-                        'packages': self.api + '/packages'}
+                        'packages': self.api + '/packages',
+                        'tasks': self.api + '/tasks'}
+        self.urls = dict((name, '{0}/{1}'.format(self.api, path))
+                         for name, path in URLS.items())
+        self._built_urls = {}
+        self._merged_headers = None
         self.verify_ssl = verify_ssl
+        self.pool_maxsize = pool_maxsize
+        self.pool = self._session_pool(pool_connections, pool_maxsize)
+        self.cache = ResponseCache() if cache is True else cache
+        self.pkg_memo = Memo(pkg_memo_size)
+        self.snapshot_indexes = Memo(SNAPSHOT_INDEXES)
+        self.store = store
+        self.hasher = FileHasher(store=store)
+        self.metrics = metrics
+        self.codec = get_codec(codec)
 
 
-    def _call(self, url, verb, **kwargs):
-        "Api call wrapper"
+    def __enter__(self):
+        return self
+
 
-        verb_map = {'GET': requests.get,
-                    'POST': requests.post,
-                    'PUT': requests.put,
-                    'DELETE': requests.delete}
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        """Close all pooled connections"""
+        self.pool.close()
+
+
+    def _session_pool(self, pool_connections, pool_maxsize):
+        "Return SessionPool the calls are sent over"
+        return SessionPool(pool_connections=pool_connections,
+                           pool_maxsize=pool_maxsize)
+
+
+    def _url(self, name, *segments):
+        """Return URL of API call :name (a key of URLS), segments are
+        quoted and substituted into the template
+        """
+        if not segments:
+            return self.urls[name]
+        key = (name, segments)
+        try:
+            return self._built_urls[key]
+        except KeyError:
+            pass
+        url = self.urls[name].format(*[quote_segment(segment)
+                                       for segment in segments])
+        return remember(self._built_urls, key, url)
+
+
+    def _json_headers(self):
+        "Return self.headers with JSON Content-Type, rebuilt on change"
+        merged = self._merged_headers
+        if merged is None or merged[0] != self.headers:
+            merged = (dict(self.headers),
+                      dict({'Content-Type': 'application/json'},
+                           **self.headers))
+            self._merged_headers = merged
+        return merged[1]
+
+
+    def _request(self, url, verb, **kwargs):
+        "Send request over pooled session, return raw response"
 
         if 'headers' not in kwargs:
             kwargs['headers'] = self.headers
-        request = verb_map[verb](url,
-                                 verify=self.verify_ssl,
-                                 auth=self.auth,
-                                 timeout=self.timeout,
-                                 **kwargs)
+        if self.metrics is not None:
+            return self._measured_request(url, verb, **kwargs)
+        return self.pool.session.request(verb, url,
+                                         verify=self.verify_ssl,
+                                         auth=self.auth,
+                                         timeout=self.timeout,
+                                         **kwargs)
+
+
+    def _measured_request(self, url, verb, **kwargs):
+        "_request recording metrics, streamed bodies are counted later"
+        event = self.metrics.start(self._endpoint(url), verb, url)
+        try:
+            request = self.pool.session.request(verb, url,
+                                                verify=self.verify_ssl,
+                                                auth=self.auth,
+                                                timeout=self.timeout,
+                                                **kwargs)
+        except Exception:
+            self.metrics.finish(event, None, body_size(kwargs.get('data')))
+            raise
+        received = 0 if kwargs.get('stream') else len(request.content)
+        self.metrics.finish(event, request.status_code,
+                            body_size(request.request.body), received)
+        return request
+
+
+    def _response(self, request, url):
+        "Decode response of request to url"
+        if self.metrics is None:
+            return response(request, self.codec)
+        start = time.time()
+        try:
+            return response(request, self.codec)
+        finally:
+            self.metrics.observe_decode(self._endpoint(url),
+                                        time.time() - start)
 
-        return response(request)
+
+    def _call(self, url, verb, **kwargs):
+        "Api call wrapper"
+        if self.cache is None:
+            return self._response(self._request(url, verb, **kwargs), url)
+        return self._cached_call(url, verb, **kwargs)
+
+
+    def _run(self, flow):
+        "Run flow of a composite call, see pyptly.flow"
+        return run(flow)
+
+
+    def _endpoint(self, url):
+        "Return name of API endpoint, e.g. 'repos' or 'version'"
+        return url[len(self.api) + 1:].split('/', 1)[0].split('?', 1)[0]
+
+
+    def _cached_call(self, url, verb, **kwargs):
+        "Api call wrapper serving GET calls from response cache"
+        endpoint = self._endpoint(url)
+        if verb != 'GET':
+            try:
+                return self._response(self._request(url, verb, **kwargs),
+                                      url)
+            finally:
+                self.cache.invalidate(endpoint)
+
+        if not self.cache.enabled(endpoint):
+            return self._response(self._request(url, verb, **kwargs), url)
+
+        key = self.cache.key(url, kwargs.get('params'))
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry.expires > time.time():
+                return decode(entry.content, self.codec)
+            kwargs['headers'] = dict(kwargs.get('headers', self.headers),
+                                     **entry.validators)
+
+        request = self._request(url, verb, **kwargs)
+        if request.status_code == 304 and entry is not None:
+            self.cache.refresh(key)
+            return decode(entry.content, self.codec)
+        if request.status_code == 200:
+            self.cache.store(key, endpoint, request.content, request.headers)
+        return self._response(request, url)
+
+
+    def _iter_call(self, url, chunk_size, **kwargs):
+        "Api call wrapper yielding elements of JSON array response"
+        request = self._request(url, 'GET', stream=True, **kwargs)
+        chunks = request.iter_content(chunk_size)
+        if self.metrics is not None:
+            chunks = self._counted(chunks, url)
+        try:
+            for item in iter_json_array(chunks):
+                yield item
+        finally:
+            request.close()
+
+
+    def _counted(self, chunks, url):
+        "Pass chunks of streamed response through, count their size"
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.metrics.add_received(self._endpoint(url), 'GET', size)
 
 
     @property
@@ -57,7 +383,7 @@ class Aptly(object):
         Each repository is returned as in "show" API
         """
         return self._call(
-            '{0}'.format(self.api_url['repos']),
+            self._url('repos'),
             'GET'
         )
 
@@ -68,15 +394,15 @@ class Aptly(object):
         :param name: name of the new local repository
         :param **kwargs: all parameters allowed by Aptly API
         """
-        headers = dict({'Content-Type': 'application/json'}, **self.headers)
+        headers = self._json_headers()
         data = {'Name': name}
         if kwargs:
             data.update(kwargs)
 
         return self._call(
-            '{0}'.format(self.api_url['repos']),
+            self._url('repos'),
             'POST',
-            data=json.dumps(data),
+            data=self.codec.dumps(data),
             headers=headers
         )
 
@@ -86,7 +412,7 @@ class Aptly(object):
         :param name: name of the new local repository
         """
         return self._call(
-            '{0}/{1}'.format(self.api_url['repos'], name),
+            self._url('repo', name),
             'GET'
         )
 
@@ -97,32 +423,44 @@ class Aptly(object):
         :param name: name of the local repository
         :param **kwargs: all parameters allowed by Aptly API
         """
-        params = {}
-        if kwargs:
-            params.update(kwargs)
-
+        params = kwargs
         return self._call(
-            '{0}/{1}/packages'.format(self.api_url['repos'], name),
+            self._url('repo_packages', name),
             'GET',
             params=params
         )
 
 
+    def iter_repo_packages(self, name, chunk_size=CHUNK_SIZE, **kwargs):
+        """Same as show_repo_packages, but returns an iterator yielding
+        packages one by one while the response is being received, so
+        memory usage does not depend on the repository size.
+        Raises ValueError if aptly responds with an error.
+
+        :param name: name of the local repository
+        :param chunk_size: size of chunks read from the network
+        :param **kwargs: all parameters allowed by Aptly API
+        """
+        return self._iter_call(
+            self._url('repo_packages', name),
+            chunk_size,
+            params=kwargs
+        )
+
+
     def edit_local_repo(self, name, **kwargs):
         """Update local repository meta information
 
         :param name: name of the local repository
         :param **kwargs: all parameters allowed by Aptly API
         """
-        headers = dict({'Content-Type': 'application/json'}, **self.headers)
-        data = {}
-        if kwargs:
-            data.update(kwargs)
+        headers = self._json_headers()
+        data = kwargs
 
         return self._call(
-            '{0}/{1}'.format(self.api_url['repos'], name),
+            self._url('repo', name),
             'PUT',
-            data=json.dumps(data),
+            data=self.codec.dumps(data),
             headers=headers
         )
 
@@ -136,12 +474,9 @@ class Aptly(object):
         :param name: name of the local repository
         :param **kwargs: all parameters allowed by Aptly API
         """
-        params = {}
-        if kwargs:
-            params.update(kwargs)
-
+        params = kwargs
         return self._call(
-            '{0}/{1}'.format(self.api_url['repos'], name),
+            self._url('repo', name),
             'DELETE',
             params=params
         )
@@ -159,25 +494,24 @@ class Aptly(object):
         :param name: name of the local repository
         :param dirname: directory with uploaded packages to import
         :param filename: name of the file to add
+        :param _async: run as background task, return the task
         :param **kwargs: all parameters allowed by Aptly API
         """
 
         filename = kwargs.pop('filename', None)
-        params = {}
+        params = async_params(kwargs)
         if kwargs:
             params.update(kwargs)
 
         if filename:
             return self._call(
-                '{0}/{1}/file/{2}/{3}'.format(self.api_url['repos'], name,
-                                              dirname, filename),
+                self._url('repo_file', name, dirname, filename),
                 'POST',
                 params=params
             )
         else:
             return self._call(
-                '{0}/{1}/file/{2}'.format(self.api_url['repos'],
-                                          name, dirname),
+                self._url('repo_dir', name, dirname),
                 'POST',
                 params=params
             )
@@ -198,15 +532,13 @@ class Aptly(object):
         :param name: name of the local repository
         :param **kwargs: all parameters allowed by Aptly API
         """
-        headers = dict({'Content-Type': 'application/json'}, **self.headers)
-        data = {}
-        if kwargs:
-            data.update(kwargs)
+        headers = self._json_headers()
+        data = kwargs
 
         return self._call(
-            '{0}/{1}/packages'.format(self.api_url['repos'], name),
+            self._url('repo_packages', name),
             'POST',
-            data=json.dumps(data),
+            data=self.codec.dumps(data),
             headers=headers
         )
 
@@ -221,37 +553,140 @@ class Aptly(object):
         :param name: name of the local repository
         :param **kwargs: all parameters allowed by Aptly API
         """
-        headers = dict({'Content-Type': 'application/json'}, **self.headers)
-        data = {}
-        if kwargs:
-            data.update(kwargs)
+        headers = self._json_headers()
+        data = kwargs
 
         return self._call(
-            '{0}/{1}/packages'.format(self.api_url['repos'], name),
+            self._url('repo_packages', name),
             'DELETE',
-            data=json.dumps(data),
+            data=self.codec.dumps(data),
             headers=headers
         )
 
 
+    def batch(self, name, batch_size=1000):
+        """Return RepoBatch which coalesces add_pkg_bykey and
+        delete_pkg_bykey calls for local repository :name
+
+        :param name: name of the local repository
+        :param batch_size: max number of refs per request
+        """
+        return RepoBatch(self, name, batch_size=batch_size)
+
+
+    def prune_repo(self, name, keep=None, older_than=None, by_arch=True,
+                   protect=(), dry_run=False, batch_size=1000):
+        """Remove outdated packages from local repository, see
+        RetentionPolicy. The removal set is computed on the client and
+        removed with batched delete_pkg_bykey calls.
+
+        Returns result of RepoBatch.flush, with dry_run only 'Removed'
+        and 'Added' lists of what would have been done.
+
+        :param name: name of the local repository
+        :param keep: number of newest versions kept per package name and
+                     architecture, None keeps all
+        :param older_than: name of a snapshot, packages older than the
+                           newest version of the same package in it are
+                           removed
+        :param by_arch: group versions by architecture as well as by name
+        :param protect: package references which are never removed
+        :param dry_run: only return what would be removed
+        :param batch_size: max number of refs per request
+        """
+        return self._run(self._prune_repo(name, keep, older_than, by_arch,
+                                          protect, dry_run, batch_size))
+
+
+    def _prune_repo(self, name, keep, older_than, by_arch, protect, dry_run,
+                    batch_size):
+        "Flow of prune_repo"
+        calls = [lambda: self.show_repo_packages(name)]
+        if older_than is not None:
+            calls.append(lambda: self.show_snapshot_packages(older_than))
+        lists = yield Calls(calls)
+        for listing in lists:
+            if is_error(listing):
+                yield Done(listing)
+        reference = lists[1] if older_than is not None else None
+
+        policy = RetentionPolicy(keep, reference, by_arch, protect)
+        removed = policy.removals(lists[0])
+        if dry_run:
+            yield Done({u'Removed': removed, u'Added': []})
+        batch = self.batch(name, batch_size)
+        batch.update(remove=removed)
+        result = yield Call(batch._flush)
+        yield Done(result)
+
+
     def show_pkg_bykey(self, key):
         """Show information about package by package key.
         Package keys could be obtained from various
         GET .../packages APIs.
 
+        Package keys are content addressed, so results are remembered
+        in pkg_memo (and store, if any) and never requested again.
+
         :param key: package key
         """
-        return self._call(
-            '{0}/{1}'.format(self.api_url['packages'], key),
+        return self._run(self._show_pkg_bykey(key))
+
+
+    def _show_pkg_bykey(self, key):
+        "Flow of show_pkg_bykey"
+        msg = self.pkg_memo.get(key)
+        if msg is None and self.store is not None:
+            msg = self.store.get('package', key)
+            if msg is not None:
+                self.pkg_memo.set(key, msg)
+        if msg is not None:
+            yield Done(dict(msg))
+
+        msg = yield Call(lambda: self._call(
+            self._url('packages', key),
             'GET'
-        )
+        ))
+        if not is_error(msg):
+            self.pkg_memo.set(key, dict(msg))
+            if self.store is not None:
+                self.store.put('package', key, msg)
+        yield Done(msg)
+
+
+    def show_pkgs_bykeys(self, keys, workers=4):
+        """Show information about many packages by package keys.
+
+        Duplicate keys are requested once, known packages are taken
+        from pkg_memo, the rest are requested by :workers threads over
+        pooled connections. Returns list of results in order of keys.
+
+        :param keys: list of package keys
+        :param workers: number of parallel requests
+        """
+        return self._run(self._show_pkgs_bykeys(keys, workers))
+
+
+    def _show_pkgs_bykeys(self, keys, workers):
+        "Flow of show_pkgs_bykeys"
+        found = {}
+        for key in keys:
+            if key not in found:
+                msg = self.pkg_memo.get(key)
+                if msg is not None:
+                    found[key] = dict(msg)
+        missing = [key for key in set(keys) if key not in found]
+        results = yield Calls([lambda key=key: self._show_pkg_bykey(key)
+                               for key in missing], workers)
+        found.update(zip(missing, results))
+        yield Done([found[key] for key in keys])
 
 
     @property
     def get_dirs(self):
         """List all directories"""
         return self._call(
-            '{0}'.format(self.api_url['files']),
+            self._url('files'),
             'GET'
         )
 
@@ -262,7 +697,7 @@ class Aptly(object):
         :param dirname: directory name to inspect
         """
         return self._call(
-            '{0}/{1}'.format(self.api_url['files'], dirname),
+            self._url('dir', dirname),
             'GET'
         )
 
@@ -273,7 +708,7 @@ class Aptly(object):
         :param dirname: directory name to delete
         """
         return self._call(
-            '{0}/{1}'.format(self.api_url['files'], dirname),
+            self._url('dir', dirname),
             'DELETE'
         )
 
@@ -285,12 +720,13 @@ class Aptly(object):
         :param filename: file to delete
         """
         return self._call(
-            '{0}/{1}/{2}'.format(self.api_url['files'], dirname, filename),
+            self._url('file', dirname, filename),
             'DELETE'
         )
 
 
-    def upload_files(self, dirname, files):
+    def upload_files(self, dirname, files, callback=None,
+                     chunk_size=CHUNK_SIZE):
         """Parameter :dir is upload directory name. Directory would be
         created if it doesn't exist.
 
@@ -298,26 +734,183 @@ class Aptly(object):
         preserve filenames. No check is performed if existing uploaded
         would be overwritten.
 
+        Files are streamed from disk in chunks, so memory usage does not
+        depend on upload size.
+
         :param dirname: upload directory name
         :param files: files to upload. Single file path or list of pathes.
+        :param callback: progress function, called as
+                         callback(bytes_sent, total_bytes)
+        :param chunk_size: size of chunks read from disk
         """
-        if isinstance(files, list):
-            files = [('file', open(f, 'rb')) for f in files]
-        else:
-            files = {'file': open(files, 'rb')}
+        if not isinstance(files, list):
+            files = [files]
+
+        body = MultipartEncoder(files, callback=callback,
+                                chunk_size=chunk_size)
+        headers = dict({'Content-Type': body.content_type}, **self.headers)
+        try:
+            return self._call(
+                self._url('dir', dirname),
+                'POST',
+                data=body,
+                headers=headers
+            )
+        finally:
+            body.close()
 
-        return self._call(
-            '{0}/{1}'.format(self.api_url['files'], dirname),
-            'POST',
-            files=files
-        )
+
+    def upload_many(self, dirname, files, workers=4,
+                    batch_bytes=BATCH_BYTES, retries=2):
+        """Upload many files to directory :dirname in parallel.
+
+        Files are split into batches of about batch_bytes, balanced by
+        size, and uploaded by :workers threads over pooled connections
+        (keep workers <= pool_maxsize). Files missing from a batch
+        response are re-uploaded one by one up to :retries times.
+
+        Returns the list of uploaded files as upload_files does. If some
+        files could not be uploaded, returns error dict with 'Uploaded'
+        and 'FailedFiles' lists.
+
+        :param dirname: upload directory name
+        :param files: list of file paths
+        :param workers: number of parallel uploads
+        :param batch_bytes: desired size of a single upload request
+        :param retries: number of retries for every failed file
+        """
+        return self._run(self._upload_many(dirname, files, workers,
+                                           batch_bytes, retries))
+
+
+    def _upload_many(self, dirname, files, workers, batch_bytes, retries):
+        "Flow of upload_many"
+        batches = split_batches([(os.path.getsize(path), path)
+                                 for path in files],
+                                batch_bytes, min_batches=workers)
+        results = yield Calls([lambda batch=batch: self._upload_batch(
+            dirname, batch, retries) for batch in batches], workers)
+        yield Done(self._upload_report(files, results))
+
+
+    def _upload_batch(self, dirname, files, retries):
+        "Flow uploading a batch of files, retry missing ones one by one"
+        uploaded = {}
+        batches = [files]
+        for _ in range(retries + 1):
+            failed = []
+            for batch in batches:
+                try:
+                    msg = yield Call(lambda: self.upload_files(dirname, batch))
+                except self.TRANSPORT_ERRORS:
+                    msg = []
+                done = set(msg) if not is_error(msg) else set()
+                for path in batch:
+                    name = '{0}/{1}'.format(dirname, os.path.basename(path))
+                    if name in done:
+                        uploaded[path] = name
+                    else:
+                        failed.append(path)
+            if not failed:
+                break
+            batches = [[path] for path in failed]
+        yield Done(uploaded)
+
+
+    def upload_new_files(self, dirname, files, repo=None, snapshot=None,
+                         **kwargs):
+        """Upload only files which are not in local repository :repo or
+        snapshot :snapshot yet.
+
+        Files are matched to packages by SHA256 (or SHA1, MD5sum for
+        packages without it). Checksums of local files are cached by
+        path, size and mtime in self.hasher, so unchanged files are
+        read once.
+
+        Returns dict with 'Uploaded' list as returned by upload_many and
+        'Skipped', a dict of skipped file paths and keys of the packages
+        with the same content. If some uploads failed, it has 'error'
+        and 'FailedFiles' keys as well.
+
+        :param dirname: upload directory name
+        :param files: list of file paths
+        :param repo: name of the local repository to check
+        :param snapshot: name of the snapshot to check
+        :param **kwargs: upload_many parameters
+        """
+        if repo is None and snapshot is None:
+            raise ValueError('repo or snapshot is required')
+        return self._run(self._upload_new_files(dirname, list(files), repo,
+                                                snapshot, kwargs))
+
+
+    def _upload_new_files(self, dirname, files, repo, snapshot, kwargs):
+        "Flow of upload_new_files, files are hashed while listing"
+        if repo is not None:
+            listing = Consume(
+                lambda: self.iter_repo_packages(repo, format='details'),
+                package_checksums)
+        else:
+            listing = lambda: self.show_snapshot_packages(snapshot,
+                                                          format='details')
+        try:
+            index, checksums = yield Calls([
+                listing, Blocking(lambda: self.hasher.map(files))])
+            if repo is None:
+                if is_error(index):
+                    yield Done(index)
+                index = package_checksums(index)
+        except (TypeError, KeyError, ValueError) as err:
+            yield Done({u'error': err})
+
+        skipped = {}
+        new_files = []
+        for path, file_sums in zip(files, checksums):
+            key = find_package(index, file_sums)
+            if key is None:
+                new_files.append(path)
+            else:
+                skipped[path] = key
+
+        uploaded = []
+        if new_files:
+            uploaded = yield Call(lambda: self.upload_many(
+                dirname, new_files, **kwargs))
+        yield Done(self._dedup_report(uploaded, skipped))
+
+
+    @staticmethod
+    def _dedup_report(uploaded, skipped):
+        "Build result of upload_new_files"
+        if is_error(uploaded):
+            report = dict(uploaded)
+        else:
+            report = {u'Uploaded': uploaded}
+        report[u'Skipped'] = skipped
+        return report
+
+
+    @staticmethod
+    def _upload_report(files, results):
+        "Merge results of _upload_batch calls"
+        uploaded = {}
+        for result in results:
+            uploaded.update(result)
+        report = [uploaded[path] for path in files if path in uploaded]
+        failed = [path for path in files if path not in uploaded]
+        if failed:
+            return {u'error': 'failed to upload {0} files'.format(
+                        len(failed)),
+                    u'Uploaded': report,
+                    u'FailedFiles': failed}
+        return report
 
 
     @property
     def get_publish(self):
         """List published repositories"""
         return self._call(
-            '{0}'.format(self.api_url['publish']),
+            self._url('publish'),
             'GET'
         )
 
@@ -326,19 +919,22 @@ class Aptly(object):
         """Publish local repository or snapshot under specified prefix.
         Storage might be passed in prefix as well, e.g. s3:packages/.
 
+        :param _async: run as background task, return the task
         :param **kwargs: all parameters allowed by Aptly API
         """
         prefix = kwargs.pop('prefix', None)
         if prefix:
             prefix = prefix_sanitized(prefix)
+        params = async_params(kwargs)
 
         data = kwargs
-        headers = dict({'Content-Type': 'application/json'}, **self.headers)
+        headers = self._json_headers()
         return self._call(
-            '{0}/{1}'.format(self.api_url['publish'], prefix if prefix else ''),
+            self._url('publish_prefix', prefix or ''),
             'POST',
             headers=headers,
-            data=json.dumps(data)
+            params=params,
+            data=self.codec.dumps(data)
         )
 
 
@@ -349,26 +945,82 @@ class Aptly(object):
         * if snapshots have been been published, it is possible to
         switch each component to new snapshot
 
+        :param _async: run as background task, return the task
         :param **kwargs: all parameters allowed by Aptly API
         """
         prefix = kwargs.pop('prefix', None)
         if prefix:
             prefix = prefix_sanitized(prefix)
+        params = async_params(kwargs)
 
-        data = {}
-        if kwargs:
-            data.update(kwargs)
-
-        headers = dict({'Content-Type': 'application/json'}, **self.headers)
+        data = kwargs
+        headers = self._json_headers()
         return self._call(
-            '{0}/{1}/{2}'.format(self.api_url['publish'],
-                                 prefix if prefix else '', distr),
+            self._url('publish_distr', prefix or '', distr),
             'PUT',
             headers=headers,
-            data=json.dumps(data)
+            params=params,
+            data=self.codec.dumps(data)
         )
 
 
+    def update_publish_many(self, targets, workers=4, per_storage=1):
+        """Update many published repositories concurrently.
+
+        Targets on the same storage (the part of the prefix before the
+        last ':', e.g. 's3:bucket', local storage for plain prefixes) are
+        updated at most :per_storage at a time, targets on different
+        storages run in parallel up to :workers at once. A failed target
+        does not stop the others.
+
+        Returns list of reports in the order of targets, every one is a
+        dict with 'Prefix', 'Distribution', 'Storage', 'Time' (seconds)
+        and 'Result' (update_publish response) keys, and 'error' if the
+        update failed.
+
+        :param targets: list of (prefix, distr, params) tuples, params
+                        is a dict of update_publish parameters
+        :param workers: max number of concurrent updates
+        :param per_storage: max number of concurrent updates per storage
+        """
+        targets = list(targets)
+        return self._run(self._update_publish_many(targets, workers,
+                                                   per_storage))
+
+
+    def _update_publish_many(self, targets, workers, per_storage):
+        "Flow of update_publish_many"
+        reports = yield Calls(
+            [lambda target=target: self._update_target(*target)
+             for target in targets], workers,
+            groups=[publish_storage(prefix) for prefix, _, _ in targets],
+            per_group=per_storage)
+        yield Done(reports)
+
+
+    def _update_target(self, prefix, distr, params):
+        "Flow updating a single target of update_publish_many"
+        start = time.time()
+        try:
+            msg = yield Call(lambda: self.update_publish(
+                distr, prefix=prefix, **(params or {})))
+        except Exception as err:
+            msg = {u'error': err}
+        yield Done(self._publish_report(prefix, distr,
+                                        publish_storage(prefix), msg,
+                                        time.time() - start))
+
+
+    @staticmethod
+    def _publish_report(prefix, distr, storage, msg, elapsed):
+        "Build report of a single update_publish_many target"
+        report = {u'Prefix': prefix, u'Distribution': distr,
+                  u'Storage': storage, u'Time': elapsed, u'Result': msg}
+        if is_error(msg):
+            report[u'error'] = error_message(msg)
+        return report
+
+
     def delete_publish(self, distr, **kwargs):
         """Delete published repository, clean up files in published
         directory
@@ -379,14 +1031,9 @@ class Aptly(object):
         if prefix:
             prefix = prefix_sanitized(prefix)
 
-        params = {}
-        if kwargs:
-            params.update(kwargs)
-
+        params = kwargs
         return self._call(
-            '{0}/{1}/{2}'.format(self.api_url['publish'],
-                                 prefix if prefix else '',
-                                 distr),
+            self._url('publish_distr', prefix or '', distr),
             'DELETE',
             params=params
         )
@@ -397,12 +1044,9 @@ class Aptly(object):
 
         :param **kwargs: all parameters allowed by Aptly API
         """
-        params = {}
-        if kwargs:
-            params.update(kwargs)
-
+        params = kwargs
         return self._call(
-            '{0}'.format(self.api_url['snapshots']),
+            self._url('snapshots'),
             'GET',
             params=params
         )
@@ -412,18 +1056,18 @@ class Aptly(object):
         """Create snapshot of current local repository :name contents
         as new snapshot with name :snapname
 
+        :param _async: run as background task, return the task
         :param **kwargs: all parameters allowed by Aptly API
         """
-        data = {}
-        if kwargs:
-            data.update(kwargs)
-
-        headers = dict({'Content-Type': 'application/json'}, **self.headers)
+        params = async_params(kwargs)
+        data = kwargs
+        headers = self._json_headers()
         return self._call(
-            '{0}/{1}/snapshots'.format(self.api_url['repos'], rep_name),
+            self._url('repo_snapshots', rep_name),
             'POST',
             headers=headers,
-            data=json.dumps(data)
+            params=params,
+            data=self.codec.dumps(data)
         )
 
 
@@ -436,41 +1080,142 @@ class Aptly(object):
 
         :param **kwargs: all parameters allowed by Aptly API
         """
-        data = {}
-        if kwargs:
-            data.update(kwargs)
-
-        headers = dict({'Content-Type': 'application/json'}, **self.headers)
+        data = kwargs
+        headers = self._json_headers()
         return self._call(
-            '{0}'.format(self.api_url['snapshots']),
+            self._url('snapshots'),
             'POST',
             headers=headers,
-            data=json.dumps(kwargs)
+            data=self.codec.dumps(kwargs)
         )
 
 
+    def merge_snapshots(self, name, sources, mode='last', q=None,
+                        workers=4, **kwargs):
+        """Create snapshot :name merged from snapshots :sources, like
+        aptly snapshot merge. Package lists are fetched by :workers
+        threads, merged on the client and the snapshot is created by a
+        single create_snapshot_from_pkg call with SourceSnapshots set.
+
+        :param name: name of the new snapshot
+        :param sources: names of the merged snapshots
+        :param mode: 'last' (packages of later snapshots replace ones
+                     with the same name and architecture), 'first',
+                     'latest' (newest version wins) or 'all'
+        :param q: package query, only matching packages are kept
+        :param workers: number of parallel listing requests
+        :param **kwargs: create_snapshot_from_pkg parameters, e.g.
+                         Description, aptly's one by default
+        """
+        kwargs.setdefault('Description', merged_description(sources))
+        return self._run(self._merge_snapshots(name, list(sources), mode, q,
+                                               workers, kwargs))
+
+
+    def _merge_snapshots(self, name, sources, mode, q, workers, kwargs):
+        "Flow of merge_snapshots"
+        params = {'format': 'details'} if q is not None else {}
+        lists = yield Calls([
+            lambda source=source: self.show_snapshot_packages(source,
+                                                              **params)
+            for source in sources], workers)
+        for packages in lists:
+            if is_error(packages):
+                yield Done(packages)
+        msg = yield Call(lambda: self.create_snapshot_from_pkg(
+            Name=name, SourceSnapshots=sources,
+            PackageRefs=merged_packages(lists, mode, q), **kwargs))
+        yield Done(msg)
+
+
+    def filter_snapshot(self, name, source, q, **kwargs):
+        """Create snapshot :name of packages of snapshot :source matching
+        package query :q, like aptly snapshot filter without
+        dependencies. Uses search_snapshot_packages.
+
+        :param name: name of the new snapshot
+        :param source: name of the filtered snapshot
+        :param q: package query, text or PackageQuery
+        :param **kwargs: create_snapshot_from_pkg parameters
+        """
+        kwargs.setdefault('Description', filtered_description(source, q))
+        return self._run(self._filter_snapshot(name, source, q, kwargs))
+
+
+    def _filter_snapshot(self, name, source, q, kwargs):
+        "Flow of filter_snapshot"
+        refs = yield Call(lambda: self._search_snapshot_packages(source, q))
+        if is_error(refs):
+            yield Done(refs)
+        msg = yield Call(lambda: self.create_snapshot_from_pkg(
+            Name=name, SourceSnapshots=[source], PackageRefs=refs,
+            **kwargs))
+        yield Done(msg)
+
+
+    def pull_snapshot(self, name, snapshot, source, queries, remove=True,
+                      all_matches=False, **kwargs):
+        """Create snapshot :name of snapshot :snapshot with packages
+        matching :queries pulled from snapshot :source, like aptly
+        snapshot pull without dependencies.
+
+        :param name: name of the new snapshot
+        :param snapshot: name of the snapshot pulled into
+        :param source: name of the snapshot pulled from
+        :param queries: package queries, e.g. ['nginx (>= 1.6)']
+        :param remove: replace packages with the same name and
+                       architecture
+        :param all_matches: pull all matches, not only the newest ones
+        :param **kwargs: create_snapshot_from_pkg parameters
+        """
+        kwargs.setdefault('Description', pulled_description(
+            snapshot, source, queries))
+        return self._run(self._pull_snapshot(name, snapshot, source,
+                                             list(queries), remove,
+                                             all_matches, kwargs))
+
+
+    def _pull_snapshot(self, name, snapshot, source, queries, remove,
+                       all_matches, kwargs):
+        "Flow of pull_snapshot"
+        refs = yield Call(lambda: self.show_snapshot_packages(snapshot))
+        if is_error(refs):
+            yield Done(refs)
+        matches = []
+        for query in queries:
+            found = yield Call(lambda: self._search_snapshot_packages(
+                source, query))
+            if is_error(found):
+                yield Done(found)
+            matches.append(found)
+        msg = yield Call(lambda: self.create_snapshot_from_pkg(
+            Name=name, SourceSnapshots=[snapshot, source],
+            PackageRefs=pull_refs(refs, pulled_packages(matches,
+                                                        all_matches),
+                                  remove), **kwargs))
+        yield Done(msg)
+
+
     def update_snapshot(self, snap_name, **kwargs):
         """Update snapshot's description or name
 
         :param **kwargs: all parameters allowed by Aptly API
         """
-        data = {}
-        if kwargs:
-            data.update(kwargs)
-
-        headers = dict({'Content-Type': 'application/json'}, **self.headers)
+        self.snapshot_indexes.discard(snap_name)
+        data = kwargs
+        headers = self._json_headers()
         return self._call(
-            '{0}/{1}'.format(self.api_url['snapshots'], snap_name),
+            self._url('snapshot', snap_name),
             'PUT',
             headers=headers,
-            data=json.dumps(data)
+            data=self.codec.dumps(data)
         )
 
 
     def show_snapshot(self, snap_name):
         """Get information about snapshot by name"""
         return self._call(
-            '{0}/{1}'.format(self.api_url['snapshots'], snap_name),
+            self._url('snapshot', snap_name),
             'GET'
         )
 
@@ -483,70 +1228,467 @@ class Aptly(object):
 
         :param **kwargs: all parameters allowed by Aptly API
         """
-        params = {}
-        if kwargs:
-            params.update(kwargs)
-
+        self.snapshot_indexes.discard(snap_name)
+        params = kwargs
         return self._call(
-            '{0}/{1}'.format(self.api_url['snapshots'], snap_name),
+            self._url('snapshot', snap_name),
             'DELETE',
             params=params
         )
 
 
+    def plan_cleanup(self, older_than=None, protect=(), dirs=False,
+                     now=None):
+        """Return CleanupPlan of snapshots and upload directories which
+        are not referenced by published repositories, see CleanupPolicy.
+        The reference graph is built from four listing requests run in
+        parallel.
+
+        :param older_than: min age of deleted snapshots in seconds
+        :param protect: fnmatch patterns of names which are never deleted
+        :param dirs: delete upload directories too; they have no age, so
+                     only when no upload is in progress
+        :param now: current time in seconds since the epoch
+        """
+        return self._run(self._plan_cleanup(older_than, protect, dirs, now))
+
+
+    def _plan_cleanup(self, older_than, protect, dirs, now):
+        "Flow of plan_cleanup"
+        policy = CleanupPolicy(older_than, protect, dirs)
+        listings = yield Calls([
+            lambda: self.get_local_repos,
+            lambda: self.get_snapshots(),
+            lambda: self.get_publish,
+            lambda: self.get_dirs if dirs else []])
+        for listing in listings:
+            if is_error(listing):
+                yield Done(listing)
+        repos, snapshots, published, dirnames = listings
+        yield Done(policy.plan(ReferenceGraph(repos, snapshots, published),
+                               dirnames, now))
+
+
+    def collect_garbage(self, older_than=None, protect=(), dirs=False,
+                        dry_run=False, workers=4, now=None):
+        """Delete snapshots and upload directories which are not
+        referenced by published repositories, see plan_cleanup.
+
+        Snapshots are deleted in waves, snapshots created from another
+        one before it, every wave by :workers threads. A snapshot is
+        skipped if a snapshot created from it failed to be deleted.
+
+        Returns dict of deleted 'Snapshots' and 'Dirs', 'Kept' snapshots
+        with the reason, unreferenced local 'Repos' (never deleted) and
+        'Failed' {name: error}; with dry_run nothing is deleted.
+
+        :param dry_run: only return what would be deleted
+        :param workers: number of parallel delete requests
+        """
+        return self._run(self._collect_garbage(older_than, protect, dirs,
+                                               dry_run, workers, now))
+
+
+    def _collect_garbage(self, older_than, protect, dirs, dry_run, workers,
+                         now):
+        "Flow of collect_garbage"
+        plan = yield Call(lambda: self._plan_cleanup(older_than, protect,
+                                                     dirs, now))
+        if is_error(plan):
+            yield Done(plan)
+        report = plan.report()
+        if dry_run:
+            yield Done(report)
+
+        failed = report[u'Failed']
+        waves = [[('snapshot', name) for name in wave]
+                 for wave in plan.waves] or [[]]
+        waves[0][:0] = [('dir', dirname) for dirname in plan.dirs]
+        for wave in waves:
+            done = yield Calls([lambda item=item: self._collect(item, plan,
+                                                                failed)
+                                for item in wave], workers)
+            failed.update((name, msg) for _, name, msg in done
+                          if msg is not None)
+        report[u'Snapshots'] = [name for name in plan.snapshots
+                                if name not in failed]
+        report[u'Dirs'] = [name for name in plan.dirs if name not in failed]
+        yield Done(report)
+
+
+    def _collect(self, item, plan, failed):
+        "Flow deleting item of collect_garbage, result (kind, name, error)"
+        kind, name = item
+        blockers = [other for other in plan.blockers(name)
+                    if kind == 'snapshot' and other in failed]
+        try:
+            if blockers:
+                msg = {u'error': 'snapshot {0} created from it was not '
+                                 'deleted'.format(blockers[0])}
+            elif kind == 'dir':
+                msg = yield Call(lambda: self.delete_dir(name))
+            else:
+                msg = yield Call(lambda: self.delete_snapshot(name))
+        except Exception as err:
+            msg = {u'error': err}
+        yield Done((kind, name, error_message(msg) if is_error(msg) else None))
+
+
+    def plan_state(self, state):
+        """Return ReconcilePlan of the calls turning the current state
+        into DesiredState :state. The current state is taken from three
+        listing requests run in parallel.
+
+        :param state: DesiredState
+        """
+        return self._run(self._plan_state(state))
+
+
+    def _plan_state(self, state):
+        "Flow of plan_state"
+        listings = yield Calls([
+            lambda: self.get_local_repos,
+            lambda: self.get_snapshots(),
+            lambda: self.get_publish])
+        for listing in listings:
+            if is_error(listing):
+                yield Done(listing)
+        yield Done(state.plan(*listings))
+
+
+    def reconcile(self, state, dry_run=False, workers=4, callback=None):
+        """Bring local repositories, snapshots and published repositories
+        to DesiredState :state with the fewest calls, see plan_state.
+
+        Calls of a wave run in parallel by :workers threads, a call is
+        skipped if a call it depends on failed. When the state is
+        already reached only the listing requests are made.
+
+        Returns dict of 'Actions' (the calls made or planned) and 'Failed'
+        {call: error}.
+
+        :param state: DesiredState
+        :param dry_run: only return the planned calls
+        :param workers: number of parallel calls
+        :param callback: function called with the ReconcilePlan before
+                         any change, e.g. print
+        """
+        return self._run(self._reconcile(state, dry_run, workers, callback))
+
+
+    def _reconcile(self, state, dry_run, workers, callback):
+        "Flow of reconcile"
+        plan = yield Call(lambda: self._plan_state(state))
+        if is_error(plan):
+            yield Done(plan)
+        if callback is not None:
+            callback(plan)
+        report = plan.report()
+        if dry_run:
+            yield Done(report)
+
+        failed = set()
+        for wave in plan.waves:
+            done = yield Calls([lambda action=action: self._apply(action,
+                                                                  failed)
+                                for action in wave], workers)
+            for action, msg in done:
+                if msg is not None:
+                    failed.add(action.key)
+                    report[u'Failed'][repr(action)] = msg
+        yield Done(report)
+
+
+    def _apply(self, action, failed):
+        "Flow running action of reconcile, result (action, error)"
+        blockers = [key for key in action.requires if key in failed]
+        try:
+            if blockers:
+                msg = {u'error': '{0} {1} failed'.format(*blockers[0][:2])}
+            else:
+                msg = yield Call(lambda: getattr(self, action.method)(
+                    *action.args, **dict(action.kwargs)))
+        except Exception as err:
+            msg = {u'error': err}
+        yield Done((action, error_message(msg) if is_error(msg) else None))
+
+
     def show_snapshot_packages(self, snap_name, **kwargs):
         """List all packages in snapshot or perform search on snapshot
         contents and return result.
 
+        With store configured, listings are kept in the store and only
+        the snapshot itself is requested to check its identity.
+
         :param **kwargs: all parameters allowed by Aptly API
         """
-        params = {}
-        if kwargs:
-            params.update(kwargs)
+        params = kwargs
 
+        if self.store is not None:
+            return self._run(self._stored_snapshot_packages(snap_name,
+                                                            params))
         return self._call(
-            '{0}/{1}/packages'.format(self.api_url['snapshots'], snap_name),
+            self._url('snapshot_packages', snap_name),
             'GET',
             params=params
         )
 
 
+    def _stored_snapshot_packages(self, snap_name, params):
+        "Flow of show_snapshot_packages backed by store"
+        snapshot = yield Call(lambda: self.show_snapshot(snap_name))
+        if is_error(snapshot):
+            yield Done(snapshot)
+
+        key = self.store.snapshot_key(snapshot, params)
+        msg = self.store.get('snapshot', key)
+        if msg is None:
+            msg = yield Call(lambda: self._call(
+                self._url('snapshot_packages', snap_name),
+                'GET',
+                params=params
+            ))
+            if not is_error(msg):
+                self.store.put('snapshot', key, msg)
+        yield Done(msg)
+
+
+    def iter_snapshot_packages(self, snap_name, chunk_size=CHUNK_SIZE,
+                               **kwargs):
+        """Same as show_snapshot_packages, but returns an iterator
+        yielding packages one by one while the response is being
+        received. Raises ValueError if aptly responds with an error.
+
+        :param chunk_size: size of chunks read from the network
+        :param **kwargs: all parameters allowed by Aptly API
+        """
+        return self._iter_call(
+            self._url('snapshot_packages', snap_name),
+            chunk_size,
+            params=kwargs
+        )
+
+
+    def search_snapshot_packages(self, snap_name, q, format=None):
+        """Search snapshot by aptly package query :q on the client, e.g.
+        'Name (~ ^python-), $Architecture (amd64), Version (>= 2.0)'.
+
+        Snapshots never change, so 'details' of all packages of the
+        snapshot are requested once and kept as QueryIndex in
+        snapshot_indexes, following searches send no request. Returns
+        package references as show_snapshot_packages(snap_name, q=q)
+        does. Raises ValueError if the query can't be parsed.
+
+        :param snap_name: name of the snapshot
+        :param q: package query, text or PackageQuery
+        :param format: 'details' to return 'details' dicts
+        """
+        return self._run(self._search_snapshot_packages(snap_name, q, format))
+
+
+    def _search_snapshot_packages(self, snap_name, q, format=None):
+        "Flow of search_snapshot_packages"
+        query = compile_query(q)
+        index = self.snapshot_indexes.get(snap_name)
+        if index is None:
+            packages = yield Call(lambda: self.show_snapshot_packages(
+                snap_name, format='details'))
+            if is_error(packages):
+                yield Done(packages)
+            index = QueryIndex(packages)
+            self.snapshot_indexes.set(snap_name, index)
+        yield Done(index.search(query, details=format == 'details'))
+
+
     def snapshots_diff(self, snapshot1, snapshot2):
         """Calculate difference between two snapshots :snapshot1 (left)
         and :snapshot2 (right).
         """
         return self._call(
-            '{0}/{1}/diff/{2}'.format(self.api_url['snapshots'],
-                                      snapshot1, snapshot2),
+            self._url('snapshots_diff', snapshot1, snapshot2),
+            'GET'
+        )
+
+
+    @property
+    def get_tasks(self):
+        """List background tasks. Calls made with _async=True return
+        a task instead of waiting for the result
+        """
+        return self._call(
+            self._url('tasks'),
             'GET'
         )
 
 
+    def show_task(self, task):
+        """Return task state
+
+        :param task: task or task ID
+        """
+        return self._call(
+            self._url('task', task_id(task)),
+            'GET'
+        )
+
+
+    def wait_task(self, task):
+        """Wait on the server until task finishes, return the task
+
+        :param task: task or task ID
+        """
+        return self._call(
+            self._url('task_wait', task_id(task)),
+            'GET'
+        )
+
+
+    def task_output(self, task):
+        """Return output of task
+
+        :param task: task or task ID
+        """
+        return self._call(
+            self._url('task_output', task_id(task)),
+            'GET'
+        )
+
+
+    def task_detail(self, task):
+        """Return details of task, e.g. report of package import
+
+        :param task: task or task ID
+        """
+        return self._call(
+            self._url('task_detail', task_id(task)),
+            'GET'
+        )
+
+
+    def task_return_value(self, task):
+        """Return value the call would have returned if run synchronously
+
+        :param task: task or task ID
+        """
+        return self._call(
+            self._url('task_return_value', task_id(task)),
+            'GET'
+        )
+
+
+    def delete_task(self, task):
+        """Delete finished task
+
+        :param task: task or task ID
+        """
+        return self._call(
+            self._url('task', task_id(task)),
+            'DELETE'
+        )
+
+
+    def clear_tasks(self):
+        """Delete all finished tasks"""
+        return self._call(
+            self._url('tasks_clear'),
+            'POST'
+        )
+
+
+    def wait_tasks(self, tasks, timeout=None, interval=0.1, max_interval=5):
+        """Wait until all tasks finish.
+
+        All tasks are polled together with a single task listing call
+        per round. The delay between rounds starts at :interval and
+        grows up to :max_interval while nothing finishes.
+
+        Returns list of tasks in the same order, with final State unless
+        timeout expired. Returns error response if tasks can't be listed.
+
+        :param tasks: list of tasks or task IDs
+        :param timeout: max seconds to wait, None to wait forever
+        :param interval: initial delay between polls in seconds
+        :param max_interval: max delay between polls in seconds
+        """
+        return self._run(self._wait_tasks(tasks, timeout, interval,
+                                          max_interval))
+
+
+    def _wait_tasks(self, tasks, timeout, interval, max_interval):
+        "Flow of wait_tasks"
+        ids = [task_id(task) for task in tasks]
+        deadline = None if timeout is None else time.time() + timeout
+        delay = interval
+        states = {}
+        while True:
+            listing = yield Call(lambda: self.get_tasks)
+            if is_error(listing):
+                yield Done(listing)
+            finished = update_tasks(ids, listing, states)
+            if all(task['State'] > TASK_RUNNING for task in states.values()):
+                break
+            if deadline is not None and time.time() >= deadline:
+                break
+            delay = interval if finished else min(delay * 1.5, max_interval)
+            if deadline is not None:
+                delay = min(delay, max(deadline - time.time(), 0))
+            yield Sleep(delay)
+
+        if self.cache is not None:
+            # tasks changed state behind the back of the cache
+            self.cache.invalidate()
+        yield Done([states[num] for num in ids])
+
+
     @property
     def aptly_version(self):
         """Return current aptly version"""
         return self._call(
-            '{0}/version'.format(self.api),
+            self._url('version'),
             'GET'
         )
 
 
-    def get_graph(self, path='', ext='png'):
+    def get_graph(self, path='', ext='png', fileobj=None, in_memory=False,
+                  chunk_size=CHUNK_SIZE):
         """Generate graph of aptly objects (same as in aptly graph
         command).
 
-        :param path: file path for graph
+        The graph is streamed over a pooled connection in chunks of
+        :chunk_size bytes into a file at :path, into :fileobj or, with
+        :in_memory, into a single buffer. Returns dict with 'Size' in
+        bytes and download 'Time' in seconds, and 'Path' or 'Content',
+        a memoryview of the graph (call tobytes() for bytes).
+
+        :param path: file path for graph, graph.<ext> by default
         :param ext: specifies desired file extension, e.g. .png, .svg.
+        :param fileobj: writable binary file object to write graph to
+        :param in_memory: return graph instead of writing it
+        :param chunk_size: max size of a chunk read from the network
         """
-        path = path if path else 'graph.' + ext
-        request = requests.get('{0}/graph.{1}'.format(self.api, ext),
-                               headers=self.headers,
-                               auth=self.auth,
-                               timeout=self.timeout,
-                               verify=self.verify_ssl)
-        if request.status_code == 200:
-            with open(path, 'wb') as file_pointer:
-                for chunk in request:
-                    file_pointer.write(chunk)
+        start = time.time()
+        request = self._request(self._url('graph', ext), 'GET',
+                                stream=True)
+        try:
+            if request.status_code != 200:
+                return self._graph_error(request)
+            sink = GraphSink(path or 'graph.' + ext, fileobj, in_memory,
+                             request.headers.get('Content-Length'))
+            with sink:
+                for chunk in request.iter_content(chunk_size):
+                    sink.write(chunk)
+            if self.metrics is not None:
+                self.metrics.add_received('graph.' + ext, 'GET', sink.size)
+            return sink.report(start)
+        finally:
+            request.close()
+
+
+    @staticmethod
+    def _graph_error(request):
+        "Return error response of failed graph download"
+        msg = response(request)
+        if not is_error(msg):
+            msg = {u'error': 'HTTP {0}'.format(request.status_code)}
+        return msg
 
-        return {'Path': path}
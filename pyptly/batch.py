@@ -0,0 +1,189 @@
+"""
+pyptly.batch
+------------
+
+Coalescing writer of local repository package lists
+"""
+from collections import OrderedDict
+from pyptly.utils import is_error, error_message
+from pyptly.index import parse_ref
+from pyptly.flow import Call, Done
+
+ADD = 'add'
+REMOVE = 'remove'
+
+
+class RepoBatch(object):
+    """Collect package additions and removals of a local repository and
+    send them with as few requests as possible::
+
+        with api.batch('stable') as batch:
+            for ref in promoted:
+                batch.add(ref)
+            for ref in obsolete:
+                batch.remove(ref)
+        batch.result
+
+    A batch is a change set against the current repo contents: adding a
+    ref and removing it again (or the other way round) cancels out and
+    sends nothing. Removals are sent before additions, so a new version
+    of a package does not conflict with the old one, in chunks of at
+    most batch_size refs. A chunk rejected because of a package (the
+    error names a ref or a name_version_arch of the chunk) is bisected
+    down to the offending refs, the rest of it is still applied; any
+    other error, e.g. a missing repo, fails the whole chunk at once.
+
+    Nothing is sent if the with block raises.
+
+    :param api: Aptly object
+    :param repo: name of the local repository
+    :param batch_size: max number of refs per request
+    """
+
+    def __init__(self, api, repo, batch_size=1000):
+        if batch_size < 1:
+            raise ValueError('batch_size must be positive')
+        self.api = api
+        self.repo = repo
+        self.batch_size = batch_size
+        self.result = None
+        self._pending = OrderedDict()
+
+
+    def __len__(self):
+        return len(self._pending)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+
+    def _change(self, ref, action):
+        if isinstance(ref, dict):
+            ref = ref['Key']
+        if self._pending.get(ref, action) != action:
+            del self._pending[ref]
+        else:
+            self._pending[ref] = action
+
+
+    def add(self, ref):
+        """Add package reference or 'details' dict to the repo"""
+        self._change(ref, ADD)
+
+
+    def remove(self, ref):
+        """Remove package reference or 'details' dict from the repo"""
+        self._change(ref, REMOVE)
+
+
+    def update(self, add=(), remove=()):
+        """Queue many additions and removals"""
+        for ref in add:
+            self.add(ref)
+        for ref in remove:
+            self.remove(ref)
+
+
+    def discard(self):
+        """Forget pending changes"""
+        self._pending.clear()
+
+
+    def _chunks(self):
+        "Take pending changes, return [(action, refs)] in send order"
+        pending, self._pending = self._pending, OrderedDict()
+        chunks = []
+        for action in (REMOVE, ADD):
+            refs = [ref for ref, act in pending.items() if act == action]
+            chunks.extend((action, refs[pos:pos + self.batch_size])
+                          for pos in range(0, len(refs), self.batch_size))
+        return chunks
+
+
+    def _call(self, action, refs):
+        "Send one request"
+        if action == ADD:
+            return self.api.add_pkg_bykey(self.repo, PackageRefs=refs)
+        return self.api.delete_pkg_bykey(self.repo, PackageRefs=refs)
+
+
+    @staticmethod
+    def _new_report():
+        "Return empty report of applied and failed refs"
+        return {REMOVE: [], ADD: [], 'failed': OrderedDict()}
+
+
+    @staticmethod
+    def _package_error(text, refs):
+        "Check if error message is about packages of refs"
+        text = u'{0}'.format(text)
+        for ref in refs:
+            if ref in text:
+                return True
+            try:
+                arch, name, version, _ = parse_ref(ref)
+            except ValueError:
+                continue
+            # aptly names conflicting packages name_version_arch
+            if u'{0}_{1}_{2}'.format(name, version, arch) in text:
+                return True
+        return False
+
+
+    @classmethod
+    def _record(cls, action, refs, msg, stack, report):
+        "Update report with response, queue halves of a rejected chunk"
+        if not is_error(msg):
+            report[action].extend(refs)
+            return
+        text = error_message(msg)
+        if len(refs) == 1 or not cls._package_error(text, refs):
+            for ref in refs:
+                report['failed'][ref] = text
+        else:
+            half = len(refs) // 2
+            # stack is LIFO, keep the original order of refs
+            stack.append(refs[half:])
+            stack.append(refs[:half])
+
+
+    @staticmethod
+    def _report(report):
+        "Build result of flush"
+        result = {u'Removed': report[REMOVE], u'Added': report[ADD]}
+        if report['failed']:
+            result[u'error'] = 'failed to apply {0} package refs'.format(
+                len(report['failed']))
+            result[u'FailedRefs'] = report['failed']
+        return result
+
+
+    def flush(self):
+        """Send pending changes.
+
+        Returns dict with 'Removed' and 'Added' lists of applied refs.
+        If aptly rejected some refs, it has an 'error' key as well and
+        'FailedRefs', a dict of rejected refs and aptly error messages.
+        """
+        return self.api._run(self._flush())
+
+
+    def _flush(self):
+        "Flow of flush, bisects a rejected chunk down to the failed refs"
+        report = self._new_report()
+        for action, refs in self._chunks():
+            stack = [refs]
+            while stack:
+                refs = stack.pop()
+                msg = yield Call(lambda: self._call(action, refs))
+                self._record(action, refs, msg, stack, report)
+        self.result = self._report(report)
+        yield Done(self.result)
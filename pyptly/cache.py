@@ -0,0 +1,224 @@
+"""
+pyptly.cache
+------------
+
+Response cache for read-only API calls
+"""
+import time
+import threading
+from collections import OrderedDict
+
+# mutating an endpoint changes the listed ones as well, e.g. creating
+# a snapshot from a repo or importing uploaded files into a repo
+INVALIDATES = {'repos': ('repos', 'snapshots', 'files', 'publish'),
+               'snapshots': ('snapshots', 'publish'),
+               'publish': ('publish',),
+               'files': ('files',),
+               'tasks': ('tasks',),
+               'tasks-clear': ('tasks',)}
+
+# these reflect running operations and must always be fresh, every
+# tasks/... call (e.g. tasks/{id}/wait) has endpoint 'tasks'
+UNCACHED = frozenset(['tasks'])
+
+
+class CacheEntry(object):
+    "Cached response body"
+    __slots__ = ('endpoint', 'content', 'expires', 'validators')
+
+    def __init__(self, endpoint, content, expires, validators):
+        self.endpoint = endpoint
+        self.content = content
+        self.expires = expires
+        self.validators = validators
+
+
+class ResponseCache(object):
+    """LRU cache of GET responses with per-endpoint TTL.
+
+    Pass it to Aptly(cache=...) to serve repeated GET calls without a
+    round-trip. Any POST/PUT/DELETE call drops cached responses of the
+    endpoints it may change (see INVALIDATES). Stale entries which came
+    with ETag or Last-Modified headers are revalidated with a
+    conditional request instead of being downloaded again.
+
+    Endpoints are named by the first path component after /api, e.g.
+    'repos', 'snapshots', 'publish', 'files', 'packages', 'version'::
+
+        cache = ResponseCache(ttl={'version': 3600, 'files': 0})
+        api = Aptly('http://127.0.0.1:8080', cache=cache)
+
+    :param default_ttl: seconds a response stays fresh
+    :param ttl: dict of per-endpoint TTLs, 0 disables caching
+    :param max_entries: max number of cached responses
+    """
+
+    def __init__(self, default_ttl=5, ttl=None, max_entries=1024):
+        self.default_ttl = default_ttl
+        self.ttl = dict(ttl or {})
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    @staticmethod
+    def key(url, params=None):
+        """Return cache key of request"""
+        if not params:
+            return url
+        return url, tuple(sorted((key, str(value))
+                                 for key, value in params.items()))
+
+
+    def enabled(self, endpoint):
+        """Check if responses of endpoint are cached at all"""
+        if endpoint in UNCACHED:
+            return False
+        return self.ttl.get(endpoint, self.default_ttl) > 0
+
+
+    def get(self, key):
+        """Return CacheEntry, fresh or not, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires > time.time():
+                self._entries[key] = self._entries.pop(key)
+                self.hits += 1
+            elif entry.validators:
+                self.revalidations += 1
+            else:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            return entry
+
+
+    def store(self, key, endpoint, content, headers):
+        """Cache response body
+
+        :param headers: response headers
+        """
+        validators = {}
+        if headers.get('ETag'):
+            validators['If-None-Match'] = headers['ETag']
+        if headers.get('Last-Modified'):
+            validators['If-Modified-Since'] = headers['Last-Modified']
+
+        expires = time.time() + self.ttl.get(endpoint, self.default_ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = CacheEntry(endpoint, content, expires,
+                                            validators)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+    def refresh(self, key):
+        """Mark entry fresh again after successful revalidation"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.expires = time.time() + self.ttl.get(entry.endpoint,
+                                                           self.default_ttl)
+                self._entries[key] = self._entries.pop(key)
+
+
+    def invalidate(self, endpoint=None):
+        """Drop entries affected by a change of endpoint, all entries
+        if endpoint is None or unknown
+        """
+        affected = INVALIDATES.get(endpoint)
+        with self._lock:
+            if affected is None:
+                dropped = list(self._entries)
+            else:
+                dropped = [key for key, entry in self._entries.items()
+                           if entry.endpoint in affected]
+            for key in dropped:
+                del self._entries[key]
+            self.invalidations += len(dropped)
+
+
+    def clear(self):
+        """Drop all entries"""
+        self.invalidate()
+
+
+    def stats(self):
+        """Return dict of hit/miss statistics"""
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries)}
+
+
+class Memo(object):
+    """Thread-safe mapping for results which never change, optionally
+    bounded in size with LRU eviction
+
+    :param max_entries: max number of entries, None for unbounded
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+    def get(self, key):
+        """Return value or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if self.max_entries is not None:
+                    self._entries[key] = self._entries.pop(key)
+            return value
+
+
+    def set(self, key, value):
+        """Remember value"""
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if self.max_entries is not None:
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+
+    def discard(self, key):
+        """Forget value of key, if any"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+    def clear(self):
+        """Forget everything"""
+        with self._lock:
+            self._entries.clear()
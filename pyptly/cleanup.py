@@ -0,0 +1,274 @@
+"""
+pyptly.cleanup
+--------------
+
+Garbage collection planning: which snapshots and upload directories are
+no longer referenced by published repositories, in which order they
+can be deleted
+"""
+import re
+import time
+import fnmatch
+import calendar
+from collections import OrderedDict
+
+# descriptions aptly gives to snapshots, the only lineage the API shows
+_MERGED_RE = re.compile(r"^Merged from sources: (.*)$")
+_PULLED_RE = re.compile(r"^Pulled into '(.*?)' with '(.*?)' as source, ")
+_FILTERED_RE = re.compile(r"^Filtered '(.*?)', query was: ")
+_REPO_RE = re.compile(r"^Snapshot from local repo \[(.*?)\]")
+_QUOTED_RE = re.compile(r"'(.*?)'(?:, |$)")
+_TIME_RE = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)'
+                      r'(?:\.\d+)?(Z|([+-])(\d\d):(\d\d))$')
+
+
+def merged_description(sources):
+    """Description aptly snapshot merge gives to a snapshot"""
+    return 'Merged from sources: {0}'.format(
+        ', '.join("'{0}'".format(source) for source in sources))
+
+
+def pulled_description(snapshot, source, queries):
+    """Description aptly snapshot pull gives to a snapshot"""
+    return "Pulled into '{0}' with '{1}' as source, pull request was: " \
+        "'{2}'".format(snapshot, source, ' '.join(queries))
+
+
+def filtered_description(source, q):
+    """Description aptly snapshot filter gives to a snapshot"""
+    return "Filtered '{0}', query was: '{1}'".format(source, q)
+
+
+def snapshot_sources(snapshot):
+    """Return (source snapshots, source repos) of snapshot, parsed from
+    its aptly Description
+
+    :param snapshot: snapshot dict as returned by get_snapshots
+    """
+    description = snapshot.get('Description') or ''
+    match = _MERGED_RE.match(description)
+    if match:
+        return _QUOTED_RE.findall(match.group(1)), []
+    match = _PULLED_RE.match(description)
+    if match:
+        return list(match.groups()), []
+    match = _FILTERED_RE.match(description)
+    if match:
+        return [match.group(1)], []
+    match = _REPO_RE.match(description)
+    if match:
+        return [], [match.group(1)]
+    return [], []
+
+
+def created_at(text):
+    """Return seconds since the epoch of an aptly CreatedAt timestamp,
+    None if it can't be parsed
+    """
+    match = _TIME_RE.match(text or '')
+    if match is None:
+        return None
+    seconds = calendar.timegm(tuple(int(part)
+                                    for part in match.groups()[:6]))
+    if match.group(8):
+        offset = int(match.group(9)) * 3600 + int(match.group(10)) * 60
+        seconds -= offset if match.group(8) == '+' else -offset
+    return seconds
+
+
+class ReferenceGraph(object):
+    """References between published repositories, snapshots and local
+    repositories, built from bulk listings
+
+    :param repos: result of get_local_repos
+    :param snapshots: result of get_snapshots
+    :param published: result of get_publish
+    """
+
+    def __init__(self, repos, snapshots, published):
+        self.repos = [repo['Name'] for repo in repos]
+        self.snapshots = OrderedDict((snapshot['Name'], snapshot)
+                                     for snapshot in snapshots)
+        self.sources = {}
+        self.source_repos = {}
+        self.derived = dict((name, []) for name in self.snapshots)
+        for name, snapshot in self.snapshots.items():
+            sources, source_repos = snapshot_sources(snapshot)
+            # sources may have been deleted with force
+            sources = [source for source in sources
+                       if source in self.snapshots]
+            self.sources[name] = sources
+            self.source_repos[name] = source_repos
+            for source in sources:
+                self.derived[source].append(name)
+
+        self.published = set()
+        self.published_repos = set()
+        for publish in published:
+            names = [source['Name'] for source in publish.get('Sources', ())]
+            if publish.get('SourceKind') == 'snapshot':
+                self.published.update(names)
+            else:
+                self.published_repos.update(names)
+
+
+    def ancestors(self, names):
+        """Return set of snapshots :names and all snapshots they were
+        created from
+        """
+        found = set()
+        pending = [name for name in names if name in self.snapshots]
+        while pending:
+            name = pending.pop()
+            if name not in found:
+                found.add(name)
+                pending.extend(self.sources[name])
+        return found
+
+
+class CleanupPlan(object):
+    """Snapshots and upload directories to delete.
+
+    Snapshots are split in waves: every snapshot is in a later wave
+    than the snapshots created from it, snapshots of a wave can be
+    deleted in parallel.
+    """
+
+    def __init__(self, waves, dirs, kept, repos, derived):
+        self.waves = waves
+        self.dirs = dirs
+        self.kept = kept
+        self.repos = repos
+        self.derived = derived
+
+
+    def __len__(self):
+        return len(self.snapshots) + len(self.dirs)
+
+
+    @property
+    def snapshots(self):
+        """Snapshots to delete in deletion order"""
+        return [name for wave in self.waves for name in wave]
+
+
+    def blockers(self, name):
+        """Return planned snapshots created from snapshot :name"""
+        return self.derived.get(name, [])
+
+
+    def report(self):
+        """Return dry run report: 'Snapshots' and 'Dirs' to delete,
+        'Kept' snapshots with the reason, 'Repos' not referenced by any
+        publish or kept snapshot (never deleted)
+        """
+        return {u'Snapshots': self.snapshots, u'Dirs': list(self.dirs),
+                u'Kept': dict(self.kept), u'Repos': list(self.repos),
+                u'Failed': {}}
+
+
+class CleanupPolicy(object):
+    """Rules deciding which snapshots and upload directories are garbage.
+
+    Published snapshots, snapshots matching :protect and, with
+    :older_than, snapshots created less than :older_than seconds ago
+    (or at an unknown time) are kept, and so are all snapshots they were
+    created from. The rest is deleted. Upload directories are deleted
+    only with :dirs, unless they match :protect: aptly doesn't tell
+    their age, so a directory another client is uploading to right now
+    would be deleted as well, :older_than doesn't apply to them.
+
+    Lineage of snapshots is read from the descriptions aptly gives to
+    merged, pulled and filtered snapshots, deleting a source of a
+    snapshot with a custom description fails unless the snapshot is
+    deleted as well.
+
+        policy = CleanupPolicy(older_than=30 * 86400, protect=['release-*'])
+        policy.plan(graph, api.get_dirs)
+
+    :param older_than: min age of deleted snapshots in seconds, None
+                       for any age
+    :param protect: fnmatch patterns of snapshot and directory names
+                    which are never deleted
+    :param dirs: delete upload directories, of any age
+    """
+
+    def __init__(self, older_than=None, protect=(), dirs=False):
+        if older_than is not None and older_than < 0:
+            raise ValueError('older_than must not be negative')
+        self.older_than = older_than
+        self.protect = tuple(protect)
+        self.dirs = dirs
+
+
+    def protected(self, name):
+        """Check if name matches one of the protect patterns"""
+        return any(fnmatch.fnmatchcase(name, pattern)
+                   for pattern in self.protect)
+
+
+    def _reason(self, graph, name, cutoff):
+        "Reason to keep snapshot :name for its own sake, None if there is none"
+        if name in graph.published:
+            return 'published'
+        if self.protected(name):
+            return 'protected'
+        if cutoff is not None:
+            created = created_at(graph.snapshots[name].get('CreatedAt'))
+            if created is None:
+                return 'unknown age'
+            if created > cutoff:
+                return 'recent'
+        return None
+
+
+    def plan(self, graph, dirs=(), now=None):
+        """Return CleanupPlan
+
+        :param graph: ReferenceGraph
+        :param dirs: result of get_dirs
+        :param now: current time in seconds since the epoch
+        """
+        cutoff = None
+        if self.older_than is not None:
+            cutoff = (time.time() if now is None else now) - self.older_than
+
+        kept = OrderedDict()
+        for name in graph.snapshots:
+            reason = self._reason(graph, name, cutoff)
+            if reason is not None:
+                kept[name] = reason
+        for name in graph.ancestors(list(kept)):
+            kept.setdefault(name, 'source of kept snapshot')
+        doomed = [name for name in graph.snapshots if name not in kept]
+
+        # depth of a snapshot is the longest chain of planned snapshots
+        # created from it
+        derived = dict((name, [other for other in graph.derived[name]
+                               if other not in kept]) for name in doomed)
+        depths = {}
+        for name in doomed:
+            self._depth(name, derived, depths, set())
+        waves = [[] for _ in range(max(depths.values() or [-1]) + 1)]
+        for name in doomed:
+            waves[depths[name]].append(name)
+
+        used_repos = set(graph.published_repos)
+        for name in kept:
+            used_repos.update(graph.source_repos[name])
+        repos = [repo for repo in graph.repos if repo not in used_repos]
+        dirs = [dirname for dirname in (dirs if self.dirs else ())
+                if not self.protected(dirname)]
+        return CleanupPlan(waves, dirs, kept, repos, derived)
+
+
+    def _depth(self, name, derived, depths, visiting):
+        "Compute depth of snapshot :name and the ones created from it"
+        if name not in depths:
+            # a cycle can only come from odd descriptions, cut it
+            visiting.add(name)
+            depths[name] = 1 + max([self._depth(other, derived, depths,
+                                                visiting)
+                                    for other in derived[name]
+                                    if other not in visiting] or [-1])
+        return depths[name]
@@ -0,0 +1,96 @@
+"""
+pyptly.codec
+------------
+
+JSON codecs: request bodies are encoded to bytes and responses are
+decoded straight from bytes by the fastest library installed
+"""
+import json
+import sys
+
+# tried in this order when no codec is requested
+PREFERRED = ('orjson', 'ujson', 'simdjson', 'json')
+
+
+class JSONCodec(object):
+    """JSON encoder and decoder working with bytes
+
+    :param name: codec name
+    :param dumps: function serializing object to bytes
+    :param loads: function parsing bytes, raising ValueError on errors
+    """
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+    def __repr__(self):
+        return '<JSONCodec {0}>'.format(self.name)
+
+
+def _stdlib():
+    "Codec of the json module"
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    if sys.version_info >= (3, 6) or sys.version_info < (3,):
+        # json.loads accepts bytes (python 2 str is bytes)
+        loads = json.loads
+    else:
+        def loads(content):
+            return json.loads(content.decode('utf-8'))
+    return JSONCodec('json', dumps, loads)
+
+
+def _orjson():
+    "Codec of orjson, bytes in and out natively"
+    import orjson
+    return JSONCodec('orjson', orjson.dumps, orjson.loads)
+
+
+def _ujson():
+    "Codec of ujson"
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=False,
+                           escape_forward_slashes=False).encode('utf-8')
+    return JSONCodec('ujson', dumps, ujson.loads)
+
+
+def _simdjson():
+    "Codec of pysimdjson, decoding only, encoding falls back to stdlib"
+    import simdjson
+    return JSONCodec('simdjson', _stdlib().dumps, simdjson.loads)
+
+
+_FACTORIES = {'json': _stdlib, 'orjson': _orjson, 'ujson': _ujson,
+              'simdjson': _simdjson}
+_CODECS = {}
+
+
+def get_codec(codec=None):
+    """Return JSONCodec by name, the codec itself if it is a JSONCodec,
+    or the first installed codec of PREFERRED for None.
+
+    Raises ValueError for an unknown name, ImportError if the library
+    of the codec is not installed.
+    """
+    if isinstance(codec, JSONCodec):
+        return codec
+    if codec is None:
+        for name in PREFERRED:
+            try:
+                return get_codec(name)
+            except ImportError:
+                continue
+    if codec not in _FACTORIES:
+        raise ValueError('unknown JSON codec: {0!r}'.format(codec))
+    if codec not in _CODECS:
+        _CODECS[codec] = _FACTORIES[codec]()
+    return _CODECS[codec]
+
+
+STDLIB = get_codec('json')
@@ -0,0 +1,135 @@
+"""
+pyptly.compose
+--------------
+
+Client side composition of snapshot package lists, same rules as aptly
+snapshot merge, filter and pull
+"""
+from collections import OrderedDict
+from pyptly.index import parse_ref
+from pyptly.version import version_ranks
+from pyptly.query import QueryIndex, matches_architecture
+
+# merge modes: packages of the last (aptly default) or the first source
+# having a package name and architecture win, or the latest version of
+# every package wins, or all packages are kept
+MERGE_MODES = ('last', 'first', 'latest', 'all')
+
+
+def _key(ref):
+    "Package reference of 'details' dict"
+    return ref['Key'] if isinstance(ref, dict) else ref
+
+
+def _groups(refs):
+    "Return OrderedDict {(name, arch): [refs]} of package references"
+    groups = OrderedDict()
+    for ref in refs:
+        ref = _key(ref)
+        arch, name, _, _ = parse_ref(ref)
+        groups.setdefault((name, arch), []).append(ref)
+    return groups
+
+
+def _unique(refs):
+    "Drop duplicate references, keep order"
+    return list(OrderedDict.fromkeys(refs))
+
+
+def newest(refs):
+    """Return the newest package of every name and architecture"""
+    groups = _groups(refs)
+    ranks = version_ranks([parse_ref(ref)[2]
+                           for group in groups.values() for ref in group])
+    result = []
+    for group in groups.values():
+        best = group[0]
+        for ref in group[1:]:
+            # later references win ties
+            if ranks[parse_ref(ref)[2]] >= ranks[parse_ref(best)[2]]:
+                best = ref
+        result.append(best)
+    return result
+
+
+def merge_refs(sources, mode='last'):
+    """Merge package lists like aptly snapshot merge.
+
+    :param sources: lists of package references or 'details' dicts
+    :param mode: one of MERGE_MODES
+    """
+    if mode not in MERGE_MODES:
+        raise ValueError('unknown merge mode: {0!r}'.format(mode))
+    sources = [[_key(ref) for ref in refs] for refs in sources]
+    if mode == 'all':
+        return _unique(ref for refs in sources for ref in refs)
+    if mode == 'latest':
+        return newest(ref for refs in sources for ref in refs)
+
+    if mode == 'last':
+        sources = reversed(sources)
+    merged = OrderedDict()
+    for refs in sources:
+        for group, group_refs in _groups(refs).items():
+            if group not in merged:
+                merged[group] = group_refs
+    return _unique(ref for refs in merged.values() for ref in refs)
+
+
+def filter_refs(refs, q):
+    """Return package references matching aptly query :q, fields other
+    than name, version and architecture need 'details' dicts
+
+    :param refs: package references or 'details' dicts
+    :param q: package query, text or PackageQuery
+    """
+    return QueryIndex(refs).search(q)
+
+
+def merged_packages(sources, mode='last', q=None):
+    """merge_refs, then keep packages matching query :q, if any; sources
+    should be 'details' lists for queries on other fields than name,
+    version and architecture
+    """
+    refs = merge_refs(sources, mode)
+    if q is None:
+        return refs
+    details = dict((package['Key'], package)
+                   for packages in sources for package in packages
+                   if isinstance(package, dict))
+    return filter_refs([details.get(ref, ref) for ref in refs], q)
+
+
+def pulled_packages(matches, all_matches=False):
+    """Return packages pulled by aptly snapshot pull: the newest match of
+    every query per name and architecture, or all matches
+
+    :param matches: lists of package references matching every query
+    :param all_matches: pull all matches, not only the newest ones
+    """
+    if all_matches:
+        return _unique(_key(ref) for refs in matches for ref in refs)
+    return _unique(ref for refs in matches for ref in newest(refs))
+
+
+def pull_refs(refs, pulled, remove=True):
+    """Add packages to a package list like aptly snapshot pull: packages
+    of the list with the name of a pulled one and a matching
+    architecture ('all' ones match every architecture) are replaced
+    unless :remove is False
+
+    :param refs: package references or 'details' dicts
+    :param pulled: package references or 'details' dicts to add
+    :param remove: replace packages with the same name and architecture
+    """
+    pulled = _groups(pulled)
+    archs = {}
+    for name, arch in pulled:
+        archs.setdefault(name, []).append(arch)
+    result = []
+    for (name, arch), group_refs in _groups(refs).items():
+        if not remove or not any(matches_architecture(arch, pulled_arch)
+                                 for pulled_arch in archs.get(name, ())):
+            result.extend(group_refs)
+    result.extend(ref for group_refs in pulled.values() for ref in group_refs)
+    return _unique(result)
@@ -0,0 +1,159 @@
+"""
+pyptly.deb
+----------
+
+Offline inspection of .deb files: control fields and aptly package keys
+"""
+import io
+import os
+import struct
+import tarfile
+import multiprocessing
+from pyptly.hashes import file_checksums
+from pyptly.index import format_ref
+
+AR_MAGIC = b'!<arch>\n'
+AR_HEADER_SIZE = 60
+# control members are small, refuse to buffer anything bigger
+MAX_CONTROL_SIZE = 16 * 1024 * 1024
+
+FNV64_OFFSET = 0xcbf29ce484222325
+FNV64_PRIME = 0x100000001b3
+FNV64_MASK = 0xffffffffffffffff
+
+
+def _ar_members(file_pointer):
+    """Iterate over (name, size) of ar archive members, the file is
+    positioned at the start of member data on every step. Data which is
+    not read is skipped without reading it.
+    """
+    if file_pointer.read(len(AR_MAGIC)) != AR_MAGIC:
+        raise ValueError('not an ar archive')
+    offset = len(AR_MAGIC)
+    while True:
+        file_pointer.seek(offset)
+        header = file_pointer.read(AR_HEADER_SIZE)
+        if not header:
+            return
+        if len(header) < AR_HEADER_SIZE or header[58:60] != b'`\n':
+            raise ValueError('malformed ar member header')
+        name = header[:16].decode('ascii').strip().rstrip('/')
+        size = int(header[48:58].decode('ascii').strip())
+        yield name, size
+        # members are aligned to 2 bytes
+        offset += AR_HEADER_SIZE + size + size % 2
+
+
+def parse_control(text):
+    """Parse control stanza into an ordered list of (field, value),
+    continuation lines are kept with newlines as aptly does
+    """
+    fields = []
+    for line in text.splitlines():
+        if not line.strip():
+            if fields:
+                break
+            continue
+        if line[0] in ' \t':
+            if not fields:
+                raise ValueError('continuation line without a field')
+            field, value = fields[-1]
+            fields[-1] = (field, value + '\n' + line)
+            continue
+        field, sep, value = line.partition(':')
+        if not sep:
+            raise ValueError('malformed control line: {0!r}'.format(line))
+        fields.append((field.strip(), value.strip()))
+    return fields
+
+
+def read_control(path):
+    """Return dict of control fields of .deb package.
+
+    Only the ar headers and the control member are read, the data member
+    is skipped.
+    """
+    with io.open(path, 'rb') as file_pointer:
+        for name, size in _ar_members(file_pointer):
+            if not name.startswith('control.tar'):
+                continue
+            if size > MAX_CONTROL_SIZE:
+                raise ValueError('control member is too big')
+            member = io.BytesIO(file_pointer.read(size))
+            with tarfile.open(fileobj=member, mode='r:*') as tar:
+                for info in tar:
+                    if info.name in ('control', './control'):
+                        text = tar.extractfile(info).read().decode('utf-8')
+                        return dict(parse_control(text))
+            raise ValueError('no control file in control member')
+    raise ValueError('no control member in {0}'.format(path))
+
+
+def files_hash(files):
+    """Return aptly FilesHash (FNV-1a 64 bit) of package files
+
+    :param files: list of (filename, checksums) pairs, checksums as
+                  returned by file_checksums
+    """
+    value = FNV64_OFFSET
+    for filename, checksums in sorted(files, key=lambda item: item[0]):
+        data = b''.join([filename.encode('utf-8'),
+                         struct.pack('>q', checksums['Size']),
+                         checksums['MD5sum'].encode('ascii'),
+                         checksums['SHA1'].encode('ascii'),
+                         checksums['SHA256'].encode('ascii')])
+        for byte in bytearray(data):
+            value = ((value ^ byte) * FNV64_PRIME) & FNV64_MASK
+    return value
+
+
+def inspect_deb(path, checksums=None):
+    """Return package details of .deb file as aptly would show them
+    after upload and import: control fields, Key, FilesHash, Filename,
+    Size, MD5sum, SHA1 and SHA256.
+
+    :param path: .deb file path
+    :param checksums: precomputed file_checksums(path)
+    """
+    control = read_control(path)
+    if checksums is None:
+        checksums = file_checksums(path)
+    filename = os.path.basename(path)
+    fileshash = files_hash([(filename, checksums)])
+
+    details = dict(control)
+    details.update(checksums)
+    details['Filename'] = filename
+    details['FilesHash'] = '{0:08x}'.format(fileshash)
+    details['Key'] = format_ref(control['Architecture'], control['Package'],
+                                control['Version'], fileshash)
+    return details
+
+
+def _inspect(path):
+    "inspect_deb for pool workers, errors are returned, not raised"
+    try:
+        return inspect_deb(path)
+    except (IOError, OSError, ValueError, KeyError, tarfile.TarError) as err:
+        return {u'error': str(err), u'Path': path}
+
+
+def inspect_debs(paths, workers=None):
+    """Inspect many .deb files in a pool of processes, return list of
+    inspect_deb results in the order of paths. Files which can't be
+    parsed get an error dict with 'error' and 'Path' keys instead.
+
+    :param paths: list of .deb file paths
+    :param workers: number of processes, cpu count by default
+    """
+    paths = list(paths)
+    workers = min(workers or multiprocessing.cpu_count(), len(paths))
+    if workers <= 1:
+        return [_inspect(path) for path in paths]
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(_inspect, paths)
+    finally:
+        pool.close()
+        pool.join()
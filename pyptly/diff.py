@@ -0,0 +1,167 @@
+"""
+pyptly.diff
+-----------
+
+Client side snapshot diff, same output as the aptly diff API
+"""
+from array import array
+from collections import OrderedDict
+from pyptly.flow import Call, Calls, Consume, Done
+from pyptly.index import PackageIndex
+from pyptly.version import version_ranks
+
+
+def sorted_rows(index):
+    """Return rows of PackageIndex in the order aptly uses for diffs:
+    name, newest version first, architecture
+    """
+    entries = list(index.entries())
+    ranks = version_ranks(version for _, _, version, _ in entries)
+
+    def key(row):
+        arch, name, version, _ = entries[row]
+        return name, -ranks[version], arch
+
+    return array('i', sorted(range(len(entries)), key=key))
+
+
+def diff(left, right, only_matching=False, left_rows=None, right_rows=None):
+    """Calculate difference between two package lists the same way as
+    /api/snapshots/:name/diff/:withSnapshot does, i.e. return list of
+    {'Left': ref or None, 'Right': ref or None} dicts.
+
+    :param left: PackageIndex or list of package references
+    :param right: PackageIndex or list of package references
+    :param only_matching: skip packages missing on either side
+    :param left_rows: precomputed sorted_rows(left)
+    :param right_rows: precomputed sorted_rows(right)
+    """
+    if not isinstance(left, PackageIndex):
+        left = PackageIndex(left)
+    if not isinstance(right, PackageIndex):
+        right = PackageIndex(right)
+    if left_rows is None:
+        left_rows = sorted_rows(left)
+    if right_rows is None:
+        right_rows = sorted_rows(right)
+
+    result = []
+    lpos, rpos = 0, 0
+    llen, rlen = len(left_rows), len(right_rows)
+    while lpos < llen or rpos < rlen:
+        if lpos == llen:
+            if not only_matching:
+                result.append({'Left': None,
+                               'Right': right.ref(right_rows[rpos])})
+            rpos += 1
+            continue
+        if rpos == rlen:
+            if not only_matching:
+                result.append({'Left': left.ref(left_rows[lpos]),
+                               'Right': None})
+            lpos += 1
+            continue
+
+        lrow, rrow = left_rows[lpos], right_rows[rpos]
+        larch, lname, lversion, lhash = left.entry(lrow)
+        rarch, rname, rversion, rhash = right.entry(rrow)
+        if lname == rname and larch == rarch:
+            if lversion != rversion or lhash != rhash:
+                result.append({'Left': left.ref(lrow),
+                               'Right': right.ref(rrow)})
+            lpos += 1
+            rpos += 1
+        elif lname < rname or (lname == rname and larch < rarch):
+            if not only_matching:
+                result.append({'Left': left.ref(lrow), 'Right': None})
+            lpos += 1
+        else:
+            if not only_matching:
+                result.append({'Left': None, 'Right': right.ref(rrow)})
+            rpos += 1
+    return result
+
+
+class SnapshotDiffer(object):
+    """Diff snapshots locally, reusing package lists between calls.
+
+    Every snapshot is downloaded once (streamed into a PackageIndex) and
+    kept sorted, so diffing a chain of N snapshots takes N listing calls
+    instead of N-1 diff calls which each read two snapshots::
+
+        differ = SnapshotDiffer(api)
+        for change in differ.diff_chain(['snap1', 'snap2', 'snap3']):
+            ...
+
+    With AsyncAptly the methods return coroutines. Snapshots are
+    immutable, but may be deleted and re-created under the same name;
+    call forget() in that case.
+
+    :param api: Aptly or AsyncAptly object
+    :param workers: number of snapshots downloaded in parallel
+    """
+
+    def __init__(self, api, workers=4):
+        self.api = api
+        self.workers = workers
+        self._snapshots = {}
+
+
+    def packages(self, snap_name):
+        """Return PackageIndex of snapshot, download it if not seen yet"""
+        return self.api._run(self._packages(snap_name))
+
+
+    def _packages(self, snap_name):
+        "Flow of packages"
+        yield Call(lambda: self._load([snap_name]))
+        yield Done(self._snapshots[snap_name][0])
+
+
+    def _load(self, snap_names):
+        "Flow downloading snapshots not seen yet"
+        missing = [name for name in OrderedDict.fromkeys(snap_names)
+                   if name not in self._snapshots]
+        indexes = yield Calls([
+            Consume(lambda name=name: self.api.iter_snapshot_packages(name),
+                    PackageIndex)
+            for name in missing], self.workers)
+        for name, index in zip(missing, indexes):
+            self._snapshots[name] = (index, sorted_rows(index))
+        yield Done()
+
+
+    def forget(self, snap_name=None):
+        """Drop cached package list of snapshot, or all of them"""
+        if snap_name is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(snap_name, None)
+
+
+    def diff(self, snapshot1, snapshot2, only_matching=False):
+        """Calculate difference between :snapshot1 (left) and
+        :snapshot2 (right), same as Aptly.snapshots_diff
+        """
+        return self.api._run(self._diff_chain([snapshot1, snapshot2],
+                                              only_matching, True))
+
+
+    def diff_chain(self, snap_names, only_matching=False):
+        """Diff every pair of consecutive snapshots, return list of
+        len(snap_names) - 1 diffs
+        """
+        return self.api._run(self._diff_chain(list(snap_names),
+                                              only_matching))
+
+
+    def _diff_chain(self, snap_names, only_matching, single=False):
+        "Flow of diff_chain, result of diff with :single"
+        yield Call(lambda: self._load(snap_names))
+        result = []
+        for left, right in zip(snap_names, snap_names[1:]):
+            left, left_rows = self._snapshots[left]
+            right, right_rows = self._snapshots[right]
+            result.append(diff(left, right, only_matching=only_matching,
+                               left_rows=left_rows, right_rows=right_rows))
+        yield Done(result[0] if single else result)
@@ -0,0 +1,171 @@
+"""
+pyptly.flow
+-----------
+
+Transport agnostic composite calls. A flow is a generator yielding the
+steps it needs, e.g. API calls to run in parallel, and getting their
+results back; Aptly runs the steps in threads, AsyncAptly in the event
+loop, so both clients share one implementation::
+
+    def _repo_names(self, names):
+        repos = yield Calls([lambda name=name: self.show_local_repo(name)
+                             for name in names], workers=4)
+        yield Done([repo['Name'] for repo in repos])
+
+Exceptions raised by a step are raised in the flow at the yield.
+"""
+import time
+import threading
+import types
+from collections import OrderedDict
+from pyptly.utils import thread_map, interleave
+
+
+class Call(object):
+    """Step running a single call, its result is sent to the flow
+
+    :param func: item, see Calls
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+
+class Calls(object):
+    """Step running calls in parallel, the list of their results is sent
+    to the flow in order of funcs.
+
+    An item is a function without arguments calling the API (its result
+    is a coroutine with AsyncAptly) or returning a flow, which is run as
+    well, or a Blocking or Consume object.
+
+    :param funcs: items to run
+    :param workers: max number of items running at once, None for all
+    :param groups: group of every item, at most :per_group items of a
+                   group run at once
+    :param per_group: max number of running items per group
+    """
+
+    def __init__(self, funcs, workers=None, groups=None, per_group=1):
+        self.funcs = list(funcs)
+        self.workers = workers
+        self.groups = groups
+        self.per_group = per_group
+
+
+    def order(self):
+        """Return item numbers in the order they are started, groups
+        are interleaved so that workers rarely wait for a group
+        """
+        if self.groups is None:
+            return list(range(len(self.funcs)))
+        groups = OrderedDict()
+        for num, group in enumerate(self.groups):
+            groups.setdefault(group, []).append(num)
+        return interleave(groups.values())
+
+
+class Blocking(object):
+    """Item doing blocking work which is not an API call, e.g. hashing
+    files; AsyncAptly runs it in an executor
+
+    :param func: function without arguments
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+
+class Consume(object):
+    """Item consuming an iterator of the API, e.g. iter_repo_packages;
+    AsyncAptly collects its async iterator into a list first
+
+    :param func: function without arguments returning the iterator
+    :param consumer: function called with the iterator, its result is
+                     the result of the item
+    """
+
+    def __init__(self, func, consumer):
+        self.func = func
+        self.consumer = consumer
+
+
+class Sleep(object):
+    """Step waiting :seconds"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class Done(object):
+    """Last step of a flow, :value is the result of the flow"""
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+def is_flow(obj):
+    """Check if obj is a flow"""
+    return isinstance(obj, types.GeneratorType)
+
+
+def advance(flow, value, error):
+    """Send result of a step (or raise error) in flow, return the next
+    step, Done if the flow finished
+    """
+    try:
+        if error is not None:
+            return flow.throw(error)
+        return flow.send(value)
+    except StopIteration:
+        return Done()
+
+
+def run(flow):
+    """Run flow in the calling thread, items of Calls in threads, and
+    return its result
+    """
+    value = error = None
+    while True:
+        step = advance(flow, value, error)
+        if isinstance(step, Done):
+            flow.close()
+            return step.value
+        value = error = None
+        try:
+            value = _step(step)
+        except Exception as err:
+            error = err
+
+
+def _item(func):
+    "Run item of Calls"
+    if isinstance(func, Blocking):
+        return func.func()
+    if isinstance(func, Consume):
+        return func.consumer(func.func())
+    result = func()
+    return run(result) if is_flow(result) else result
+
+
+def _step(step):
+    "Run step of a flow, return its result"
+    if isinstance(step, Sleep):
+        time.sleep(step.seconds)
+        return None
+    if isinstance(step, Call):
+        return _item(step.func)
+
+    funcs = step.funcs
+    workers = step.workers or len(funcs) or 1
+    if step.groups is None:
+        return thread_map(_item, funcs, workers)
+    locks = dict((group, threading.BoundedSemaphore(step.per_group))
+                 for group in set(step.groups))
+
+    def run_item(num):
+        with locks[step.groups[num]]:
+            return num, _item(funcs[num])
+
+    results = dict(thread_map(run_item, step.order(), workers))
+    return [results[num] for num in range(len(funcs))]
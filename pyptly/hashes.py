@@ -0,0 +1,115 @@
+"""
+pyptly.hashes
+-------------
+
+Local file checksums matching aptly package metadata
+"""
+import os
+import io
+import json
+import hashlib
+import multiprocessing
+from pyptly.cache import Memo
+from pyptly.utils import thread_map
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# aptly package fields of the checksums, strongest first
+CHECKSUMS = (('SHA256', 'sha256'), ('SHA1', 'sha1'), ('MD5sum', 'md5'))
+
+
+def file_checksums(path, chunk_size=HASH_CHUNK_SIZE):
+    """Return dict of Size, MD5sum, SHA1 and SHA256 of file, reading it
+    once through a single buffer
+    """
+    hashers = [(field, hashlib.new(name)) for field, name in CHECKSUMS]
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    size = 0
+    with io.open(path, 'rb') as file_pointer:
+        while True:
+            count = file_pointer.readinto(buf)
+            if not count:
+                break
+            for _, hasher in hashers:
+                hasher.update(view[:count])
+            size += count
+    checksums = dict((field, hasher.hexdigest()) for field, hasher in hashers)
+    checksums['Size'] = size
+    return checksums
+
+
+class FileHasher(object):
+    """Checksums of local files cached by (path, size, mtime), so an
+    unchanged file is read only once.
+
+    Checksums are kept in memory and, if store is given, in a
+    PackageStore, so they survive between runs. Files are hashed by
+    :workers threads; hashlib releases the GIL while hashing, so large
+    files are hashed on all cores.
+
+    :param store: PackageStore to persist checksums in
+    :param workers: number of files hashed in parallel
+    """
+
+    def __init__(self, store=None, workers=None):
+        self.store = store
+        self.workers = workers or multiprocessing.cpu_count()
+        self.hashed = 0
+        self._memo = Memo()
+
+
+    @staticmethod
+    def key(path):
+        """Return cache key of file: absolute path, size and mtime"""
+        stat = os.stat(path)
+        return json.dumps([os.path.abspath(path), stat.st_size,
+                           stat.st_mtime])
+
+
+    def checksums(self, path):
+        """Return checksums of file, see file_checksums"""
+        key = self.key(path)
+        checksums = self._memo.get(key)
+        if checksums is None and self.store is not None:
+            checksums = self.store.get('file', key)
+        if checksums is None:
+            checksums = file_checksums(path)
+            self.hashed += 1
+            if self.store is not None:
+                self.store.put('file', key, checksums)
+        self._memo.set(key, checksums)
+        return checksums
+
+
+    def map(self, paths):
+        """Return list of checksums of files, hashed in parallel"""
+        return thread_map(self.checksums, paths, self.workers)
+
+
+def package_checksums(packages):
+    """Map checksums of package 'details' dicts to package keys, return
+    {(field, checksum): key}; a package is mapped by the strongest field
+    of CHECKSUMS it has only, weaker ones can't tell a different file
+    """
+    index = {}
+    for package in packages:
+        for field, _ in CHECKSUMS:
+            if package.get(field):
+                index[(field, package[field])] = package['Key']
+                break
+    return index
+
+
+def find_package(index, checksums):
+    """Return key of package with the same content as file or None. Only
+    the strongest checksum both have is compared, a package whose SHA256
+    differs is not found even if its MD5sum matches
+
+    :param index: result of package_checksums
+    :param checksums: result of file_checksums
+    """
+    for field, _ in CHECKSUMS:
+        key = index.get((field, checksums.get(field)))
+        if key is not None:
+            return key
+    return None
@@ -0,0 +1,249 @@
+"""
+pyptly.metrics
+--------------
+
+Latency histograms, byte and status counters of API calls
+"""
+import bisect
+import threading
+import time
+
+# seconds, the same as the Prometheus client default
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+                   1.0, 2.5, 5.0, 7.5, 10.0)
+DECODE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class Histogram(object):
+    """Counts of observed values per bucket, with their sum
+
+    :param buckets: sorted upper bounds of buckets, +Inf is implied
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value):
+        """Add value"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def cumulative(self):
+        """Return list of (upper bound, count of values <= bound)"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+    def quantile(self, fraction):
+        """Estimate quantile as the upper bound of its bucket"""
+        rank = fraction * self.count
+        for bound, total in self.cumulative():
+            if total >= rank and total:
+                return bound
+        return None
+
+
+def body_size(body):
+    """Return size of request body, 0 if it is unknown"""
+    if body is None:
+        return 0
+    try:
+        return len(body)
+    except TypeError:
+        return 0
+
+
+class Metrics(object):
+    """Instrumentation of API calls.
+
+    Pass it to Aptly(metrics=...) to record per endpoint and verb
+    latency histograms, request and response sizes, status codes and
+    JSON decode time. Without metrics a call only pays for one
+    attribute check::
+
+        metrics = Metrics()
+        api = Aptly('http://127.0.0.1:8080', metrics=metrics)
+        metrics.on_response.append(lambda event: log.debug('%r', event))
+        open('/var/lib/node_exporter/pyptly.prom', 'w').write(
+            metrics.prometheus())
+
+    Hooks are called with an event dict: on_request hooks with
+    'endpoint', 'verb' and 'url' keys before the request is sent,
+    on_response hooks with 'status' (None if no response was received),
+    'elapsed' (seconds), 'sent' and 'received' (bytes) added. Streamed
+    responses are counted when they are consumed.
+
+    :param buckets: latency histogram buckets in seconds
+    :param decode_buckets: JSON decode time histogram buckets in seconds
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS,
+                 decode_buckets=DECODE_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.decode_buckets = tuple(decode_buckets)
+        self.on_request = []
+        self.on_response = []
+        self.latency = {}
+        self.decode = {}
+        self.statuses = {}
+        self.sent = {}
+        self.received = {}
+        self._lock = threading.Lock()
+
+
+    def start(self, endpoint, verb, url):
+        """Return event of a request which is about to be sent"""
+        event = {'endpoint': endpoint, 'verb': verb, 'url': url,
+                 'start': time.time()}
+        for hook in self.on_request:
+            hook(event)
+        return event
+
+
+    def finish(self, event, status, sent=0, received=0):
+        """Record completed request
+
+        :param event: result of start()
+        :param status: HTTP status code, None if the request failed
+        """
+        event['elapsed'] = time.time() - event['start']
+        event['status'] = status
+        event['sent'] = sent
+        event['received'] = received
+        key = (event['endpoint'], event['verb'])
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram(self.buckets)
+            histogram.observe(event['elapsed'])
+            status_key = key + (status or 0,)
+            self.statuses[status_key] = self.statuses.get(status_key, 0) + 1
+            self.sent[key] = self.sent.get(key, 0) + sent
+            self.received[key] = self.received.get(key, 0) + received
+        for hook in self.on_response:
+            hook(event)
+        return event
+
+
+    def add_received(self, endpoint, verb, size):
+        """Count bytes of a streamed response body"""
+        key = (endpoint, verb)
+        with self._lock:
+            self.received[key] = self.received.get(key, 0) + size
+
+
+    def observe_decode(self, endpoint, elapsed):
+        """Record JSON decode time of a response"""
+        with self._lock:
+            histogram = self.decode.get(endpoint)
+            if histogram is None:
+                histogram = self.decode[endpoint] = Histogram(
+                    self.decode_buckets)
+            histogram.observe(elapsed)
+
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self._lock:
+            self.latency.clear()
+            self.decode.clear()
+            self.statuses.clear()
+            self.sent.clear()
+            self.received.clear()
+
+
+    def summary(self):
+        """Return dict of per 'VERB endpoint' stats: count, total, p50
+        and p99 latency (bucket bounds), bytes sent and received
+        """
+        result = {}
+        with self._lock:
+            for (endpoint, verb), histogram in self.latency.items():
+                result['{0} {1}'.format(verb, endpoint)] = {
+                    'count': histogram.count,
+                    'total': histogram.sum,
+                    'p50': histogram.quantile(0.5),
+                    'p99': histogram.quantile(0.99),
+                    'sent': self.sent.get((endpoint, verb), 0),
+                    'received': self.received.get((endpoint, verb), 0)}
+        return result
+
+
+    def prometheus(self, prefix='pyptly'):
+        """Return metrics in Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            _histograms(lines, prefix + '_request_duration_seconds',
+                        'Duration of aptly API requests',
+                        [((('endpoint', endpoint), ('verb', verb)), hist)
+                         for (endpoint, verb), hist
+                         in sorted(self.latency.items())])
+            _histograms(lines, prefix + '_decode_duration_seconds',
+                        'Time spent decoding JSON responses',
+                        [((('endpoint', endpoint),), hist)
+                         for endpoint, hist in sorted(self.decode.items())])
+            _counters(lines, prefix + '_responses_total',
+                      'Responses by status code, 0 for failed requests',
+                      [((('endpoint', endpoint), ('verb', verb),
+                         ('code', str(status))), count)
+                       for (endpoint, verb, status), count
+                       in sorted(self.statuses.items())])
+            _counters(lines, prefix + '_request_bytes_total',
+                      'Size of request bodies',
+                      [((('endpoint', endpoint), ('verb', verb)), size)
+                       for (endpoint, verb), size
+                       in sorted(self.sent.items())])
+            _counters(lines, prefix + '_response_bytes_total',
+                      'Size of response bodies',
+                      [((('endpoint', endpoint), ('verb', verb)), size)
+                       for (endpoint, verb), size
+                       in sorted(self.received.items())])
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    "Format Prometheus label set"
+    return '{' + ','.join('{0}="{1}"'.format(
+        name, value.replace('\\', '\\\\').replace('"', '\\"').replace(
+            '\n', '\\n')) for name, value in pairs) + '}'
+
+
+def _number(value):
+    "Format Prometheus sample value"
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histograms(lines, name, help_text, series):
+    "Append histogram samples to lines"
+    lines.append('# HELP {0} {1}'.format(name, help_text))
+    lines.append('# TYPE {0} histogram'.format(name))
+    for labels, histogram in series:
+        for bound, total in histogram.cumulative():
+            lines.append('{0}_bucket{1} {2}'.format(
+                name, _labels(labels + (('le', _number(bound)),)), total))
+        lines.append('{0}_sum{1} {2}'.format(name, _labels(labels),
+                                             _number(histogram.sum)))
+        lines.append('{0}_count{1} {2}'.format(name, _labels(labels),
+                                               histogram.count))
+
+
+def _counters(lines, name, help_text, series):
+    "Append counter samples to lines"
+    lines.append('# HELP {0} {1}'.format(name, help_text))
+    lines.append('# TYPE {0} counter'.format(name))
+    for labels, value in series:
+        lines.append('{0}{1} {2}'.format(name, _labels(labels),
+                                         _number(value)))
@@ -0,0 +1,128 @@
+"""
+pyptly.multipart
+----------------
+
+Streaming multipart/form-data encoder for file uploads
+"""
+import io
+import os
+import uuid
+from collections import deque
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _quote(filename):
+    "Escape filename for Content-Disposition header"
+    return filename.replace('\\', '\\\\').replace('"', '%22')
+
+
+class MultipartEncoder(object):
+    """File-like multipart/form-data body which reads files lazily.
+
+    Only one file is open at a time and it is read in chunks of at most
+    chunk_size bytes into a single preallocated buffer, so memory usage
+    does not depend on the size of the upload. Every file is closed as
+    soon as it is sent; call close() to release the current one if the
+    upload is interrupted.
+
+    read() returns a memoryview of the internal buffer which is valid
+    until the next read() call.
+
+    :param files: list of file paths
+    :param field: form field name for every file
+    :param chunk_size: max size of a chunk read from disk
+    :param callback: function called as callback(bytes_sent, total_bytes)
+                     after every chunk
+    """
+
+    def __init__(self, files, field='file', chunk_size=CHUNK_SIZE,
+                 callback=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={0}'.format(
+            self.boundary)
+        self.chunk_size = chunk_size
+        self.callback = callback
+        self.bytes_sent = 0
+        self.len = 0
+        self._file = None
+        self._remaining = 0
+        self._buffer = bytearray(chunk_size)
+        self._view = memoryview(self._buffer)
+        self._segments = deque()
+
+        separator = '--{0}\r\n'.format(self.boundary)
+        for path in files:
+            size = os.path.getsize(path)
+            header = (separator +
+                      'Content-Disposition: form-data; name="{0}"; '
+                      'filename="{1}"\r\n'
+                      'Content-Type: application/octet-stream\r\n'
+                      '\r\n').format(field, _quote(os.path.basename(path)))
+            self._push(header.encode('utf-8'))
+            self._segments.append((path, size))
+            self.len += size
+            separator = '\r\n--{0}\r\n'.format(self.boundary)
+
+        if self._segments:
+            self._push('\r\n--{0}--\r\n'.format(self.boundary).encode('utf-8'))
+        else:
+            self._push('--{0}--\r\n'.format(self.boundary).encode('utf-8'))
+
+
+    def _push(self, data):
+        self._segments.append(data)
+        self.len += len(data)
+
+
+    def __len__(self):
+        return self.len
+
+
+    def _sent(self, chunk):
+        self.bytes_sent += len(chunk)
+        if self.callback is not None:
+            self.callback(self.bytes_sent, self.len)
+        return chunk
+
+
+    def read(self, size=-1):
+        """Return next chunk of the body, empty bytes at the end
+
+        :param size: max chunk size, chunk_size if negative
+        """
+        if size is None or size < 0 or size > self.chunk_size:
+            size = self.chunk_size
+
+        while self._segments:
+            segment = self._segments[0]
+            if isinstance(segment, bytes):
+                if len(segment) > size:
+                    self._segments[0] = segment[size:]
+                else:
+                    self._segments.popleft()
+                return self._sent(segment[:size])
+
+            path, length = segment
+            if self._file is None:
+                self._file = io.open(path, 'rb')
+                self._remaining = length
+            if self._remaining:
+                count = self._file.readinto(
+                    self._view[:min(size, self._remaining)])
+                if not count:
+                    self.close()
+                    raise IOError('{0} was truncated during upload'.format(
+                        path))
+                self._remaining -= count
+                return self._sent(self._view[:count])
+            self.close()
+            self._segments.popleft()
+        return b''
+
+
+    def close(self):
+        """Close the file being sent"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
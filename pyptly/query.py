@@ -0,0 +1,483 @@
+"""
+pyptly.query
+------------
+
+Client side evaluation of aptly package queries
+https://www.aptly.info/doc/feature/query/
+"""
+import re
+import fnmatch
+from pyptly.index import parse_ref
+from pyptly.version import compare_versions
+from pyptly.utils import remember
+
+# relations of field conditions, longest first; '<' and '>' mean '<=' and
+# '>=' as in Debian dependencies
+RELATIONS = ('>=', '<=', '>>', '<<', '=', '>', '<', '%', '~')
+_ALIASES = {'>': '>=', '<': '<='}
+_COMPARE = {'>=': lambda cmp: cmp >= 0,
+            '<=': lambda cmp: cmp <= 0,
+            '>>': lambda cmp: cmp > 0,
+            '<<': lambda cmp: cmp < 0}
+# fields compared as Debian versions by '=', other fields are compared
+# as strings like aptly does
+VERSION_FIELDS = frozenset(['$Version'])
+# fields with an index in QueryIndex, aliases share the index
+INDEXED = {'Name': 'Name', '$Architecture': '$Architecture',
+           'Architecture': '$Architecture', '$Source': '$Source'}
+_SPECIAL = ' \t\r\n,|!(){}'
+_compiled = {}
+
+
+def _source(package):
+    "Source package name and version of package"
+    source = package.get('Source')
+    if not source:
+        return package.get('Package'), package.get('Version')
+    name, _, version = source.partition(' (')
+    return name.strip(), version.rstrip(')').strip() or package.get('Version')
+
+
+def _package_type(package):
+    "aptly $PackageType of package"
+    if package.get('Architecture') == 'source':
+        return 'source'
+    if (package.get('Filename') or '').endswith('.udeb'):
+        return 'udeb'
+    return 'deb'
+
+
+_FIELDS = {'Name': lambda package: package.get('Package'),
+           '$Architecture': lambda package: package.get('Architecture'),
+           '$Version': lambda package: package.get('Version'),
+           '$Source': lambda package: _source(package)[0],
+           '$SourceVersion': lambda package: _source(package)[1],
+           '$PackageType': _package_type}
+
+
+def field_value(package, field):
+    """Return value of query field of 'details' dict, None if missing"""
+    getter = _FIELDS.get(field)
+    if getter is not None:
+        return getter(package)
+    return package.get(field)
+
+
+def ref_details(ref):
+    """Return minimal 'details' dict of package reference, enough for
+    queries on name, version and architecture
+    """
+    arch, name, version, fileshash = parse_ref(ref)
+    return {'Key': ref, 'Package': name, 'Version': version,
+            'Architecture': arch, 'FilesHash': fileshash}
+
+
+def matches_architecture(arch, value):
+    """Check if package architecture :arch matches :value the way aptly
+    does: 'all' packages match every architecture except 'source'
+    """
+    return arch == value or (arch == 'all' and value != 'source')
+
+
+class Field(object):
+    """Condition on a single field, relation None checks that the field
+    is not empty. Missing fields are empty strings, as in aptly.
+
+    :param field: field name, e.g. 'Name', 'Priority', '$Source'
+    :param relation: one of RELATIONS or None
+    :param value: value to compare with
+    """
+
+    def __init__(self, field, relation=None, value=None):
+        self.field = field
+        self.relation = _ALIASES.get(relation, relation)
+        self.value = value
+        if self.relation == '~':
+            self._test = re.compile(value).search
+        elif self.relation == '%':
+            self._test = lambda text: fnmatch.fnmatchcase(text, value)
+        elif self.relation in _COMPARE:
+            check = _COMPARE[self.relation]
+            self._test = lambda text: check(compare_versions(text, value))
+        elif self.relation is None:
+            self._test = lambda text: text != ''
+        elif field == '$Architecture':
+            self._test = lambda text: matches_architecture(text, value)
+        elif field in VERSION_FIELDS:
+            self._test = lambda text: compare_versions(text, value) == 0
+        else:
+            self._test = lambda text: text == value
+
+
+    def __repr__(self):
+        if self.relation is None:
+            return self.field
+        return '{0} ({1} {2})'.format(self.field, self.relation, self.value)
+
+
+    def test(self, text):
+        """Check a field value against the condition"""
+        return self._test('' if text is None else text)
+
+
+    def match(self, package):
+        """Check if 'details' dict matches the condition"""
+        return self.test(field_value(package, self.field))
+
+
+    def candidates(self, index):
+        """Return set of rows of QueryIndex which may match, None if the
+        field has no index
+        """
+        values = index.values(self.field)
+        if values is None:
+            return None
+        if self.relation in (None, '=') and self.field not in VERSION_FIELDS:
+            if self.relation is None:
+                return index.all_rows() - set(values.get('', ()))
+            rows = set(values.get(self.value, ()))
+            if self.field == '$Architecture' and self.value != 'source':
+                rows.update(values.get('all', ()))
+            return rows
+        rows = set()
+        for text, value_rows in values.items():
+            if self.test(text):
+                rows.update(value_rows)
+        return rows
+
+
+class And(object):
+    "All conditions match"
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+
+    def __repr__(self):
+        return ', '.join(_grouped(node, Or) for node in self.nodes)
+
+
+    def match(self, package):
+        return all(node.match(package) for node in self.nodes)
+
+
+    def candidates(self, index):
+        rows = None
+        for node in self.nodes:
+            node_rows = node.candidates(index)
+            if node_rows is not None:
+                rows = node_rows if rows is None else rows & node_rows
+        return rows
+
+
+class Or(object):
+    "Any condition matches"
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+
+    def __repr__(self):
+        return ' | '.join(repr(node) for node in self.nodes)
+
+
+    def match(self, package):
+        return any(node.match(package) for node in self.nodes)
+
+
+    def candidates(self, index):
+        rows = set()
+        for node in self.nodes:
+            node_rows = node.candidates(index)
+            if node_rows is None:
+                return None
+            rows |= node_rows
+        return rows
+
+
+class Not(object):
+    "Condition does not match"
+
+    def __init__(self, node):
+        self.node = node
+
+
+    def __repr__(self):
+        return '!' + _grouped(self.node, (And, Or))
+
+
+    def match(self, package):
+        return not self.node.match(package)
+
+
+    def candidates(self, index):
+        return None
+
+
+def _grouped(node, kinds):
+    "repr of node, in parentheses if it is one of kinds"
+    if isinstance(node, kinds):
+        return '({0!r})'.format(node)
+    return repr(node)
+
+
+class _Parser(object):
+    """Recursive descent parser of the aptly query grammar:
+
+        query     := and ('|' and)*
+        and       := not (',' not)*
+        not       := '!' not | '(' query ')' | condition
+        condition := word ['(' [relation] value ')'] ['{' arch '}']
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+
+    def error(self, msg):
+        raise ValueError('{0} at position {1} of query {2!r}'.format(
+            msg, self.pos, self.text))
+
+
+    def skip(self):
+        "Skip spaces"
+        while self.pos < len(self.text) and self.text[self.pos].isspace():
+            self.pos += 1
+
+
+    def peek(self, char):
+        "Skip spaces, check next character"
+        self.skip()
+        return self.text.startswith(char, self.pos)
+
+
+    def until(self, char):
+        "Return text up to closing char, skip the char"
+        end = self.text.find(char, self.pos)
+        if end < 0:
+            self.error("missing '{0}'".format(char))
+        text = self.text[self.pos:end].strip()
+        self.pos = end + 1
+        return text
+
+
+    def parse(self):
+        node = self.query()
+        self.skip()
+        if self.pos < len(self.text):
+            self.error('unexpected {0!r}'.format(self.text[self.pos]))
+        return node
+
+
+    def query(self):
+        nodes = [self.conjunction()]
+        while self.peek('|'):
+            self.pos += 1
+            nodes.append(self.conjunction())
+        return nodes[0] if len(nodes) == 1 else Or(nodes)
+
+
+    def conjunction(self):
+        nodes = [self.negation()]
+        while self.peek(','):
+            self.pos += 1
+            nodes.append(self.negation())
+        return nodes[0] if len(nodes) == 1 else And(nodes)
+
+
+    def negation(self):
+        if self.peek('!'):
+            self.pos += 1
+            return Not(self.negation())
+        if self.peek('('):
+            self.pos += 1
+            node = self.query()
+            if not self.peek(')'):
+                self.error("missing ')'")
+            self.pos += 1
+            return node
+        return self.condition()
+
+
+    def word(self):
+        start = self.pos
+        while (self.pos < len(self.text) and
+               self.text[self.pos] not in _SPECIAL):
+            self.pos += 1
+        if self.pos == start:
+            self.error('expected field or package name')
+        return self.text[start:self.pos]
+
+
+    def condition(self):
+        self.skip()
+        word = self.word()
+        relation = value = arch = None
+        if self.peek('('):
+            self.pos += 1
+            relation, value = _relation(self.until(')'))
+            if not value:
+                self.error('empty value of {0}'.format(word))
+        if self.peek('{'):
+            self.pos += 1
+            arch = self.until('}')
+
+        if word.startswith('$') or word[0].isupper():
+            if arch is not None:
+                self.error('architecture of field condition {0}'.format(word))
+            return Field(word, relation, value)
+
+        if '_' in word and relation is None and arch is None:
+            # package reference name_version_arch
+            parts = word.split('_')
+            if len(parts) != 3:
+                self.error('malformed package reference {0!r}'.format(word))
+            # references match exactly, unlike dependencies
+            return And([Field('Name', '=', parts[0]),
+                        Field('Version', '=', parts[1]),
+                        Field('Architecture', '=', parts[2])])
+        nodes = [Field('Name', '=', word)]
+        if value is not None:
+            nodes.append(Field('$Version', relation, value))
+        if arch is not None:
+            nodes.append(Field('$Architecture', '=', arch))
+        return nodes[0] if len(nodes) == 1 else And(nodes)
+
+
+def _relation(text):
+    "Split '>= 1.0' into ('>=', '1.0'), plain values are '='"
+    for relation in RELATIONS:
+        if text.startswith(relation):
+            return relation, text[len(relation):].strip()
+    return '=', text
+
+
+class PackageQuery(object):
+    """Compiled aptly package query, e.g.
+    'Name (~ ^python-), $Architecture (amd64), Version (>= 2.0)'.
+
+    Field conditions are checked against package 'details' dicts, 'Name'
+    is the 'Package' field, '$'-fields are computed as aptly does.
+    Matching follows aptly: '$Architecture (amd64)' and 'name {amd64}'
+    match 'all' packages as well, '=' compares versions only for
+    '$Version' and dependencies, other fields are compared as strings.
+    Raises ValueError if the query can't be parsed.
+
+    :param text: query
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.root = _Parser(text).parse()
+
+
+    def __repr__(self):
+        return '<PackageQuery {0!r}>'.format(self.root)
+
+
+    def match(self, package):
+        """Check if 'details' dict or package reference matches"""
+        if not isinstance(package, dict):
+            package = ref_details(package)
+        return self.root.match(package)
+
+
+    def filter(self, packages):
+        """Return matching packages of a list of 'details' dicts or
+        package references
+        """
+        return [package for package in packages if self.match(package)]
+
+
+def compile_query(query):
+    """Return PackageQuery of query text, compiled once per text"""
+    if isinstance(query, PackageQuery):
+        return query
+    try:
+        return _compiled[query]
+    except KeyError:
+        pass
+    return remember(_compiled, query, PackageQuery(query))
+
+
+class QueryIndex(object):
+    """Package list searchable by aptly queries.
+
+    Rows are indexed by Name, $Architecture and $Source, so conditions
+    on these fields only check packages with a matching value, the rest
+    of the query is checked package by package. Results of queries are
+    remembered, repeated searches are dict lookups.
+
+        index = QueryIndex(api.show_snapshot_packages('snap',
+                                                      format='details'))
+        index.search('Name (~ ^python-), $Architecture (amd64)')
+
+    :param packages: 'details' dicts or package references; only name,
+                     version and architecture can be queried for the
+                     latter
+    """
+
+    def __init__(self, packages=()):
+        self.packages = []
+        self._values = dict((field, {}) for field in set(INDEXED.values()))
+        self._results = {}
+        for package in packages:
+            self.add(package)
+
+
+    def __len__(self):
+        return len(self.packages)
+
+
+    def add(self, package):
+        """Add 'details' dict or package reference"""
+        if not isinstance(package, dict):
+            package = ref_details(package)
+        row = len(self.packages)
+        self.packages.append(package)
+        self._results.clear()
+        for field, values in self._values.items():
+            value = field_value(package, field)
+            values.setdefault('' if value is None else value, []).append(row)
+
+
+    def values(self, field):
+        """Return {value: rows} index of field, None if not indexed"""
+        field = INDEXED.get(field)
+        return self._values[field] if field is not None else None
+
+
+    def all_rows(self):
+        """Return set of all rows"""
+        return set(range(len(self.packages)))
+
+
+    def rows(self, query):
+        """Return sorted rows of packages matching query, results are
+        remembered until a package is added
+        """
+        query = compile_query(query)
+        try:
+            return self._results[query.text]
+        except KeyError:
+            pass
+        rows = query.root.candidates(self)
+        rows = range(len(self.packages)) if rows is None else sorted(rows)
+        match = query.root.match
+        packages = self.packages
+        return remember(self._results, query.text,
+                        [row for row in rows if match(packages[row])])
+
+
+    def search(self, query, details=False):
+        """Return package references (or 'details' dicts) of packages
+        matching query, in order they were added
+
+        :param query: query text or PackageQuery
+        :param details: return 'details' dicts instead of references
+        """
+        packages = [self.packages[row] for row in self.rows(query)]
+        if details:
+            return packages
+        return [package['Key'] for package in packages]
@@ -0,0 +1,302 @@
+"""
+pyptly.reconcile
+----------------
+
+Declarative state: the calls turning the current local repositories,
+snapshots and published repositories into the desired ones
+"""
+from collections import OrderedDict
+
+# repository fields edit_local_repo can change
+REPO_FIELDS = ('Comment', 'DefaultDistribution', 'DefaultComponent')
+# publish parameters passed to update_publish as well
+UPDATE_FIELDS = ('Signing', 'ForceOverwrite', 'AcquireByHash',
+                 'SkipContents', 'SkipBz2')
+
+
+def publish_key(prefix, distribution):
+    """Return (storage, prefix, distribution) of a published repository,
+    e.g. ('s3:bucket', 'debian', 'stable') for 's3:bucket:debian'
+    """
+    prefix = prefix or '.'
+    storage = ''
+    if ':' in prefix:
+        storage, prefix = prefix.rsplit(':', 1)
+    return storage, prefix or '.', distribution
+
+
+def _full_prefix(storage, prefix):
+    "Publish prefix including storage"
+    return '{0}:{1}'.format(storage, prefix) if storage else prefix
+
+
+def _sources(sources):
+    "Comparable {component: name} of publish Sources"
+    return dict((source.get('Component', ''), source['Name'])
+                for source in sources)
+
+
+class Action(object):
+    """Single API call of a ReconcilePlan
+
+    :param method: name of the Aptly method
+    :param args: positional arguments
+    :param kwargs: keyword arguments
+    :param key: object created or changed, e.g. ('repo', 'stable') if
+                the call creates repository stable
+    :param requires: keys of objects the call depends on
+    """
+
+    def __init__(self, method, args, kwargs, key, requires=()):
+        self.method = method
+        self.args = tuple(args)
+        self.kwargs = kwargs
+        self.key = key
+        self.requires = list(requires)
+
+
+    def __repr__(self):
+        args = [repr(arg) for arg in self.args]
+        args.extend('{0}={1!r}'.format(name, self.kwargs[name])
+                    for name in sorted(self.kwargs))
+        return '{0}({1})'.format(self.method, ', '.join(args))
+
+
+class ReconcilePlan(object):
+    """Ordered API calls. Calls are split in waves: every call is in a
+    later wave than the calls it depends on, calls of a wave are
+    independent of each other.
+    """
+
+    def __init__(self, waves):
+        self.waves = waves
+
+
+    def __len__(self):
+        return len(self.actions)
+
+
+    def __str__(self):
+        if not self.actions:
+            return 'no changes'
+        # calls of a wave share the number, they run concurrently
+        return '\n'.join('{0}. {1!r}'.format(num + 1, action)
+                         for num, wave in enumerate(self.waves)
+                         for action in wave)
+
+
+    @property
+    def actions(self):
+        """Actions in execution order"""
+        return [action for wave in self.waves for action in wave]
+
+
+    def report(self):
+        """Return dry run report: planned 'Actions' and 'Failed' {}"""
+        return {u'Actions': [repr(action) for action in self.actions],
+                u'Failed': {}}
+
+
+class DesiredState(object):
+    """Desired local repositories, snapshots and published repositories,
+    described by the fields aptly uses in its API.
+
+    Repositories are created or edited when one of REPO_FIELDS differs.
+    Snapshots are created from local repository 'Repo' or from
+    'PackageRefs' (with 'SourceSnapshots'); existing snapshots are
+    immutable, only a different 'Description' is updated. Publishes are
+    keyed by prefix (with storage) and distribution; published snapshots
+    are switched when 'Sources' differ, a publish with a different
+    'SourceKind' or of different local repositories is dropped and
+    published again. Published local repositories are not updated,
+    their contents are not compared. A source without 'Component' gets
+    the one aptly would give it: DefaultComponent of a local
+    repository, the current component of a single source or 'main'.
+    Objects missing from the desired state are left alone.
+
+        state = DesiredState(
+            repos=[{'Name': 'stable', 'DefaultComponent': 'main'}],
+            snapshots=[{'Name': 'stable-1', 'Repo': 'stable'}],
+            published=[{'Prefix': 's3:bucket:debian',
+                        'Distribution': 'stable', 'SourceKind': 'snapshot',
+                        'Sources': [{'Component': 'main',
+                                     'Name': 'stable-1'}]}])
+
+    :param repos: create_local_repo parameters
+    :param snapshots: snapshot definitions
+    :param published: publish parameters
+    """
+
+    def __init__(self, repos=(), snapshots=(), published=()):
+        self.repos = [dict(repo) for repo in repos]
+        self.snapshots = [dict(snapshot) for snapshot in snapshots]
+        self.published = [dict(publish) for publish in published]
+        for snapshot in self.snapshots:
+            if 'Repo' not in snapshot and 'PackageRefs' not in snapshot:
+                raise ValueError('snapshot {0} needs Repo or '
+                                 'PackageRefs'.format(snapshot.get('Name')))
+
+
+    def _repo_actions(self, current):
+        "Actions of local repositories"
+        current = dict((repo['Name'], repo) for repo in current)
+        actions = []
+        for repo in self.repos:
+            name = repo['Name']
+            fields = dict((field, repo[field]) for field in REPO_FIELDS
+                          if field in repo)
+            if name not in current:
+                fields.update((field, value) for field, value in repo.items()
+                              if field != 'Name')
+                actions.append(Action('create_local_repo', [name], fields,
+                                      ('repo', name)))
+                continue
+            changed = dict((field, value) for field, value in fields.items()
+                           if current[name].get(field) != value)
+            if changed:
+                actions.append(Action('edit_local_repo', [name], changed,
+                                      ('repo_fields', name)))
+        return actions
+
+
+    def _snapshot_actions(self, current):
+        "Actions of snapshots"
+        current = dict((snapshot['Name'], snapshot) for snapshot in current)
+        actions = []
+        for snapshot in self.snapshots:
+            name = snapshot['Name']
+            if name in current:
+                description = snapshot.get('Description')
+                if (description is not None and
+                        current[name].get('Description') != description):
+                    actions.append(Action('update_snapshot', [name],
+                                          {'Description': description},
+                                          ('description', name)))
+                continue
+            params = dict(snapshot)
+            repo = params.pop('Repo', None)
+            if repo is not None:
+                actions.append(Action('create_snapshot_from_repo', [repo],
+                                      params, ('snapshot', name),
+                                      [('repo', repo)]))
+            else:
+                actions.append(Action(
+                    'create_snapshot_from_pkg', [], params,
+                    ('snapshot', name),
+                    [('snapshot', source)
+                     for source in params.get('SourceSnapshots', ())]))
+        return actions
+
+
+    def _components(self, sources, kind, existing, defaults):
+        """Return copy of publish Sources with every missing Component
+        filled in the way aptly fills it in, so that they compare equal
+        to Sources aptly reports
+
+        :param existing: current Sources of the publish or None
+        :param defaults: {repo name: DefaultComponent}
+        """
+        known = [source.get('Component') for source in existing or ()]
+        result = []
+        for source in sources:
+            component = source.get('Component')
+            if not component and kind != 'snapshot':
+                component = defaults.get(source['Name'])
+            if not component and len(sources) == 1 and len(known) == 1:
+                component = known[0]
+            filled = {'Component': component or 'main'}
+            filled.update((field, value) for field, value in source.items()
+                          if field != 'Component')
+            result.append(filled)
+        return result
+
+
+    def _publish_actions(self, current, repos=()):
+        "Actions of published repositories"
+        defaults = dict((repo['Name'], repo.get('DefaultComponent'))
+                        for repo in list(repos) + self.repos
+                        if repo.get('DefaultComponent'))
+        current = dict((publish_key(_full_prefix(publish.get('Storage'),
+                                                 publish.get('Prefix')),
+                                    publish.get('Distribution')), publish)
+                       for publish in current)
+        actions = []
+        for publish in self.published:
+            params = dict(publish)
+            key = publish_key(params.pop('Prefix', None),
+                              params.pop('Distribution', None))
+            storage, prefix, distribution = key
+            kind = params.get('SourceKind', 'local')
+            requires = [('snapshot' if kind == 'snapshot' else 'repo',
+                         source['Name'])
+                        for source in params.get('Sources', ())]
+            existing = current.get(key)
+            if 'Sources' in params:
+                params['Sources'] = self._components(
+                    params['Sources'], kind,
+                    existing and existing.get('Sources'), defaults)
+            # a published local repository can't be switched to another
+            # one, it is published again like a changed SourceKind
+            if existing is not None and (
+                    existing.get('SourceKind') != kind or
+                    (kind != 'snapshot' and
+                     _sources(params.get('Sources', ())) !=
+                     _sources(existing.get('Sources', ())))):
+                actions.append(Action(
+                    'delete_publish', [distribution],
+                    {'prefix': _full_prefix(storage, prefix)},
+                    ('unpublish',) + key))
+                requires.append(('unpublish',) + key)
+                existing = None
+            if existing is None:
+                params['prefix'] = _full_prefix(storage, prefix)
+                if distribution is not None:
+                    params['Distribution'] = distribution
+                actions.append(Action('publish', [], params,
+                                      ('publish',) + key, requires))
+            elif kind == 'snapshot' and (_sources(params.get('Sources', ()))
+                                         != _sources(existing['Sources'])):
+                update = dict((field, params[field])
+                              for field in UPDATE_FIELDS if field in params)
+                update['prefix'] = _full_prefix(storage, prefix)
+                update['Snapshots'] = params['Sources']
+                actions.append(Action('update_publish', [distribution],
+                                      update, ('publish',) + key, requires))
+        return actions
+
+
+    def plan(self, repos, snapshots, published):
+        """Return ReconcilePlan turning the current state into this one
+
+        :param repos: result of get_local_repos
+        :param snapshots: result of get_snapshots
+        :param published: result of get_publish
+        """
+        actions = (self._repo_actions(repos) +
+                   self._snapshot_actions(snapshots) +
+                   self._publish_actions(published, repos))
+        planned = OrderedDict()
+        for action in actions:
+            planned.setdefault(action.key, []).append(action)
+
+        # wave of an action is the longest chain of planned actions it
+        # depends on
+        waves = {}
+        for action in actions:
+            self._wave(action, planned, waves, set())
+        result = [[] for _ in range(max(list(waves.values()) or [-1]) + 1)]
+        for action in actions:
+            result[waves[id(action)]].append(action)
+        return ReconcilePlan(result)
+
+
+    def _wave(self, action, planned, waves, visiting):
+        "Compute wave of action and the actions it depends on"
+        if id(action) not in waves:
+            # a cycle can only come from a broken state, cut it
+            visiting.add(id(action))
+            waves[id(action)] = 1 + max(
+                [self._wave(other, planned, waves, visiting)
+                 for key in action.requires for other in planned.get(key, ())
+                 if id(other) not in visiting] or [-1])
+        return waves[id(action)]
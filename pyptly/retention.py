@@ -0,0 +1,94 @@
+"""
+pyptly.retention
+----------------
+
+Retention rules selecting outdated packages of a package list
+"""
+from pyptly.index import parse_ref
+from pyptly.version import version_ranks
+
+
+def _entries(packages):
+    "Return [(ref, arch, name, version)] of references or 'details'"
+    entries = []
+    for package in packages:
+        ref = package['Key'] if isinstance(package, dict) else package
+        arch, name, version, _ = parse_ref(ref)
+        entries.append((ref, arch, name, version))
+    return entries
+
+
+class RetentionPolicy(object):
+    """Rules deciding which packages of a package list are removed.
+
+    Packages are grouped by name and architecture (by name only without
+    :by_arch). A package is removed if it is not one of the :keep newest
+    versions of its group, or if it is older than the newest version of
+    its group in :older_than. Groups missing from :older_than are not
+    affected by that rule. Packages in :protect are never removed.
+
+        policy = RetentionPolicy(keep=3)
+        policy.removals(api.show_repo_packages('stable'))
+
+    :param keep: number of newest versions kept per group, None for all
+    :param older_than: package references or 'details' dicts, e.g. of
+                       a snapshot
+    :param by_arch: group by architecture as well as by name
+    :param protect: package references which are always kept
+    """
+
+    def __init__(self, keep=None, older_than=None, by_arch=True,
+                 protect=()):
+        if keep is not None and keep < 1:
+            raise ValueError('keep must be positive')
+        self.keep = keep
+        self.older_than = older_than
+        self.by_arch = by_arch
+        self.protect = frozenset(protect)
+
+
+    def _group(self, arch, name):
+        "Group key of a package"
+        return (name, arch) if self.by_arch else name
+
+
+    def _minimums(self, reference, ranks):
+        "Return {group: rank of newest version} of reference entries"
+        minimums = {}
+        for _, arch, name, version in reference:
+            group = self._group(arch, name)
+            minimums[group] = max(minimums.get(group, -1), ranks[version])
+        return minimums
+
+
+    def removals(self, packages):
+        """Return references of packages to remove, in order of packages
+
+        :param packages: package references or 'details' dicts
+        """
+        entries = _entries(packages)
+        reference = _entries(self.older_than or ())
+        # ranks of all versions of both lists compare across lists
+        ranks = version_ranks([entry[3] for entry in entries + reference])
+
+        kept = {}
+        if self.keep is not None:
+            versions = {}
+            for _, arch, name, version in entries:
+                versions.setdefault(self._group(arch, name), set()).add(
+                    ranks[version])
+            for group, group_ranks in versions.items():
+                group_ranks = sorted(group_ranks)
+                kept[group] = group_ranks[max(len(group_ranks) - self.keep,
+                                              0)]
+        minimums = self._minimums(reference, ranks)
+
+        removed = []
+        for ref, arch, name, version in entries:
+            if ref in self.protect:
+                continue
+            group = self._group(arch, name)
+            rank = ranks[version]
+            if rank < kept.get(group, -1) or rank < minimums.get(group, -1):
+                removed.append(ref)
+        return removed
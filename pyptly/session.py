@@ -0,0 +1,83 @@
+"""
+pyptly.session
+--------------
+
+This module provides a pool of keep-alive HTTP sessions shared by
+all threads of a process
+"""
+import os
+import weakref
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SessionPool(object):
+    """Thread-safe pool of persistent HTTP connections.
+
+    Every thread gets its own requests.Session, but all of them are
+    mounted on a single HTTPAdapter, so keep-alive connections are
+    shared across threads while session state is not. The pool is
+    re-created transparently in a child process after os.fork, so
+    parent and child never write to the same socket.
+
+    :param pool_connections: number of per-host connection pools to cache
+    :param pool_maxsize: max number of connections kept open per host
+    :param pool_block: block when no free connection is available instead
+                       of opening a throwaway one
+    :param max_retries: number of retries for failed connections
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10,
+                 pool_block=False, max_retries=0):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.max_retries = max_retries
+        self._reset()
+
+
+    def _reset(self):
+        "Create a new adapter, forgetting every session of the old one"
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # sessions live in the thread local, so they go away with
+        # their thread; the set only finds the live ones for close()
+        self._sessions = weakref.WeakSet()
+        self._adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                    pool_maxsize=self.pool_maxsize,
+                                    pool_block=self.pool_block,
+                                    max_retries=self.max_retries)
+
+
+    @property
+    def session(self):
+        """Return requests.Session of the current thread"""
+        if self._pid != os.getpid():
+            # sockets inherited from the parent process must not be
+            # reused, so just drop them without closing
+            self._reset()
+
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            self._local.session = session
+            with self._lock:
+                self._sessions.add(session)
+        return session
+
+
+    def close(self):
+        """Close all pooled connections. The pool stays usable, new
+        connections are opened on the next request.
+        """
+        with self._lock:
+            sessions = list(self._sessions)
+            adapter = self._adapter
+        for session in sessions:
+            session.close()
+        adapter.close()
+        self._reset()
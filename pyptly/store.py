@@ -0,0 +1,204 @@
+"""
+pyptly.store
+------------
+
+Persistent on-disk cache of immutable aptly data shared by processes
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import weakref
+import threading
+
+# atime of an entry is not rewritten on every read to keep reads cheap
+ATIME_RESOLUTION = 60
+# total size written by other processes is picked up that often
+RESYNC_PUTS = 1000
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    atime REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime);
+'''
+
+
+class _Connection(sqlite3.Connection):
+    "sqlite3 connection which can be weakly referenced"
+
+
+class PackageStore(object):
+    """SQLite backed store of package details and snapshot package
+    lists, shared by all processes of a host.
+
+    Package keys and snapshots never change their contents, so entries
+    are never stale; the store is only bounded in size, least recently
+    used entries are evicted first. The database runs in WAL mode, so
+    readers do not block writers and any number of processes may use
+    the same file::
+
+        store = PackageStore('/var/cache/pyptly/store.db')
+        api = Aptly('http://127.0.0.1:8080', store=store)
+
+    :param path: database file path
+    :param max_bytes: max total size of stored (compressed) values
+    :param timeout: seconds to wait for a lock held by another process
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, timeout=30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._pid = None
+        self._local = None
+        self._size = None
+        self._puts = 0
+        self._connect()
+
+
+    def _connect(self):
+        "Create the database once, forget connections of parent process"
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # weak, a connection is closed when its thread ends
+        self._conns = weakref.WeakSet()
+        self._conn.executescript(_SCHEMA)
+
+
+    @property
+    def _conn(self):
+        "sqlite3 connection of the current thread"
+        if self._pid != os.getpid():
+            self._connect()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # close() may close it from another thread
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False,
+                                   factory=_Connection)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._lock:
+                self._conns.add(conn)
+        return conn
+
+
+    def get(self, kind, key):
+        """Return stored value or None
+
+        :param kind: kind of data, e.g. 'package' or 'snapshot'
+        :param key: unique key within kind
+        """
+        row = self._conn.execute(
+            'SELECT value, atime FROM entries WHERE kind = ? AND key = ?',
+            (kind, key)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        now = time.time()
+        if row[1] < now - ATIME_RESOLUTION:
+            self._conn.execute(
+                'UPDATE entries SET atime = ? WHERE kind = ? AND key = ?',
+                (now, kind, key))
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+
+    def put(self, kind, key, value):
+        """Store JSON serializable value, evict old entries if needed"""
+        blob = zlib.compress(json.dumps(value).encode('utf-8'), 1)
+        self._conn.execute(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+            (kind, key, sqlite3.Binary(blob), len(blob), time.time()))
+
+        # running estimate, summing up the table on every put is slow
+        self._puts += 1
+        if self._size is None or self._puts % RESYNC_PUTS == 0:
+            self._size = self.size()
+        else:
+            self._size += len(blob)
+        if self._size > self.max_bytes:
+            self._size = self.size()
+            if self._size > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+                self._size = self.size()
+
+
+    def _evict(self, target):
+        "Delete least recently used entries until total size <= target"
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            excess = self.size() - target
+            rows = conn.execute(
+                'SELECT rowid, size FROM entries ORDER BY atime')
+            dropped = []
+            for rowid, size in rows:
+                if excess <= 0:
+                    break
+                dropped.append((rowid,))
+                excess -= size
+            conn.executemany('DELETE FROM entries WHERE rowid = ?', dropped)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+    def size(self):
+        """Return total size of stored values"""
+        return self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+
+    def clear(self):
+        """Delete all entries"""
+        self._conn.execute('DELETE FROM entries')
+        self._size = 0
+
+
+    def close(self):
+        """Close connections of all threads. The store stays usable,
+        every thread connects again on its next call; other threads
+        must not be in the middle of a call.
+        """
+        with self._lock:
+            conns = list(self._conns)
+            self._conns.clear()
+            self._local = threading.local()
+        for conn in conns:
+            conn.close()
+
+
+    @staticmethod
+    def snapshot_key(snapshot, params):
+        """Return key of snapshot package listing.
+
+        aptly does not expose snapshot UUID in the API, so a snapshot is
+        identified by name and creation time (and UUID, if present),
+        which differ if a snapshot is deleted and created again.
+
+        :param snapshot: snapshot info as returned by show_snapshot
+        :param params: listing parameters
+        """
+        return json.dumps([snapshot['Name'], snapshot.get('CreatedAt'),
+                           snapshot.get('UUID'),
+                           sorted((key, str(value))
+                                  for key, value in params.items())])
@@ -5,25 +5,317 @@ pyptly.utils
 Miscellaneous module tools
 """
 import re
+import json
+import codecs
+import heapq
+from multiprocessing.pool import ThreadPool
+from pyptly.codec import get_codec
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    # python 2
+    from urllib import quote
+
+# characters allowed unescaped in a path segment (RFC 3986 pchar), '~'
+# is listed because quote escapes it before python 3.7
+SEGMENT_SAFE = "!$&'()*+,;=:@~"
+# max number of remembered results of prefix_sanitized and quote_segment
+MEMO_SIZE = 4096
+
+_DOT_RE = re.compile(r'^\.$')
+_UNDERSCORE_RE = re.compile(r'(?<!_)_(?!_)')
+_SLASH_RE = re.compile(r'/')
+_sanitized = {}
+_quoted = {}
+
+
+def remember(memo, key, value):
+    """Store value in a plain dict memo, emptied once it holds MEMO_SIZE
+    entries, return value
+    """
+    if len(memo) >= MEMO_SIZE:
+        memo.clear()
+    memo[key] = value
+    return value
+
 
 def prefix_sanitized(prefix):
     """Change prefix in accordance with Aptly Publish APIs convention
     https://www.aptly.info/doc/api/publish/
     """
+    try:
+        return _sanitized[prefix]
+    except KeyError:
+        pass
     # replace '.' with ':.'
-    prefix = re.sub(r'^\.$', ':.', prefix)
+    sanitized = _DOT_RE.sub(':.', prefix)
     # replace single underscores with double underscores
-    prefix = re.sub(r'(?<!_)_(?!_)', '__', prefix)
+    sanitized = _UNDERSCORE_RE.sub('__', sanitized)
     # replace slashes with single underscores
-    prefix = re.sub(r'/', '_', prefix)
-    return prefix
+    sanitized = _SLASH_RE.sub('_', sanitized)
+    return remember(_sanitized, prefix, sanitized)
+
+
+def quote_segment(segment):
+    """Percent-encode a single URL path segment, so names containing
+    '/', '%', '?' or spaces reach aptly unchanged
+    """
+    try:
+        return _quoted[segment]
+    except KeyError:
+        pass
+    text = segment
+    if not isinstance(text, (bytes, type(u''))):
+        text = '{0}'.format(text)
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return remember(_quoted, segment, quote(text, safe=SEGMENT_SAFE))
+
+
+def publish_storage(prefix):
+    """Return storage part of a publish prefix, e.g. 's3:bucket' for
+    's3:bucket:dists/', '' for the local storage
+    """
+    prefix = prefix_sanitized(prefix or '.')
+    return prefix.rsplit(':', 1)[0] if ':' in prefix else ''
+
 
+def interleave(groups):
+    """Merge lists into one, taking items of every list in turn"""
+    merged = []
+    groups = [list(group) for group in groups]
+    for pos in range(max([len(group) for group in groups] or [0])):
+        merged.extend(group[pos] for group in groups if pos < len(group))
+    return merged
 
-def response(request):
+
+def response(request, codec=None):
     """API response wrapper
+
+    :param codec: JSONCodec, the fastest installed one by default
+    """
+    return decode(request.content, codec)
+
+
+def async_params(kwargs):
+    """Pop _async flag from keyword arguments, return query parameters
+    which make aptly run the call as a background task
     """
+    if kwargs.pop('_async', False):
+        return {'_async': 1}
+    return {}
+
+
+def is_error(msg):
+    """Check if decoded API response is an error. aptly reports errors
+    either as {"error": ...} or as [{"error": ..., "meta": ...}]
+    """
+    if isinstance(msg, dict):
+        return 'error' in msg
+    return (isinstance(msg, list) and len(msg) > 0 and
+            isinstance(msg[0], dict) and 'error' in msg[0])
+
+
+def error_message(msg):
+    """Return error message of an error response"""
+    if isinstance(msg, list):
+        msg = msg[0] if msg else {}
+    return msg.get('error', msg) if isinstance(msg, dict) else msg
+
+
+def decode(content, codec=None):
+    """Same as response, but for raw response body"""
     try:
-        msg = request.json()
+        msg = get_codec(codec).loads(content)
     except ValueError as err:
         msg = {u'error': err}
     return msg
+
+
+class JSONArrayParser(object):
+    """Incremental parser of a JSON array.
+
+    Feed it with chunks of bytes as they arrive, it returns elements
+    of the top-level array as soon as they are complete::
+
+        parser = JSONArrayParser()
+        for chunk in chunks:
+            for item in parser.feed(chunk):
+                process(item)
+        parser.close()
+
+    A top-level value other than array (e.g. error object) raises
+    ValueError with that value as argument. Malformed data raises
+    ValueError as soon as it arrives.
+    """
+    _whitespace = re.compile(r'[ \t\n\r]*')
+    _special = re.compile(r'["\[\]{}]')
+    _string_special = re.compile(r'["\\]')
+    _scalar_end = re.compile(r'[,\] \t\n\r]')
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._state = 'start'
+        # scan state of the incomplete element at the start of _buffer
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+
+
+    def feed(self, chunk, final=False):
+        """Parse chunk of bytes, return list of completed elements"""
+        items = []
+        buf = self._buffer + self._text.decode(chunk, final)
+        pos = 0
+        while True:
+            pos = self._whitespace.match(buf, pos).end()
+            if pos == len(buf):
+                break
+
+            if self._state == 'start':
+                if buf[pos] != '[':
+                    self._buffer = buf[pos:]
+                    return items
+                pos += 1
+                self._state = 'first'
+            elif self._state == 'end':
+                raise ValueError('extra data after JSON array')
+            elif self._state == 'next' or (self._state == 'first' and
+                                           buf[pos] == ']'):
+                if buf[pos] == ']':
+                    pos += 1
+                    self._state = 'end'
+                elif buf[pos] == ',' and self._state == 'next':
+                    pos += 1
+                    self._state = 'value'
+                else:
+                    raise ValueError('malformed JSON array')
+            else:
+                if buf[pos] in ',:]}':
+                    raise ValueError('malformed JSON array')
+                end = self._element_end(buf, pos, final)
+                if end is None:
+                    break
+                # the element is complete, it is decoded once
+                item, decoded = self._decoder.raw_decode(buf, pos)
+                if decoded != end:
+                    raise ValueError('malformed JSON array element')
+                items.append(item)
+                pos = end
+                self._state = 'next'
+
+        self._buffer = buf[pos:]
+        return items
+
+
+    def _element_end(self, buf, start, final):
+        """Return end of element starting at :start, None if it is not
+        complete yet. Scanning continues where the last chunk ended, so
+        every character is scanned once.
+        """
+        pos = start + self._scanned
+        if buf[start] not in '{["':
+            # numbers and literals may continue in the next chunk
+            match = self._scalar_end.search(buf, pos)
+            if match is None and not final:
+                self._scanned = len(buf) - start
+                return None
+            self._scanned = 0
+            return len(buf) if match is None else match.start()
+
+        depth, in_string = self._depth, self._in_string
+        while True:
+            if in_string:
+                match = self._string_special.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                if match.group() == '\\':
+                    if match.end() == len(buf):
+                        # escaped character is in the next chunk
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                in_string = False
+            else:
+                match = self._special.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                char = match.group()
+                if char == '"':
+                    in_string = True
+                elif char in '[{':
+                    depth += 1
+                else:
+                    depth -= 1
+            pos = match.end()
+            if depth == 0 and not in_string:
+                self._scanned, self._depth, self._in_string = 0, 0, False
+                return pos
+        self._scanned = pos - start
+        self._depth, self._in_string = depth, in_string
+        return None
+
+
+    def close(self):
+        """Parse the rest of data, return list of completed elements"""
+        items = self.feed(b'', final=True)
+        if self._state == 'start':
+            raise ValueError(json.loads(self._buffer) if self._buffer
+                             else 'empty response')
+        if self._state != 'end':
+            raise ValueError('unterminated JSON array')
+        return items
+
+
+def iter_json_array(chunks):
+    """Yield elements of JSON array from iterable of bytes chunks"""
+    parser = JSONArrayParser()
+    for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+    for item in parser.close():
+        yield item
+
+
+def thread_map(func, items, workers):
+    """Apply func to every item using a pool of threads, return results
+    in the order of items
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def split_batches(sizes, batch_size, min_batches=1):
+    """Split items into batches of about batch_size total size each,
+    balanced so that every batch has about the same size
+
+    :param sizes: list of (size, item) pairs
+    :param batch_size: desired total size of a batch
+    :param min_batches: min number of batches if there are enough items
+    """
+    total = sum(size for size, _ in sizes)
+    count = max(-(-total // batch_size), min_batches)
+    count = max(min(count, len(sizes)), 1)
+
+    # largest item first into the lightest batch
+    heap = [(0, num, []) for num in range(count)]
+    for size, item in sorted(sizes, key=lambda pair: -pair[0]):
+        weight, num, batch = heapq.heappop(heap)
+        batch.append(item)
+        heapq.heappush(heap, (weight + size, num, batch))
+    return [batch for _, _, batch in sorted(heap, key=lambda b: b[1])
+            if batch]
@@ -0,0 +1,149 @@
+"""
+pyptly.version
+--------------
+
+Debian package version comparison, same rules as dpkg and aptly
+"""
+import re
+
+_DIGITS = frozenset('0123456789')
+_LETTERS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_EPOCH = re.compile(r'^(\d+):')
+
+
+def parse_version(version):
+    """Split version into (epoch, upstream, revision)"""
+    epoch = 0
+    match = _EPOCH.match(version)
+    if match:
+        epoch = int(match.group(1))
+        version = version[match.end():]
+    upstream, _, revision = version.rpartition('-')
+    if not upstream:
+        upstream, revision = revision, ''
+    return epoch, upstream, revision
+
+
+def _order(char):
+    "Sort weight of a non-digit character, '~' sorts before anything"
+    if char in _LETTERS:
+        return ord(char)
+    if char == '~':
+        return -1
+    return ord(char) + 256
+
+
+def _compare_part(left, right):
+    "dpkg verrevcmp: compare upstream versions or revisions"
+    i = j = 0
+    while i < len(left) or j < len(right):
+        while ((i < len(left) and left[i] not in _DIGITS) or
+               (j < len(right) and right[j] not in _DIGITS)):
+            lorder = _order(left[i]) if (i < len(left) and
+                                         left[i] not in _DIGITS) else 0
+            rorder = _order(right[j]) if (j < len(right) and
+                                          right[j] not in _DIGITS) else 0
+            if lorder != rorder:
+                return -1 if lorder < rorder else 1
+            i += 1
+            j += 1
+
+        start = i
+        while i < len(left) and left[i] in _DIGITS:
+            i += 1
+        lnum = int(left[start:i]) if i > start else 0
+        start = j
+        while j < len(right) and right[j] in _DIGITS:
+            j += 1
+        rnum = int(right[start:j]) if j > start else 0
+        if lnum != rnum:
+            return -1 if lnum < rnum else 1
+    return 0
+
+
+def compare_versions(left, right):
+    """Compare two Debian versions, return -1, 0 or 1"""
+    lepoch, lupstream, lrevision = parse_version(left)
+    repoch, rupstream, rrevision = parse_version(right)
+    if lepoch != repoch:
+        return -1 if lepoch < repoch else 1
+    return (_compare_part(lupstream, rupstream) or
+            _compare_part(lrevision, rrevision))
+
+
+try:
+    _chr = unichr
+except NameError:
+    # python 3
+    _chr = chr
+
+# dpkg order of the non-digit parts of versions, as translation of
+# characters into code points which compare the same way: '~' sorts
+# before the end of a part (_END), letters before everything else
+_END = u'\x02'
+_LEX = dict((code, code + 256) for code in range(128)
+            if chr(code) not in _LETTERS and chr(code) not in _DIGITS)
+_LEX[ord('~')] = 1
+_NUMBERS = re.compile(r'[0-9]+')
+
+
+def _number(digits):
+    "Encode number so encodings compare as numbers, length first"
+    digits = digits.lstrip('0')
+    return _END + _chr(0x30 + len(digits)) + digits
+
+
+_EMPTY = _number('')
+
+
+def _part_key(part):
+    """Sort key of upstream version or revision: non-digit runs are
+    translated, every number is encoded after an _END mark
+    """
+    if not part.strip('0'):
+        # no segments at all, same as an empty part
+        return _EMPTY + _EMPTY
+    key = _NUMBERS.sub(lambda match: _number(match.group()),
+                       part.translate(_LEX))
+    if part[-1] not in _DIGITS:
+        key += _EMPTY
+    # a missing segment compares as an empty one, so two empty segments
+    # are appended: a leading '0' is an empty segment too, the second
+    # one is compared with what follows it ('' > '0~')
+    return key + _EMPTY + _EMPTY
+
+
+def version_key(version):
+    """Return sort key of Debian version, a string: keys compare as
+    compare_versions compares versions, so lists of versions can be
+    sorted without calling compare_versions for every pair
+    """
+    if not isinstance(version, type(u'')):
+        version = version.decode('utf-8')
+    epoch, upstream, revision = parse_version(version)
+    return (_number(str(epoch)) + _part_key(upstream) +
+            _part_key(revision))
+
+
+def version_ranks(versions):
+    """Return {version: rank} of distinct versions, equal versions (e.g.
+    '1.0' and '1.00') get the same rank, newer ones higher ranks
+    """
+    keys = dict((version, version_key(version)) for version in set(versions))
+    ranks = {}
+    rank, last = -1, None
+    for version in sorted(keys, key=keys.__getitem__):
+        if keys[version] != last:
+            rank, last = rank + 1, keys[version]
+        ranks[version] = rank
+    return ranks
+
+
+def sort_versions(versions, reverse=False):
+    """Return versions sorted oldest first (newest first with reverse).
+    Keys are computed once per distinct version, the list itself is
+    sorted by integer ranks.
+    """
+    versions = list(versions)
+    return sorted(versions, key=version_ranks(versions).__getitem__,
+                  reverse=reverse)
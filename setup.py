@@ -15,8 +15,10 @@ setup(name="pyptly",
       author="Nikolai Nozhenko",
       author_email="nik.nozhenko@gmail.com",
       url="http://github.com/repelista/pyaptly",
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks']),
       install_requires=reqs,
+      python_requires='>=2.7',
+      extras_require={'async': ['aiohttp>=3.3'], 'fast': ['orjson']},
       keywords="aptly library",
       classifiers=[
           'Development Status :: 4 - Beta',
@@ -25,7 +27,6 @@ setup(name="pyptly",
           'Operating System :: OS Independent',
           'Programming Language :: Python',
           'Programming Language :: Python :: 2',
-          'Programming Language :: Python :: 2.6',
           'Programming Language :: Python :: 2.7',
           'Programming Language :: Python :: 3.3',
           'Programming Language :: Python :: 3.4',
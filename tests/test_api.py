@@ -1,8 +1,12 @@
 import pyptly
 import os
+import shutil
+import tempfile
 import six
-from .conf import (AptlyTestCase, assert_is_instance, assert_equals,
-                   assert_in, assert_true, assert_raises)
+import pyptly.metrics
+from pyptly.deb import inspect_debs
+from .conf import (AptlyTestCase, unittest, assert_is_instance,
+                   assert_equals, assert_in, assert_true, assert_raises)
 
 
 class Test_local_repo_methods(AptlyTestCase):
@@ -58,6 +62,15 @@ class Test_misc_methods(AptlyTestCase):
     def test_get_graph(self):
         file_path = self.api.get_graph()
         assert os.path.exists(file_path['Path'])
+        assert_equals(file_path['Size'], os.path.getsize(file_path['Path']))
+
+    def test_get_graph_in_memory(self):
+        graph = self.api.get_graph(in_memory=True, chunk_size=1024)
+        assert_equals(len(graph['Content']), graph['Size'])
+        assert_equals(graph['Content'][:4].tobytes(), b'\x89PNG')
+        buf = six.BytesIO()
+        graph = self.api.get_graph(fileobj=buf)
+        assert_equals(len(buf.getvalue()), graph['Size'])
 
 
 class Test_package_api(AptlyTestCase):
@@ -87,10 +100,14 @@ class Test_package_api(AptlyTestCase):
 
     def test_3_show_pkg_bykey(self):
         repo_pkgs = self.api.show_repo_packages(self.repo_name)
-        escaped_key = repo_pkgs[0].replace(' ', '%20')
-        pkg = self.api.show_pkg_bykey(escaped_key)
+        pkg = self.api.show_pkg_bykey(repo_pkgs[0])
         assert_in('ShortKey', pkg)
 
+    def test_3_show_pkgs_bykeys(self):
+        repo_pkgs = self.api.show_repo_packages(self.repo_name)
+        pkgs = self.api.show_pkgs_bykeys(repo_pkgs + repo_pkgs, workers=2)
+        assert_equals([pkg['Key'] for pkg in pkgs], repo_pkgs + repo_pkgs)
+
     def test_4_show_pkg_bykey(self):
         repo_info = self.api.create_local_repo('test_repo2')
         repo_pkgs = self.api.show_repo_packages(self.repo_name)
@@ -105,6 +122,14 @@ class Test_package_api(AptlyTestCase):
                                             PackageRefs=[repo_pkgs[0]])
         assert_equals(repo_info, del_pkg)
 
+    def test_6_iter_repo_packages(self):
+        repo_pkgs = self.api.show_repo_packages(self.repo_name,
+                                                format='details')
+        iter_pkgs = self.api.iter_repo_packages(self.repo_name,
+                                                chunk_size=100,
+                                                format='details')
+        assert_equals(list(iter_pkgs), repo_pkgs)
+
 
 class Test_publish(AptlyTestCase):
 
@@ -138,6 +163,16 @@ class Test_publish(AptlyTestCase):
                                               Signing={"Skip": True})
         assert_equals(upd_publish['Distribution'], self.publish_distr)
 
+    def test_3_update_publish_many(self):
+        params = {'Signing': {'Skip': True}}
+        targets = [(self.prefix, self.publish_distr, params),
+                   (self.prefix, 'missing-distr', params)]
+        reports = self.api.update_publish_many(targets, workers=2)
+        assert_equals(reports[0]['Result']['Distribution'], self.publish_distr)
+        assert_equals(reports[0]['Storage'], '')
+        assert_in('Time', reports[0])
+        assert_in('error', reports[1])
+
     def test_4_delete_publish(self):
         del_publish = self.api.delete_publish(self.publish_distr,
                                               prefix=self.prefix,
@@ -185,16 +220,45 @@ class Test_snapshots(AptlyTestCase):
                                                         PackageRefs=repo_pkgs)
         assert_equals(create_snap['Name'], self.snapshot_name2)
 
+    def test_5_merge_snapshots(self):
+        merged = self.api.merge_snapshots(
+            'snap-test-merged', [self.snapshot_name1, self.snapshot_name2],
+            mode='latest')
+        assert_equals(merged['Name'], 'snap-test-merged')
+        assert_equals(
+            sorted(self.api.show_snapshot_packages('snap-test-merged')),
+            sorted(self.api.show_snapshot_packages(self.snapshot_name1)))
+        self.api.delete_snapshot('snap-test-merged')
+
     def test_6_show_snapshot_packages(self):
         snap_pkgs = self.api.show_snapshot_packages(self.snapshot_name1,
                                                     format='details')
         assert_is_instance(snap_pkgs, list)
 
+    def test_6_iter_snapshot_packages(self):
+        snap_pkgs = self.api.show_snapshot_packages(self.snapshot_name1)
+        iter_pkgs = self.api.iter_snapshot_packages(self.snapshot_name1)
+        assert_equals(list(iter_pkgs), snap_pkgs)
+
+    def test_6_search_snapshot_packages(self):
+        query = 'Name (~ .), !$Architecture (source)'
+        snap_pkgs = self.api.show_snapshot_packages(self.snapshot_name1,
+                                                    q=query)
+        found = self.api.search_snapshot_packages(self.snapshot_name1, query)
+        assert_equals(sorted(found), sorted(snap_pkgs))
+        assert_in(self.snapshot_name1, self.api.snapshot_indexes)
+
     def test_7_snapshots_diff(self):
         snap_diff = self.api.snapshots_diff(self.snapshot_name1,
                                             self.snapshot_name2)
         assert_equals(snap_diff, [])
 
+    def test_7_prune_repo(self):
+        report = self.api.prune_repo(self.repo_name, keep=1,
+                                     older_than=self.snapshot_name1,
+                                     dry_run=True)
+        assert_equals(report, {'Removed': [], 'Added': []})
+
     def test_8_delete_snapshot(self):
         snap_delete1 = self.api.delete_snapshot(self.snapshot_name1, force=1)
         snap_delete2 = self.api.delete_snapshot(self.snapshot_name2)
@@ -243,8 +307,175 @@ class Test_upload_files(AptlyTestCase):
         rm_dir = self.api.delete_dir(self.upload_dir)
         assert_true(not bool(rm_dir))
 
+    def test_6_upload_many(self):
+        pkgs = [self.test_pkg1, self.test_pkg2, self.test_pkg3]
+        uploaded = self.api.upload_many(self.upload_dir, pkgs, workers=2,
+                                        batch_bytes=1)
+        assert_equals(uploaded, [self.upload_dir + '/' + os.path.basename(pkg)
+                                 for pkg in pkgs])
+        self.api.delete_dir(self.upload_dir)
+
+    def test_7_upload_new_files(self):
+        pkgs = [self.test_pkg1, self.test_pkg2, self.test_pkg3]
+        self.api.upload_files(self.upload_dir, pkgs[:2])
+        self.api.add_uploaded_pkg(self.repo_name, self.upload_dir)
+        report = self.api.upload_new_files(self.upload_dir, pkgs,
+                                           repo=self.repo_name)
+        assert_equals(report['Uploaded'],
+                      [self.upload_dir + '/' + os.path.basename(pkgs[2])])
+        assert_equals(sorted(report['Skipped']), sorted(pkgs[:2]))
+        self.api.delete_dir(self.upload_dir)
+
+    def test_8_inspect_debs(self):
+        # keys computed offline match the ones of imported packages
+        details = inspect_debs([self.test_pkg1, self.test_pkg2])
+        assert_equals(sorted(pkg['Key'] for pkg in details),
+                      sorted(self.api.show_repo_packages(self.repo_name)))
+
+
+class Test_tasks(AptlyTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.api.create_local_repo(cls.repo_name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.api.delete_snapshot(cls.snapshot_name1)
+        cls.api.delete_local_repo(cls.repo_name, force=1)
+        cls.api.clear_tasks()
+
+    def test_1_wait_tasks(self):
+        task = self.api.create_snapshot_from_repo(self.repo_name, _async=True,
+                                                  Name=self.snapshot_name1)
+        assert_in('ID', task)
+        tasks = self.api.wait_tasks([task, 1 << 30], timeout=60)
+        assert_equals(tasks[0]['ID'], task['ID'])
+        assert_equals(tasks[0]['State'], pyptly.api.TASK_SUCCEEDED)
+        assert_equals(tasks[1]['State'], pyptly.api.TASK_FAILED)
+        snap_info = self.api.show_snapshot(self.snapshot_name1)
+        assert_equals(snap_info['Name'], self.snapshot_name1)
+
+
+def test_update_tasks():
+    tasks = {}
+    listing = [{'ID': 1, 'State': pyptly.api.TASK_RUNNING},
+               {'ID': 2, 'State': pyptly.api.TASK_SUCCEEDED}]
+    assert_equals(pyptly.api.update_tasks([1, 2, 3], listing, tasks), 2)
+    assert_equals(tasks[1]['State'], pyptly.api.TASK_RUNNING)
+    assert_equals(tasks[3]['State'], pyptly.api.TASK_FAILED)
+    # finished tasks are counted once
+    listing = [{'ID': 1, 'State': pyptly.api.TASK_FAILED}]
+    assert_equals(pyptly.api.update_tasks([1, 2, 3], listing, tasks), 1)
+    assert_equals(pyptly.api.task_id({'ID': 5}), 5)
+
+
+def test_GraphSink():
+    # Content-Length too small, too large and unknown
+    for size in (3, 100, None):
+        sink = pyptly.api.GraphSink('unused', in_memory=True, size=size)
+        with sink:
+            for chunk in (b'abc', b'', b'defg'):
+                sink.write(chunk)
+        report = sink.report(0)
+        assert_equals(report['Size'], 7)
+        assert_equals(report['Content'].tobytes(), b'abcdefg')
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'graph.png')
+        with pyptly.api.GraphSink(path) as sink:
+            sink.write(b'png')
+        assert_equals(os.listdir(tmpdir), ['graph.png'])
+        # a failed download keeps the complete graph and leaves no part
+        try:
+            with pyptly.api.GraphSink(path) as sink:
+                sink.write(b'p')
+                raise IOError('connection reset')
+        except IOError:
+            pass
+        assert_equals(os.listdir(tmpdir), ['graph.png'])
+        with open(path, 'rb') as file_pointer:
+            assert_equals(file_pointer.read(), b'png')
+    finally:
+        shutil.rmtree(tmpdir)
+
 
 def test_Aptly():
     api = pyptly.Aptly('127.0.0.1:8080')
     assert_equals(api.host, 'http://' + '127.0.0.1:8080')
     assert_raises(ValueError, pyptly.Aptly, None, None)
+
+
+def test_Aptly_urls():
+    api = pyptly.Aptly('127.0.0.1:8080')
+    assert_equals(api._url('repos'), 'http://127.0.0.1:8080/api/repos')
+    assert_equals(api._url('repo_file', 'main/contrib', 'in coming', 'a%b'),
+                  'http://127.0.0.1:8080/api/repos/main%2Fcontrib'
+                  '/file/in%20coming/a%25b')
+    assert_equals(api._url('packages', 'Pamd64 foo 1.0+b1 0123'),
+                  'http://127.0.0.1:8080/api/packages/Pamd64%20foo'
+                  '%201.0+b1%200123')
+    assert_equals(api._url('publish_distr', ':.', 'stable'),
+                  'http://127.0.0.1:8080/api/publish/:./stable')
+    assert_equals(api._url('task', 12), 'http://127.0.0.1:8080/api/tasks/12')
+
+
+def test_Aptly_json_headers():
+    api = pyptly.Aptly('127.0.0.1:8080')
+    headers = api._json_headers()
+    assert_equals(headers, {'Content-Type': 'application/json'})
+    assert_true(api._json_headers() is headers)
+    api.headers['X-Token'] = 'secret'
+    assert_equals(api._json_headers(), {'Content-Type': 'application/json',
+                                        'X-Token': 'secret'})
+
+
+def test_Aptly_metrics():
+    metrics = pyptly.metrics.Metrics()
+    api = pyptly.Aptly('127.0.0.1:8080', metrics=metrics)
+    api.aptly_version
+    summary = metrics.summary()['GET version']
+    assert_equals(summary['count'], 1)
+    assert_true(summary['received'] > 0)
+    assert_equals(metrics.decode['version'].count, 1)
+    assert_equals(api._endpoint(api.api + '/version?x=1'), 'version')
+
+
+def test_Aptly_close():
+    with pyptly.Aptly('127.0.0.1:8080', pool_maxsize=2) as api:
+        assert_is_instance(api.aptly_version, dict)
+        assert_is_instance(api.aptly_version, dict)
+    # pool is re-created on demand after close
+    assert_is_instance(api.aptly_version, dict)
+
+
+def test_SessionPool_threads():
+    import gc
+    from pyptly.session import SessionPool
+    from pyptly.utils import thread_map
+    pool = SessionPool()
+    main = pool.session
+    for _ in range(50):
+        thread_map(lambda num: pool.session, range(4), 4)
+    gc.collect()
+    # sessions of finished worker threads are not kept
+    assert_equals(list(pool._sessions), [main])
+    pool.close()
+    assert_equals(len(pool._sessions), 0)
+
+
+def test_AsyncAptly():
+    if not hasattr(pyptly, 'AsyncAptly'):
+        raise unittest.SkipTest('aiohttp is not installed')
+    import asyncio
+    loop = asyncio.new_event_loop()
+    api = pyptly.AsyncAptly('127.0.0.1:8080', max_concurrency=2)
+    try:
+        versions = loop.run_until_complete(
+            asyncio.gather(*[api.aptly_version for _ in range(5)]))
+        for version in versions:
+            assert_is_instance(version['Version'], six.string_types)
+    finally:
+        loop.run_until_complete(api.close())
+        loop.close()
@@ -0,0 +1,92 @@
+from pyptly.batch import RepoBatch
+from pyptly.flow import run
+from .conf import assert_equals, assert_true, assert_raises
+
+
+class FakeApi(object):
+    "Records PackageRefs requests, rejects refs of packages named bad"
+
+    _run = staticmethod(run)
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def _apply(self, verb, refs):
+        self.calls.append((verb, list(refs)))
+        if self.error is not None:
+            return {'error': self.error}
+        bad = [ref for ref in refs if ref.split(' ')[1] == 'bad']
+        if bad:
+            return [{'error': 'conflict in ' + bad[0], 'meta': ''}]
+        return {'Name': 'repo'}
+
+    def add_pkg_bykey(self, name, PackageRefs):
+        return self._apply('POST', PackageRefs)
+
+    def delete_pkg_bykey(self, name, PackageRefs):
+        return self._apply('DELETE', PackageRefs)
+
+
+def ref(name, num=1):
+    return 'Pamd64 {0} {1} {1:08x}'.format(name, num)
+
+
+def test_batch_coalesce():
+    api = FakeApi()
+    with RepoBatch(api, 'repo', batch_size=2) as batch:
+        batch.update(add=[ref('a'), ref('b'), ref('c'), ref('d')])
+        batch.remove(ref('b'))
+        batch.remove({'Key': ref('a', 0)})
+        # removed and added back
+        batch.remove(ref('e'))
+        batch.add(ref('e'))
+        assert_equals(len(batch), 4)
+    assert_equals(api.calls, [('DELETE', [ref('a', 0)]),
+                              ('POST', [ref('a'), ref('c')]),
+                              ('POST', [ref('d')])])
+    assert_equals(batch.result, {'Removed': [ref('a', 0)],
+                                 'Added': [ref('a'), ref('c'), ref('d')]})
+    assert_equals(len(batch), 0)
+
+
+def test_batch_errors():
+    api = FakeApi()
+    batch = RepoBatch(api, 'repo', batch_size=8)
+    refs = [ref('p', num) for num in range(7)]
+    refs.insert(5, ref('bad'))
+    batch.update(add=refs)
+    result = batch.flush()
+    assert_equals(result['Added'], [r for r in refs if r != ref('bad')])
+    assert_equals(dict(result['FailedRefs']),
+                  {ref('bad'): 'conflict in ' + ref('bad')})
+    assert_true('error' in result)
+    # one chunk, halves down to the bad ref
+    assert_equals(len(api.calls), 7)
+
+
+def test_batch_repo_error():
+    api = FakeApi('local repo with name repo not found')
+    refs = [ref('p', num) for num in range(10)]
+    with RepoBatch(api, 'repo', batch_size=8) as batch:
+        batch.update(add=refs)
+    # no bisection of errors which are not about packages
+    assert_equals(len(api.calls), 2)
+    assert_equals(batch.result['Added'], [])
+    assert_equals(list(batch.result['FailedRefs']), refs)
+    api = FakeApi('unable to add package to repo: conflict in package '
+                  'p_3_amd64')
+    assert_true(RepoBatch._package_error(api.error, refs[2:4]))
+    assert_true(not RepoBatch._package_error(api.error, refs[:2]))
+
+
+def test_batch_discard():
+    api = FakeApi()
+    try:
+        with RepoBatch(api, 'repo') as batch:
+            batch.add(ref('a'))
+            raise KeyError()
+    except KeyError:
+        pass
+    assert_equals(api.calls, [])
+    assert_raises(ValueError, RepoBatch, api, 'repo', 0)
@@ -0,0 +1,90 @@
+import time
+import pyptly
+from pyptly.cache import ResponseCache, Memo
+from .conf import assert_equals, assert_true
+
+url = 'http://127.0.0.1:8080/api'
+
+
+def test_cache_ttl():
+    cache = ResponseCache(default_ttl=60, ttl={'version': 0.01, 'files': 0})
+    key = cache.key(url + '/version')
+    assert_equals(cache.get(key), None)
+    cache.store(key, 'version', b'{}', {})
+    assert_equals(cache.get(key).content, b'{}')
+    time.sleep(0.02)
+    assert_equals(cache.get(key), None)
+    assert_true(not cache.enabled('files'))
+    assert_true(not cache.enabled('tasks'))
+    # endpoint of every task call is tasks
+    api = pyptly.Aptly('127.0.0.1:8080')
+    assert_true(not cache.enabled(api._endpoint(api._url('task_wait', 1))))
+    assert_equals(cache.stats()['hits'], 1)
+    assert_equals(cache.stats()['misses'], 2)
+
+
+def test_cache_key():
+    assert_equals(ResponseCache.key(url, {'b': 1, 'a': 'x'}),
+                  ResponseCache.key(url, {'a': 'x', 'b': '1'}))
+    assert_equals(ResponseCache.key(url, {}), url)
+
+
+def test_cache_lru():
+    cache = ResponseCache(max_entries=2)
+    for name in ('a', 'b', 'c'):
+        cache.store(name, 'repos', name, {})
+        cache.get('a')
+    assert_equals(sorted(cache._entries), ['a', 'c'])
+
+
+def test_cache_revalidation():
+    cache = ResponseCache(ttl={'repos': 0.01})
+    cache.store('a', 'repos', b'[]', {'ETag': '"1"'})
+    time.sleep(0.02)
+    entry = cache.get('a')
+    assert_equals(entry.validators, {'If-None-Match': '"1"'})
+    cache.refresh('a')
+    assert_true(cache.get('a').expires > time.time())
+    assert_equals(cache.stats()['revalidations'], 1)
+
+
+def test_cache_invalidate():
+    cache = ResponseCache()
+    for endpoint in ('repos', 'snapshots', 'publish', 'files', 'version'):
+        cache.store(endpoint, endpoint, b'[]', {})
+    cache.invalidate('publish')
+    assert_equals(len(cache), 4)
+    cache.invalidate('snapshots')
+    assert_equals(sorted(cache._entries), ['files', 'repos', 'version'])
+    cache.invalidate('repos')
+    assert_equals(sorted(cache._entries), ['version'])
+    cache.invalidate('tasks')
+    assert_equals(len(cache), 1)
+    cache.invalidate('mirrors')
+    assert_equals(len(cache), 0)
+    assert_equals(cache.stats()['invalidations'], 5)
+
+
+def test_memo():
+    memo = Memo()
+    for num in range(100):
+        memo.set(num, {'Key': num})
+    assert_equals(len(memo), 100)
+    assert_equals(memo.get(5), {'Key': 5})
+    assert_equals(memo.get(500), None)
+
+    memo = Memo(max_entries=2)
+    for num in range(3):
+        memo.set(num, num + 1)
+        memo.get(0)
+    assert_equals(sorted(memo._entries), [0, 2])
+
+    memo = Memo(max_entries=0)
+    memo.set(1, 1)
+    assert_equals(len(memo), 0)
+
+    memo = Memo()
+    memo.set(1, 1)
+    memo.discard(1)
+    memo.discard(2)
+    assert_equals(len(memo), 0)
@@ -0,0 +1,108 @@
+import pyptly
+from pyptly.cleanup import (ReferenceGraph, CleanupPolicy, snapshot_sources,
+                            created_at, merged_description,
+                            pulled_description, filtered_description)
+from .conf import assert_equals, assert_raises
+
+DAY = 86400
+NOW = created_at('2020-03-01T00:00:00Z')
+
+repos = [{'Name': 'stable'}, {'Name': 'testing'}, {'Name': 'old'}]
+snapshots = [
+    {'Name': 'base', 'CreatedAt': '2020-01-01T10:00:00.123456789Z',
+     'Description': 'Snapshot from local repo [stable]: main packages'},
+    {'Name': 'updates', 'CreatedAt': '2020-01-02T10:00:00+02:00',
+     'Description': 'Snapshot from local repo [testing]'},
+    {'Name': 'merged', 'CreatedAt': '2020-01-03T10:00:00Z',
+     'Description': merged_description(['base', 'updates'])},
+    {'Name': 'filtered', 'CreatedAt': '2020-01-04T10:00:00Z',
+     'Description': filtered_description('merged', 'Name (~ ^python)')},
+    {'Name': 'pulled', 'CreatedAt': '2020-02-28T10:00:00Z',
+     'Description': pulled_description('base', 'updates', ['nginx'])},
+    {'Name': 'release-1', 'CreatedAt': '2019-01-01T00:00:00Z',
+     'Description': 'Snapshot from local repo [old]'},
+    {'Name': 'live', 'CreatedAt': '2019-06-01T00:00:00Z',
+     'Description': ''}]
+published = [{'Prefix': '.', 'Distribution': 'stable',
+              'SourceKind': 'snapshot',
+              'Sources': [{'Component': 'main', 'Name': 'live'}]},
+             {'Prefix': 'testing', 'Distribution': 'testing',
+              'SourceKind': 'local',
+              'Sources': [{'Component': 'main', 'Name': 'testing'}]}]
+
+
+def test_snapshot_sources():
+    assert_equals(snapshot_sources(snapshots[0]), ([], ['stable']))
+    assert_equals(snapshot_sources(snapshots[2]), (['base', 'updates'], []))
+    assert_equals(snapshot_sources(snapshots[3]), (['merged'], []))
+    assert_equals(snapshot_sources(snapshots[4]), (['base', 'updates'], []))
+    assert_equals(snapshot_sources({'Name': 'x'}), ([], []))
+
+
+def test_created_at():
+    assert_equals(created_at('2020-01-02T10:00:00+02:00'),
+                  created_at('2020-01-02T08:00:00Z'))
+    assert_equals(created_at('2020-01-02T07:30:00.5-00:30'),
+                  created_at('2020-01-02T08:00:00Z'))
+    assert_equals(created_at('yesterday'), None)
+
+
+def test_plan():
+    graph = ReferenceGraph(repos, snapshots, published)
+    assert_equals(graph.ancestors(['filtered']),
+                  set(['filtered', 'merged', 'base', 'updates']))
+
+    assert_equals(CleanupPolicy().plan(graph, ['upload-1']).dirs, [])
+    plan = CleanupPolicy(dirs=True).plan(graph, ['upload-1', 'keep-me'])
+    assert_equals(plan.waves, [['filtered', 'pulled', 'release-1'],
+                               ['merged'], ['base', 'updates']])
+    assert_equals(plan.dirs, ['upload-1', 'keep-me'])
+    assert_equals(plan.kept, {'live': 'published'})
+    assert_equals(plan.repos, ['stable', 'old'])
+    assert_equals(plan.blockers('base'), ['merged', 'pulled'])
+    assert_equals(len(plan), 8)
+
+    plan = CleanupPolicy(older_than=30 * DAY, protect=['release-*', 'keep*'],
+                         dirs=True).plan(graph, ['upload-1', 'keep-me'],
+                                         now=NOW)
+    assert_equals(plan.snapshots, ['filtered', 'merged'])
+    assert_equals(plan.dirs, ['upload-1'])
+    assert_equals(plan.kept, {'pulled': 'recent', 'release-1': 'protected',
+                              'live': 'published',
+                              'base': 'source of kept snapshot',
+                              'updates': 'source of kept snapshot'})
+    assert_equals(plan.repos, [])
+    assert_raises(ValueError, CleanupPolicy, -1)
+
+
+def test_collect_garbage():
+    api = pyptly.Aptly('127.0.0.1:8080')
+    deleted = []
+    api._call = lambda url, verb, **kwargs: {
+        'repos': repos, 'snapshots': snapshots, 'publish': published,
+        'files': ['upload-1']}[url.split('/api/')[1]]
+
+    def delete_snapshot(name):
+        deleted.append(name)
+        return {'error': 'in use'} if name == 'merged' else {}
+    api.delete_snapshot = delete_snapshot
+    api.delete_dir = lambda name: deleted.append(name) or {}
+
+    assert_equals(api.collect_garbage(dry_run=True)['Dirs'], [])
+    report = api.collect_garbage(dirs=True, dry_run=True)
+    assert_equals(report['Snapshots'], ['filtered', 'pulled', 'release-1',
+                                        'merged', 'base', 'updates'])
+    assert_equals(report['Dirs'], ['upload-1'])
+    assert_equals(deleted, [])
+
+    report = api.collect_garbage(dirs=True, workers=2)
+    assert_equals(sorted(deleted), ['filtered', 'merged', 'pulled',
+                                    'release-1', 'upload-1'])
+    assert_equals(report['Snapshots'], ['filtered', 'pulled', 'release-1'])
+    assert_equals(report['Dirs'], ['upload-1'])
+    assert_equals(sorted(report['Failed']), ['base', 'merged', 'updates'])
+    assert_equals(report['Failed']['base'],
+                  'snapshot merged created from it was not deleted')
+
+    api._call = lambda url, verb, **kwargs: {'error': 'down'}
+    assert_equals(api.collect_garbage(), {'error': 'down'})
@@ -0,0 +1,35 @@
+from pyptly.codec import get_codec, JSONCodec, PREFERRED, STDLIB
+from pyptly.utils import decode
+from .conf import assert_equals, assert_raises, assert_true, assert_in
+
+DATA = {'PackageRefs': ['Pamd64 unzip 6.0-16+deb8u2 a1b2c3d4'],
+        'Description': u'caf\xe9 / "quoted"', 'Size': 2 ** 40,
+        'Nested': [None, True, 1.5, {}]}
+
+
+def test_codecs():
+    for name in PREFERRED:
+        try:
+            codec = get_codec(name)
+        except ImportError:
+            continue
+        body = codec.dumps(DATA)
+        assert_true(isinstance(body, bytes))
+        assert_equals(STDLIB.loads(body), DATA)
+        assert_equals(codec.loads(STDLIB.dumps(DATA)), DATA)
+        assert_raises(ValueError, codec.loads, b'{"error": ')
+
+
+def test_get_codec():
+    assert_in(get_codec().name, PREFERRED)
+    assert_true(get_codec('json') is STDLIB)
+    custom = JSONCodec('custom', STDLIB.dumps, STDLIB.loads)
+    assert_true(get_codec(custom) is custom)
+    assert_raises(ValueError, get_codec, 'yaml')
+
+
+def test_decode():
+    assert_equals(decode(b'{"Version": "1.3.0"}', 'json'),
+                  {'Version': '1.3.0'})
+    assert_in('error', decode(b'<html>', 'json'))
+    assert_in('error', decode(b''))
@@ -0,0 +1,111 @@
+import pyptly
+from pyptly.compose import (merge_refs, pull_refs, newest, filter_refs,
+                            merged_packages, pulled_packages)
+from .conf import assert_equals, assert_raises
+
+snap1 = ['Pamd64 nginx 1.6-1 00000001',
+         'Pi386 nginx 1.6-1 00000002',
+         'Pamd64 zlib1g 1.2.8 00000003']
+snap2 = ['Pamd64 nginx 1.4-1 00000004',
+         'Pamd64 unzip 6.0-16 00000005']
+snap3 = ['Pamd64 nginx 1.8-1 00000006',
+         'Pamd64 nginx 1.7-1 00000007']
+
+
+def test_merge_refs():
+    assert_equals(merge_refs([snap1, snap2, snap3]),
+                  [snap3[0], snap3[1], snap2[1], snap1[1], snap1[2]])
+    assert_equals(merge_refs([snap1, snap2, snap3], mode='first'),
+                  snap1 + snap2[1:])
+    assert_equals(merge_refs([snap1, snap2, snap3], mode='latest'),
+                  [snap3[0], snap1[1], snap1[2], snap2[1]])
+    assert_equals(merge_refs([snap1, snap1, snap2], mode='all'),
+                  snap1 + snap2)
+    assert_equals(merge_refs([[{'Key': ref} for ref in snap2]]), snap2)
+    assert_raises(ValueError, merge_refs, [snap1], 'newest')
+
+
+def test_newest():
+    assert_equals(newest(snap3 + snap2), snap3[:1] + snap2[1:])
+    # later refs win ties
+    assert_equals(newest(['Pamd64 a 1.0 00000001', 'Pamd64 a 1.00 00000002']),
+                  ['Pamd64 a 1.00 00000002'])
+
+
+def test_filter():
+    assert_equals(filter_refs(snap1, '!$Architecture (i386)'),
+                  [snap1[0], snap1[2]])
+    details = [{'Key': snap2[0], 'Package': 'nginx', 'Priority': 'extra'},
+               {'Key': snap2[1], 'Package': 'unzip', 'Priority': 'optional'}]
+    assert_equals(merged_packages([snap1, details], 'latest',
+                                  'Priority (extra) | zlib1g'),
+                  [snap1[2]])
+    assert_equals(merged_packages([snap1, details], 'last',
+                                  'Priority (extra) | zlib1g'),
+                  [snap2[0], snap1[2]])
+
+
+def test_all_packages():
+    refs = snap1 + ['Pall nginx-doc 1.6-1 00000008',
+                    'Pall nginx 1.5-1 00000009']
+    # 'all' packages match every architecture, as in aptly
+    assert_equals(filter_refs(refs, '!$Architecture (i386)'),
+                  [snap1[0], snap1[2]])
+    assert_equals(filter_refs(refs, '!Architecture (i386)'),
+                  [snap1[0], snap1[2], refs[3], refs[4]])
+    assert_equals(merged_packages([refs, snap2], 'last', 'nginx {amd64}'),
+                  [snap2[0], refs[4]])
+    # a pulled amd64 package replaces 'all' packages of its name
+    assert_equals(pull_refs(refs, snap3[:1]),
+                  [snap1[1], snap1[2], refs[3], snap3[0]])
+    assert_equals(pull_refs(refs, ['Pall nginx 1.7-1 0000000a']),
+                  snap1 + [refs[3], 'Pall nginx 1.7-1 0000000a'])
+
+
+def test_pull():
+    assert_equals(pulled_packages([snap3, snap2[1:]]),
+                  [snap3[0], snap2[1]])
+    assert_equals(pulled_packages([snap3], all_matches=True), snap3)
+    assert_equals(pull_refs(snap1, snap3[:1]),
+                  [snap1[1], snap1[2], snap3[0]])
+    assert_equals(pull_refs(snap1, snap3[:1], remove=False),
+                  snap1 + snap3[:1])
+
+
+def test_compose_api():
+    api = pyptly.Aptly('127.0.0.1:8080')
+    snapshots = {'snap1': snap1, 'snap2': snap2, 'snap3': snap3}
+    created = []
+    api.show_snapshot_packages = lambda name, **kwargs: snapshots.get(
+        name, {'error': 'snapshot not found'})
+    api.create_snapshot_from_pkg = lambda **kwargs: created.append(
+        kwargs) or {'Name': kwargs['Name']}
+
+    assert_equals(api.merge_snapshots('merged', ['snap1', 'snap2', 'snap3'],
+                                      mode='latest', q='!$Architecture (i386)',
+                                      Description='merged'),
+                  {'Name': 'merged'})
+    assert_equals(created.pop(), {
+        'Name': 'merged', 'SourceSnapshots': ['snap1', 'snap2', 'snap3'],
+        'PackageRefs': [snap3[0], snap1[2], snap2[1]],
+        'Description': 'merged'})
+    assert_equals(api.merge_snapshots('merged', ['snap1', 'missing']),
+                  {'error': 'snapshot not found'})
+
+    api.filter_snapshot('filtered', 'snap1', 'nginx')
+    assert_equals(created.pop(), {'Name': 'filtered',
+                                  'SourceSnapshots': ['snap1'],
+                                  'PackageRefs': snap1[:2],
+                                  'Description': "Filtered 'snap1', query "
+                                                 "was: 'nginx'"})
+
+    api.pull_snapshot('pulled', 'snap1', 'snap3', ['nginx (>= 1.0)'])
+    assert_equals(created.pop(), {'Name': 'pulled',
+                                  'SourceSnapshots': ['snap1', 'snap3'],
+                                  'PackageRefs': [snap1[1], snap1[2],
+                                                  snap3[0]],
+                                  'Description': "Pulled into 'snap1' with "
+                                                 "'snap3' as source, pull "
+                                                 "request was: 'nginx "
+                                                 "(>= 1.0)'"})
+    assert_equals(created, [])
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+from pyptly.deb import (parse_control, read_control, files_hash, inspect_deb,
+                        inspect_debs)
+from pyptly.hashes import file_checksums
+from pyptly.index import parse_ref
+from .conf import (unittest, assert_equals, assert_true, assert_raises,
+                   AptlyTestCase)
+
+
+def test_parse_control():
+    text = ('Package: foo\n'
+            'Version: 1:2.0-1\n'
+            'Description: short\n'
+            ' long line\n'
+            ' .\n'
+            '\n'
+            'Package: ignored\n')
+    assert_equals(parse_control(text),
+                  [('Package', 'foo'), ('Version', '1:2.0-1'),
+                   ('Description', 'short\n long line\n .')])
+    assert_raises(ValueError, parse_control, ' orphan\n')
+    assert_raises(ValueError, parse_control, 'no colon\n')
+
+
+def test_read_control():
+    control = read_control(AptlyTestCase.test_pkg3)
+    assert_equals(control['Package'], 'unzip')
+    assert_equals(control['Version'], '6.0-16+deb8u2')
+    assert_equals(control['Architecture'], 'amd64')
+    assert_raises(ValueError, read_control, 'README.md')
+
+
+def test_files_hash():
+    checksums = {'Size': 1, 'MD5sum': 'a', 'SHA1': 'b', 'SHA256': 'c'}
+    one = files_hash([('x.deb', checksums)])
+    assert_equals(one, files_hash([('x.deb', dict(checksums))]))
+    assert_true(one != files_hash([('y.deb', checksums)]))
+    # files are sorted by name
+    pair = [('a.deb', checksums), ('b.deb', checksums)]
+    assert_equals(files_hash(pair), files_hash(pair[::-1]))
+
+
+def test_inspect_deb():
+    path = AptlyTestCase.test_pkg1
+    details = inspect_deb(path)
+    arch, name, version, fileshash = parse_ref(details['Key'])
+    assert_equals((arch, name, version),
+                  ('amd64', 'python-talloc', '2.1.2-0+deb8u1'))
+    assert_equals(fileshash, details['FilesHash'])
+    assert_equals(details['SHA256'], file_checksums(path)['SHA256'])
+    assert_equals(details['Filename'], os.path.basename(path))
+
+
+class Test_inspect_debs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.broken = os.path.join(self.tmpdir, 'broken.deb')
+        with open(self.broken, 'wb') as file_pointer:
+            file_pointer.write(b'!<arch>\ngarbage')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_inspect_debs(self):
+        paths = [AptlyTestCase.test_pkg1, self.broken,
+                 AptlyTestCase.test_pkg3]
+        results = inspect_debs(paths, workers=2)
+        assert_equals(results[0], inspect_deb(paths[0]))
+        assert_equals(results[1]['Path'], self.broken)
+        assert_equals(results[1]['error'], 'malformed ar member header')
+        assert_equals(results[2]['Package'], 'unzip')
+        assert_equals(inspect_debs(paths, workers=1), results)
@@ -0,0 +1,59 @@
+from pyptly.diff import diff, sorted_rows, SnapshotDiffer
+from pyptly.index import PackageIndex
+from pyptly.flow import run
+from .conf import assert_equals
+
+snap1 = ['Pamd64 unzip 6.0-16+deb8u2 aaaaaaaa',
+         'Pamd64 zlib1g 1.2.8 bbbbbbbb',
+         'Pi386 zlib1g 1.2.8 cccccccc',
+         'Pall python-talloc 2.1.2-0+deb8u1 dddddddd']
+snap2 = ['Pamd64 unzip 6.0-16+deb8u3 eeeeeeee',
+         'Pamd64 zlib1g 1.2.8 bbbbbbbb',
+         'Pamd64 python-gdbm 2.7.8-2+b1 ffffffff']
+
+
+def test_diff():
+    assert_equals(diff(snap1, snap2), [
+        {'Left': None, 'Right': snap2[2]},
+        {'Left': snap1[3], 'Right': None},
+        {'Left': snap1[0], 'Right': snap2[0]},
+        {'Left': snap1[2], 'Right': None}])
+    assert_equals(diff(snap1, snap2, only_matching=True),
+                  [{'Left': snap1[0], 'Right': snap2[0]}])
+    assert_equals(diff(snap1, list(reversed(snap1))), [])
+
+
+def test_sorted_rows():
+    refs = ['Pi386 zip 1.0 00000001', 'Pamd64 zip 1.0~rc1 00000002',
+            'Pamd64 zip 1:0.9 00000003', 'Pamd64 unzip 6.0 00000004',
+            'Pi386 zip 1.00 00000005', 'Pamd64 zip 1.0 00000006']
+    index = PackageIndex(refs)
+    # name, newest version first (equal versions by architecture)
+    assert_equals([index.ref(row) for row in sorted_rows(index)],
+                  [refs[3], refs[2], refs[5], refs[0], refs[4], refs[1]])
+
+
+class FakeAptly(object):
+    snapshots = {'snap1': snap1, 'snap2': snap2, 'snap3': snap1}
+
+    _run = staticmethod(run)
+
+    def __init__(self):
+        self.calls = []
+
+    def iter_snapshot_packages(self, snap_name):
+        self.calls.append(snap_name)
+        return iter(self.snapshots[snap_name])
+
+
+def test_snapshot_differ():
+    api = FakeAptly()
+    differ = SnapshotDiffer(api)
+    chain = differ.diff_chain(['snap1', 'snap2', 'snap3'])
+    assert_equals(chain, [diff(snap1, snap2), diff(snap2, snap1)])
+    assert_equals(differ.diff('snap3', 'snap1'), [])
+    # listings are downloaded in parallel
+    assert_equals(sorted(api.calls), ['snap1', 'snap2', 'snap3'])
+    differ.forget('snap1')
+    differ.packages('snap1')
+    assert_equals(api.calls, ['snap1', 'snap2', 'snap3', 'snap1'])
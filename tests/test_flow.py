@@ -0,0 +1,107 @@
+import time
+import pyptly
+from pyptly.flow import Call, Calls, Blocking, Consume, Sleep, Done, run
+from pyptly.reconcile import DesiredState
+from .conf import unittest, assert_equals, assert_true
+
+
+def _double(value):
+    yield Sleep(0)
+    yield Done(value * 2)
+
+
+def _flow(log):
+    value = yield Call(lambda: 1)
+    log.append(value)
+    values = yield Calls([lambda: 2, lambda: _double(3),
+                          Blocking(lambda: 4),
+                          Consume(lambda: iter([5, 6]), sum)], workers=2)
+    log.append(values)
+    try:
+        yield Call(lambda: {}['missing'])
+    except KeyError:
+        log.append('raised')
+    yield Done('done')
+    log.append('not reached')
+
+
+def test_run():
+    log = []
+    assert_equals(run(_flow(log)), 'done')
+    assert_equals(log, [1, [2, 6, 4, 11], 'raised'])
+
+
+def test_groups():
+    running = {}
+    peak = {}
+
+    def work(group):
+        running[group] = running.get(group, 0) + 1
+        peak[group] = max(peak.get(group, 0), running[group])
+        time.sleep(0.01)
+        running[group] -= 1
+        return group
+
+    groups = ['a', 'a', 'a', 'b', 'b', 'c']
+    step = Calls([lambda group=group: work(group) for group in groups],
+                 workers=3, groups=groups)
+    assert_equals(step.order(), [0, 3, 5, 1, 4, 2])
+
+    def flow():
+        result = yield step
+        yield Done(result)
+
+    assert_equals(run(flow()), groups)
+    assert_equals(peak, {'a': 1, 'b': 1, 'c': 1})
+
+
+class StubCalls(object):
+    "Answers API calls of AsyncAptly from a dict of URL suffixes"
+
+    responses = {
+        'repos': [{'Name': 'stable'}],
+        'snapshots': [],
+        'publish': [],
+        'snapshots/snap1/packages': ['Pamd64 a 1 0000000a'],
+        'snapshots/snap2/packages': ['Pamd64 b 1 0000000b'],
+    }
+
+    def __init__(self, api):
+        self.api = api
+        self.calls = []
+
+    def __call__(self, url, verb, **kwargs):
+        # a done future, the tests must compile without async syntax
+        import asyncio
+        path = url[len(self.api.api) + 1:]
+        self.calls.append((verb, path))
+        result = asyncio.get_event_loop().create_future()
+        if verb == 'GET':
+            result.set_result(self.responses[path])
+        else:
+            result.set_result(dict(
+                self.api.codec.loads(kwargs.get('data') or '{}'), Path=path))
+        return result
+
+
+def test_AsyncAptly_flows():
+    if not hasattr(pyptly, 'AsyncAptly'):
+        raise unittest.SkipTest('aiohttp is not installed')
+    import asyncio
+    api = pyptly.AsyncAptly('127.0.0.1:8080')
+    # calls go over the aiohttp session only
+    assert_true(api.pool is None)
+    api._call = StubCalls(api)
+    loop = asyncio.new_event_loop()
+    try:
+        merged = loop.run_until_complete(
+            api.merge_snapshots('merged', ['snap1', 'snap2']))
+        report = loop.run_until_complete(
+            api.reconcile(DesiredState(repos=[{'Name': 'testing'}])))
+    finally:
+        loop.close()
+    assert_equals(sorted(merged['PackageRefs']),
+                  ['Pamd64 a 1 0000000a', 'Pamd64 b 1 0000000b'])
+    assert_equals(report, {'Actions': ["create_local_repo('testing')"],
+                           'Failed': {}})
+    assert_equals(api._call.calls[-1], ('POST', 'repos'))
@@ -0,0 +1,64 @@
+import os
+import shutil
+import hashlib
+import tempfile
+from pyptly.hashes import (file_checksums, FileHasher, package_checksums,
+                           find_package)
+from pyptly.store import PackageStore
+from .conf import unittest, assert_equals, AptlyTestCase
+
+
+class Test_file_hasher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = []
+        for num in range(4):
+            path = os.path.join(self.tmpdir, '{0}.deb'.format(num))
+            with open(path, 'wb') as file_pointer:
+                file_pointer.write(os.urandom(1000 * num))
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_file_checksums(self):
+        with open(AptlyTestCase.test_pkg3, 'rb') as file_pointer:
+            data = file_pointer.read()
+        checksums = file_checksums(AptlyTestCase.test_pkg3, chunk_size=4096)
+        assert_equals(checksums, {'Size': len(data),
+                                  'MD5sum': hashlib.md5(data).hexdigest(),
+                                  'SHA1': hashlib.sha1(data).hexdigest(),
+                                  'SHA256': hashlib.sha256(data).hexdigest()})
+
+    def test_cache(self):
+        store = PackageStore(os.path.join(self.tmpdir, 'store.db'))
+        hasher = FileHasher(store=store, workers=2)
+        checksums = hasher.map(self.files)
+        assert_equals(checksums, [file_checksums(path) for path in self.files])
+        hasher.map(self.files)
+        assert_equals(hasher.hashed, 4)
+        # shared by other hashers through the store
+        other = FileHasher(store=store)
+        other.map(self.files)
+        assert_equals(other.hashed, 0)
+        # a changed file is hashed again
+        with open(self.files[0], 'ab') as file_pointer:
+            file_pointer.write(b'x')
+        other.map(self.files)
+        assert_equals(other.hashed, 1)
+
+
+def test_find_package():
+    packages = [{'Key': 'Pamd64 a 1 00000001', 'SHA256': 'aa', 'MD5sum': 'a'},
+                {'Key': 'Pamd64 b 1 00000002', 'MD5sum': 'b'}]
+    index = package_checksums(packages)
+    file_b = {'SHA256': 'bb', 'SHA1': 'b1', 'MD5sum': 'b'}
+    assert_equals(find_package(index, file_b), 'Pamd64 b 1 00000002')
+    file_a = {'SHA256': 'aa', 'SHA1': 'a1', 'MD5sum': 'x'}
+    assert_equals(find_package(index, file_a), 'Pamd64 a 1 00000001')
+    file_c = {'SHA256': 'cc', 'SHA1': 'c1', 'MD5sum': 'c'}
+    assert_equals(find_package(index, file_c), None)
+    # SHA256 of package a differs, a matching MD5sum doesn't count
+    file_d = {'SHA256': 'dd', 'SHA1': 'd1', 'MD5sum': 'a'}
+    assert_equals(find_package(index, file_d), None)
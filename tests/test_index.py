@@ -0,0 +1,68 @@
+from pyptly.index import PackageIndex, parse_ref
+from .conf import assert_equals, assert_in, assert_not_in, assert_raises
+
+refs1 = ['Pamd64 unzip 6.0-16+deb8u2 a1b2c3d4e5f60718',
+         'Pamd64 unzip 6.0-16+deb8u1 12345678',
+         'Pi386 unzip 6.0-16+deb8u2 ffffffffffffffff',
+         'Pall python-talloc 2.1.2-0+deb8u1 0000000a']
+refs2 = ['Pamd64 unzip 6.0-16+deb8u2 a1b2c3d4e5f60718',
+         'Pamd64 python-gdbm 2.7.8-2+b1 5a5a5a5a5a5a5a5a']
+
+
+def test_parse_ref():
+    assert_equals(parse_ref(refs1[0]),
+                  ('amd64', 'unzip', '6.0-16+deb8u2', 'a1b2c3d4e5f60718'))
+    assert_raises(ValueError, parse_ref, 'amd64 unzip 6.0')
+    assert_raises(ValueError, PackageIndex, ['Pamd64 unzip 6.0'])
+
+
+def test_index():
+    index = PackageIndex(refs1 + refs1[:2])
+    assert_equals(len(index), 4)
+    assert_equals(list(index), refs1)
+    for ref in refs1:
+        assert_in(ref, index)
+    assert_not_in(refs2[1], index)
+    assert_not_in('Pamd64 unzip 6.0-16+deb8u2 a1b2c3d4e5f60719', index)
+    assert_not_in('garbage', index)
+
+    details = PackageIndex([{'Key': ref} for ref in refs1])
+    assert_equals(details, index)
+
+
+def test_index_growth():
+    refs = ['Pamd64 pkg{0} 1.{1} {2:08x}'.format(num % 100, num, num * 7919)
+            for num in range(5000)]
+    index = PackageIndex(refs)
+    assert_equals(len(index), 5000)
+    assert_equals(list(index), refs)
+    assert_equals(len(index.lookup('pkg7')), 50)
+
+
+def test_lookup():
+    index = PackageIndex(refs1)
+    assert_equals(index.lookup('unzip'), refs1[:3])
+    assert_equals(index.lookup('unzip', 'i386'), [refs1[2]])
+    assert_equals(index.lookup('python-gdbm'), [])
+    index.add(refs2[1])
+    assert_equals(index.lookup('python-gdbm'), [refs2[1]])
+
+
+def test_set_operations():
+    index1 = PackageIndex(refs1)
+    index2 = PackageIndex(refs2)
+    assert_equals(list(index1 | index2), refs1 + refs2[1:])
+    assert_equals(list(index1 & index2), refs2[:1])
+    assert_equals(list(index1 - index2), refs1[1:])
+    assert_equals(list(index2 - index1), refs2[1:])
+    assert_equals(PackageIndex(reversed(refs1)), index1)
+
+
+def test_tables():
+    index1 = PackageIndex(refs1)
+    index2 = PackageIndex(refs2)
+    # every index keeps its own strings, derived indexes share them
+    assert_equals(len(index2._names), 2)
+    assert_equals((index1 | index2)._names, index1._names)
+    assert_equals(len(index1._names), 3)
+    assert_in(refs2[1], index1 | index2)
@@ -0,0 +1,62 @@
+from pyptly.metrics import Histogram, Metrics, body_size
+from .conf import assert_equals, assert_in, assert_true
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+    assert_equals(histogram.cumulative(),
+                  [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+    assert_equals(histogram.count, 4)
+    assert_equals(histogram.quantile(0.5), 0.1)
+    assert_equals(histogram.quantile(0.99), float('inf'))
+    assert_equals(Histogram((1,)).quantile(0.5), None)
+
+
+def test_body_size():
+    assert_equals(body_size(None), 0)
+    assert_equals(body_size(b'abc'), 3)
+    assert_equals(body_size(iter([b'abc'])), 0)
+
+
+def test_metrics_hooks():
+    metrics = Metrics()
+    events = []
+    metrics.on_request.append(lambda event: events.append(dict(event)))
+    metrics.on_response.append(lambda event: events.append(dict(event)))
+    event = metrics.start('repos', 'GET', 'http://localhost/api/repos')
+    metrics.finish(event, 200, 0, 42)
+    assert_equals(len(events), 2)
+    assert_true('status' not in events[0])
+    assert_equals(events[1]['received'], 42)
+    assert_equals(events[1]['status'], 200)
+
+    metrics.finish(metrics.start('repos', 'GET', ''), None)
+    metrics.add_received('repos', 'GET', 8)
+    summary = metrics.summary()['GET repos']
+    assert_equals(summary['count'], 2)
+    assert_equals(summary['received'], 50)
+    assert_equals(metrics.statuses, {('repos', 'GET', 200): 1,
+                                     ('repos', 'GET', 0): 1})
+    metrics.reset()
+    assert_equals(metrics.summary(), {})
+
+
+def test_metrics_prometheus():
+    metrics = Metrics(buckets=(0.5,), decode_buckets=(0.5,))
+    metrics.finish(metrics.start('files', 'POST', ''), 200, 100, 10)
+    metrics.observe_decode('files', 0.01)
+    text = metrics.prometheus()
+    assert_in('# TYPE pyptly_request_duration_seconds histogram', text)
+    assert_in('pyptly_request_duration_seconds_bucket'
+              '{endpoint="files",verb="POST",le="+Inf"} 1', text)
+    assert_in('pyptly_decode_duration_seconds_count{endpoint="files"} 1',
+              text)
+    assert_in('pyptly_responses_total'
+              '{endpoint="files",verb="POST",code="200"} 1', text)
+    assert_in('pyptly_request_bytes_total{endpoint="files",verb="POST"} 100',
+              text)
+    assert_in('pyptly_response_bytes_total{endpoint="files",verb="POST"} 10',
+              text)
+    assert_true(text.endswith('\n'))
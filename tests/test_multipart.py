@@ -0,0 +1,54 @@
+import os
+from pyptly.multipart import MultipartEncoder
+from .conf import assert_equals, assert_in, assert_true, assert_raises
+
+test_pkg1 = 'tests/files/python-talloc_2.1.2-0+deb8u1_amd64.deb'
+test_pkg2 = 'tests/files/unzip_6.0-16+deb8u2_amd64.deb'
+
+
+def read_all(body, size):
+    data = b''
+    chunk = body.read(size)
+    while chunk:
+        # chunks are bytes or memoryviews, bytes() of a memoryview is
+        # its repr on python 2
+        data += memoryview(chunk).tobytes()
+        chunk = body.read(size)
+    return data
+
+
+def test_encoder_body():
+    progress = []
+    body = MultipartEncoder([test_pkg1, test_pkg2], chunk_size=4096,
+                            callback=lambda sent, total: progress.append(sent))
+    data = read_all(body, 10000)
+
+    assert_equals(len(data), len(body))
+    assert_equals(progress[-1], len(body))
+    assert_true(data.endswith(
+        '\r\n--{0}--\r\n'.format(body.boundary).encode('utf-8')))
+    for pkg in [test_pkg1, test_pkg2]:
+        with open(pkg, 'rb') as pkg_file:
+            assert_in(pkg_file.read(), data)
+        assert_in('filename="{0}"'.format(os.path.basename(pkg)).encode(),
+                  data)
+
+
+def test_encoder_chunks():
+    body = MultipartEncoder([test_pkg1], chunk_size=1024)
+    chunk = body.read()
+    while chunk:
+        assert_true(len(chunk) <= 1024)
+        chunk = body.read(100000)
+    assert_equals(body.bytes_sent, len(body))
+    assert_equals(body._file, None)
+
+
+def test_encoder_empty():
+    body = MultipartEncoder([])
+    assert_equals(read_all(body, 100),
+                  '--{0}--\r\n'.format(body.boundary).encode('utf-8'))
+
+
+def test_encoder_missing_file():
+    assert_raises(OSError, MultipartEncoder, ['tests/files/missing.deb'])
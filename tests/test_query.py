@@ -0,0 +1,95 @@
+from pyptly.query import PackageQuery, QueryIndex, compile_query
+from .conf import assert_equals, assert_true, assert_raises
+
+packages = [
+    {'Key': 'Pamd64 python-foo 2.1-1 aaaaaaaa', 'Package': 'python-foo',
+     'Version': '2.1-1', 'Architecture': 'amd64', 'Source': 'foo (2.1-1)',
+     'Priority': 'optional'},
+    {'Key': 'Pi386 python-foo 1.9-1 bbbbbbbb', 'Package': 'python-foo',
+     'Version': '1.9-1', 'Architecture': 'i386', 'Source': 'foo',
+     'Priority': 'extra'},
+    {'Key': 'Pamd64 nginx 1:1.6.0-1 cccccccc', 'Package': 'nginx',
+     'Version': '1:1.6.0-1', 'Architecture': 'amd64'},
+    {'Key': 'Pall python-bar 3.0~rc1 dddddddd', 'Package': 'python-bar',
+     'Version': '3.0~rc1', 'Architecture': 'all',
+     'Filename': 'python-bar_3.0~rc1_all.udeb'},
+]
+keys = [package['Key'] for package in packages]
+
+
+def test_search():
+    index = QueryIndex(packages)
+    test_map = (
+        ('Name (~ ^python-), $Architecture (amd64), Version (>= 2.0)',
+         [keys[0], keys[3]]),
+        ('nginx', keys[2:3]),
+        ('nginx (>> 1.7) {amd64}', keys[2:3]),
+        ('nginx (<< 1.7)', []),
+        ('nginx_1:1.6.0-1_amd64', keys[2:3]),
+        ('$Source (foo)', keys[:2]),
+        ('$SourceVersion (<= 2.0)', keys[1:2]),
+        ('!Priority | nginx', keys[2:]),
+        ('(Name (% python-*) | nginx), !$Architecture (i386)',
+         [keys[0], keys[2]]),
+        ('$PackageType (udeb)', keys[3:]),
+        ('Version (< 3.0)', [keys[0], keys[1], keys[3]]),
+        ('Priority (optional) | Priority (extra), Version (<< 2)', keys[:2]),
+        ('Name (missing)', []),
+        # 'all' packages match every architecture but source
+        ('$Architecture (i386)', keys[1:2] + keys[3:]),
+        ('$Architecture (source)', []),
+        ('Architecture (i386)', keys[1:2]),
+        ('python-bar {amd64}', keys[3:]),
+        ('python-bar_3.0~rc1_amd64', []),
+        ('python-bar_3.0~rc1_all', keys[3:]),
+        # versions are compared by $Version only, Version is a string
+        ('$Version (= 1:1.6.0-1.0)', []),
+        ('$Version (= 2.1-1)', keys[:1]),
+        ('Version (= 2.1-1)', keys[:1]),
+        ('Filename', keys[3:]),
+    )
+    for query, expect in test_map:
+        assert_equals(index.search(query), expect)
+        assert_equals(PackageQuery(query).filter(packages),
+                      [package for package in packages
+                       if package['Key'] in expect])
+    assert_equals(index.search('nginx', details=True), packages[2:3])
+
+
+def test_refs():
+    index = QueryIndex(keys)
+    assert_equals(index.search('python-foo (>= 2.0)'), keys[:1])
+    assert_equals(index.search('$Architecture (all) | nginx'), keys[2:])
+    index.add('Pamd64 nginx 1.9 eeeeeeee')
+    assert_equals(index.search('$Architecture (all) | nginx'),
+                  keys[2:] + ['Pamd64 nginx 1.9 eeeeeeee'])
+    assert_true(PackageQuery('nginx').match(keys[2]))
+    assert_true(not PackageQuery('nginx').match(keys[1]))
+
+
+def test_version_equality():
+    index = QueryIndex(['Pamd64 foo 1.0 00000001',
+                        'Pamd64 bar 1.0-0 00000002'])
+    assert_equals(index.search('$Version (= 1.0-0)'),
+                  ['Pamd64 foo 1.0 00000001', 'Pamd64 bar 1.0-0 00000002'])
+    assert_equals(index.search('Version (= 1.0-0)'),
+                  ['Pamd64 bar 1.0-0 00000002'])
+    assert_equals(index.search('foo (= 1.0-0)'), ['Pamd64 foo 1.0 00000001'])
+    # empty fields are missing
+    empty = {'Key': 'Pall baz 1 00000003', 'Package': 'baz', 'Version': '1',
+             'Architecture': 'all', 'Priority': ''}
+    assert_true(not PackageQuery('Priority').match(empty))
+    assert_true(PackageQuery('Section (<< 1)').match(empty))
+
+
+def test_compile_query():
+    query = compile_query('Name (nginx) ,$Version (>= 1)')
+    assert_equals(repr(query), '<PackageQuery Name (= nginx), '
+                               '$Version (>= 1)>')
+    assert_true(compile_query('Name (nginx) ,$Version (>= 1)') is query)
+    assert_true(compile_query(query) is query)
+    assert_equals(repr(compile_query('!(a | b), c')),
+                  '<PackageQuery !(Name (= a) | Name (= b)), Name (= c)>')
+    for bad in ('', 'Name (', '(nginx', 'nginx |', 'a_b',
+                'Priority {amd64}', 'Name ()', 'nginx )'):
+        assert_raises(ValueError, PackageQuery, bad)
@@ -0,0 +1,123 @@
+import pyptly
+from pyptly.reconcile import DesiredState, publish_key
+from .conf import assert_equals, assert_raises
+
+repos = [{'Name': 'stable', 'Comment': '', 'DefaultDistribution': 'stable',
+          'DefaultComponent': 'main'}]
+snapshots = [{'Name': 'stable-1', 'Description': 'Snapshot from local '
+                                                 'repo [stable]'}]
+published = [{'Storage': 's3:bucket', 'Prefix': 'debian',
+              'Distribution': 'stable', 'SourceKind': 'snapshot',
+              'Sources': [{'Component': 'main', 'Name': 'stable-1'}]},
+             {'Storage': '', 'Prefix': '.', 'Distribution': 'testing',
+              'SourceKind': 'local',
+              'Sources': [{'Component': 'main', 'Name': 'stable'}]}]
+state = DesiredState(
+    repos=[{'Name': 'stable', 'DefaultDistribution': 'stable'},
+           {'Name': 'testing', 'Comment': 'new'}],
+    snapshots=[{'Name': 'stable-1', 'Repo': 'stable'},
+               {'Name': 'testing-1', 'Repo': 'testing'},
+               {'Name': 'all-1', 'PackageRefs': [],
+                'SourceSnapshots': ['stable-1', 'testing-1']}],
+    published=[{'Prefix': 's3:bucket:debian', 'Distribution': 'stable',
+                'SourceKind': 'snapshot', 'Signing': {'Skip': True},
+                'Sources': [{'Component': 'main', 'Name': 'all-1'}]},
+               {'Distribution': 'testing', 'SourceKind': 'local',
+                'Sources': [{'Component': 'main', 'Name': 'stable'}]}])
+
+
+def test_publish_key():
+    assert_equals(publish_key('s3:bucket:debian', 'stable'),
+                  ('s3:bucket', 'debian', 'stable'))
+    assert_equals(publish_key(None, 'stable'), ('', '.', 'stable'))
+    assert_equals(publish_key('filesystem:www:', 'x'),
+                  ('filesystem:www', '.', 'x'))
+
+
+def test_plan():
+    plan = state.plan(repos, snapshots, published)
+    assert_equals([[repr(action) for action in wave] for wave in plan.waves], [
+        ["create_local_repo('testing', Comment='new')"],
+        ["create_snapshot_from_repo('testing', Name='testing-1')"],
+        ["create_snapshot_from_pkg(Name='all-1', PackageRefs=[], "
+         "SourceSnapshots=['stable-1', 'testing-1'])"],
+        ["update_publish('stable', Signing={'Skip': True}, "
+         "Snapshots=[{'Component': 'main', 'Name': 'all-1'}], "
+         "prefix='s3:bucket:debian')"]])
+    assert_equals(len(plan), 4)
+    assert_equals(str(plan).split('\n')[0],
+                  "1. create_local_repo('testing', Comment='new')")
+
+    done = DesiredState(repos=repos, snapshots=[
+        {'Name': 'stable-1', 'Repo': 'stable'}])
+    assert_equals(str(done.plan(repos, snapshots, published)), 'no changes')
+
+    changed = DesiredState(
+        repos=[{'Name': 'stable', 'Comment': 'x'}],
+        snapshots=[{'Name': 'stable-1', 'Repo': 'stable',
+                    'Description': 'first'}],
+        published=[{'Prefix': '.', 'Distribution': 'testing',
+                    'SourceKind': 'snapshot',
+                    'Sources': [{'Name': 'stable-1'}]}])
+    assert_equals([repr(action) for action in changed.plan(
+        repos, snapshots, published).actions], [
+        "edit_local_repo('stable', Comment='x')",
+        "update_snapshot('stable-1', Description='first')",
+        "delete_publish('testing', prefix='.')",
+        "publish(Distribution='testing', SourceKind='snapshot', "
+        "Sources=[{'Component': 'main', 'Name': 'stable-1'}], "
+        "prefix='.')"])
+
+    # Sources without Component match the Sources aptly reports
+    echoed = DesiredState(published=[
+        {'Prefix': 's3:bucket:debian', 'Distribution': 'stable',
+         'SourceKind': 'snapshot', 'Sources': [{'Name': 'stable-1'}]},
+        {'Distribution': 'testing', 'SourceKind': 'local',
+         'Sources': [{'Name': 'stable'}]}])
+    assert_equals(str(echoed.plan(repos, snapshots, published)),
+                  'no changes')
+    # a local repository is published to its default component
+    repo = dict(repos[0], DefaultComponent='contrib')
+    assert_equals(repr(echoed.plan([repo], snapshots, []).actions[-1]),
+                  "publish(Distribution='testing', SourceKind='local', "
+                  "Sources=[{'Component': 'contrib', 'Name': 'stable'}], "
+                  "prefix='.')")
+
+    # another local repository is published again
+    switched = DesiredState(published=[
+        {'Distribution': 'testing', 'SourceKind': 'local',
+         'Sources': [{'Component': 'main', 'Name': 'testing'}]}])
+    assert_equals([[repr(action) for action in wave]
+                   for wave in switched.plan(repos, snapshots,
+                                             published).waves], [
+        ["delete_publish('testing', prefix='.')"],
+        ["publish(Distribution='testing', SourceKind='local', "
+         "Sources=[{'Component': 'main', 'Name': 'testing'}], "
+         "prefix='.')"]])
+    assert_raises(ValueError, DesiredState, (), [{'Name': 'x'}])
+
+
+def test_reconcile():
+    api = pyptly.Aptly('127.0.0.1:8080')
+    calls = []
+    api._call = lambda url, verb, **kwargs: {
+        'repos': repos, 'snapshots': snapshots,
+        'publish': published}[url.split('/api/')[1]]
+    api.create_local_repo = lambda name, **kwargs: calls.append(name) or {}
+    api.create_snapshot_from_repo = lambda name, **kwargs: calls.append(
+        kwargs['Name']) or {'error': 'repo is empty'}
+    api.create_snapshot_from_pkg = lambda **kwargs: calls.append('pkg')
+    plans = []
+
+    report = api.reconcile(state, dry_run=True, callback=plans.append)
+    assert_equals(len(report['Actions']), 4)
+    assert_equals(len(plans), 1)
+    assert_equals(calls, [])
+
+    report = api.reconcile(state, workers=2)
+    assert_equals(calls, ['testing', 'testing-1'])
+    assert_equals(sorted(report['Failed'].values()), [
+        'repo is empty', 'snapshot all-1 failed', 'snapshot testing-1 failed'])
+
+    api._call = lambda url, verb, **kwargs: {'error': 'down'}
+    assert_equals(api.reconcile(state), {'error': 'down'})
@@ -0,0 +1,54 @@
+import pyptly
+from pyptly.retention import RetentionPolicy
+from .conf import assert_equals, assert_raises
+
+refs = ['Pamd64 foo 1.0-1 00000001',
+        'Pamd64 foo 1.10-1 00000002',
+        'Pamd64 foo 1.9-1 00000003',
+        'Pi386 foo 1.0-1 00000004',
+        'Pall bar 2.0~rc1 00000005',
+        'Pall bar 2.0 00000006']
+
+
+def test_keep():
+    assert_equals(RetentionPolicy(keep=1).removals(refs),
+                  [refs[0], refs[2], refs[4]])
+    assert_equals(RetentionPolicy(keep=1, by_arch=False).removals(refs),
+                  [refs[0], refs[2], refs[3], refs[4]])
+    assert_equals(RetentionPolicy(keep=5).removals(refs), [])
+    assert_equals(RetentionPolicy().removals(refs), [])
+    assert_equals(RetentionPolicy(keep=1).removals(
+        [{'Key': ref} for ref in refs[:2]]), refs[:1])
+    assert_raises(ValueError, RetentionPolicy, 0)
+
+
+def test_older_than():
+    snapshot = ['Pamd64 foo 1.9-1 aaaaaaaa', 'Pamd64 foo 1.2 bbbbbbbb']
+    assert_equals(RetentionPolicy(older_than=snapshot).removals(refs),
+                  refs[:1])
+    assert_equals(RetentionPolicy(older_than=snapshot,
+                                  by_arch=False).removals(refs),
+                  [refs[0], refs[3]])
+    assert_equals(RetentionPolicy(keep=2, older_than=snapshot,
+                                  protect=[refs[0]]).removals(refs), [])
+
+
+def test_prune_repo():
+    api = pyptly.Aptly('127.0.0.1:8080')
+    calls = []
+    api.show_repo_packages = lambda name: refs
+    api.show_snapshot_packages = lambda name: ['Pall bar 2.0 cccccccc']
+    api.delete_pkg_bykey = lambda name, PackageRefs: (
+        calls.append((name, PackageRefs)) or {'Name': name})
+
+    assert_equals(api.prune_repo('repo', keep=2, dry_run=True),
+                  {'Removed': refs[:1], 'Added': []})
+    assert_equals(calls, [])
+    assert_equals(api.prune_repo('repo', keep=2, older_than='snap',
+                                 batch_size=1),
+                  {'Removed': [refs[0], refs[4]], 'Added': []})
+    assert_equals(calls, [('repo', [refs[0]]), ('repo', [refs[4]])])
+
+    api.show_snapshot_packages = lambda name: {'error': 'not found'}
+    assert_equals(api.prune_repo('repo', older_than='snap'),
+                  {'error': 'not found'})
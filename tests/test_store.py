@@ -0,0 +1,59 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from pyptly.store import PackageStore
+from .conf import (unittest, assert_equals, assert_true, assert_less_equal,
+                   assert_in, assert_raises)
+
+
+class Test_package_store(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'store.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_put(self):
+        store = PackageStore(self.path)
+        pkg = {'Key': 'Pamd64 unzip 6.0-16+deb8u2 a1b2c3d4', 'Version': '6.0'}
+        assert_equals(store.get('package', pkg['Key']), None)
+        store.put('package', pkg['Key'], pkg)
+        assert_equals(store.get('package', pkg['Key']), pkg)
+        assert_equals(store.get('snapshot', pkg['Key']), None)
+        # shared with other instances
+        assert_equals(PackageStore(self.path).get('package', pkg['Key']), pkg)
+
+    def test_eviction(self):
+        store = PackageStore(self.path, max_bytes=4000)
+        for num in range(200):
+            store.put('package', str(num), {'Key': num, 'Data': str(num) * 50})
+        assert_less_equal(store.size(), 4000)
+        assert_true(0 < len(store) < 200)
+        assert_equals(store.get('package', '199')['Key'], 199)
+        store.clear()
+        assert_equals(len(store), 0)
+
+    def test_close(self):
+        from pyptly.utils import thread_map
+        store = PackageStore(self.path)
+        store.put('package', 'a', {'Key': 'a'})
+        conns = thread_map(lambda num: store._conn, range(4), 4)
+        conns.append(store._conn)
+        store.close()
+        # connections of all threads are closed
+        for conn in conns:
+            assert_raises(sqlite3.ProgrammingError, conn.execute, 'SELECT 1')
+        assert_equals(len(store._conns), 0)
+        assert_equals(store.get('package', 'a'), {'Key': 'a'})
+
+    def test_snapshot_key(self):
+        snap = {'Name': 'snap', 'CreatedAt': '2017-01-01T00:00:00Z'}
+        key = PackageStore.snapshot_key(snap, {'format': 'details'})
+        assert_in('2017-01-01T00:00:00Z', key)
+        assert_true(key != PackageStore.snapshot_key(snap, {}))
+        recreated = dict(snap, CreatedAt='2017-01-02T00:00:00Z')
+        assert_true(key != PackageStore.snapshot_key(recreated,
+                                                      {'format': 'details'}))
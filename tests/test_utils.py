@@ -1,6 +1,10 @@
+import json
 import requests
-from pyptly.utils import prefix_sanitized, response
-from .conf import assert_is_instance, assert_equals
+from pyptly.utils import (prefix_sanitized, response, split_batches,
+                          thread_map, iter_json_array, is_error,
+                          error_message, publish_storage, interleave,
+                          quote_segment, JSONArrayParser)
+from .conf import assert_is_instance, assert_equals, assert_raises
 
 def test_prefix():
     test_map = ( ('.', ':.'),
@@ -32,6 +36,22 @@ def test_prefix():
 
     for test_val, expect_val in test_map:
         assert_equals(prefix_sanitized(test_val), expect_val)
+        # memoized result
+        assert_equals(prefix_sanitized(test_val), expect_val)
+
+
+def test_quote_segment():
+    test_map = (('stable', 'stable'),
+                ('main/contrib', 'main%2Fcontrib'),
+                ('100%', '100%25'),
+                ('a b?c#d', 'a%20b%3Fc%23d'),
+                ('1.0-1+deb9u1~bpo', '1.0-1+deb9u1~bpo'),
+                (':.', ':.'),
+                (u'caf\xe9', 'caf%C3%A9'),
+                (42, '42'))
+
+    for test_val, expect_val in test_map:
+        assert_equals(quote_segment(test_val), expect_val)
 
 
 def test_response():
@@ -41,3 +61,73 @@ def test_response():
     request = requests.get('https://google.com')
     msg = response(request)
     assert_is_instance(msg['error'], ValueError)
+
+
+def test_is_error():
+    assert_equals(is_error({'error': 'not found'}), True)
+    assert_equals(is_error([{'error': 'not found', 'meta': 'aborted'}]), True)
+    assert_equals(is_error({'Name': 'repo'}), False)
+    assert_equals(is_error(['dir/file.deb']), False)
+    assert_equals(is_error([]), False)
+
+
+def test_iter_json_array():
+    data = [{'Key': 'Pamd64 unzip 6.0-16+deb8u2 {0}'.format(num),
+             'Size': num * 1000,
+             'Description': u'\u00e9 ]}, "'}
+            for num in range(100)] + [1234567, None, True, [1, [2]],
+                                      u'\\"[', -1.5e3]
+    raw = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    for size in (1, 7, 64, len(raw)):
+        chunks = [raw[pos:pos + size] for pos in range(0, len(raw), size)]
+        assert_equals(list(iter_json_array(chunks)), data)
+
+    assert_equals(list(iter_json_array([b' [', b' ] '])), [])
+    for raw in (b'{"error": "not found"}', b'', b'[1, 2', b'[1 2]',
+                b'[1,]', b'[1] 2'):
+        assert_raises(ValueError, list, iter_json_array([raw]))
+
+    # malformed data raises without waiting for the end of the response
+    for raw in (b'[1,]', b'[{"a": 1]', b'[{"a" 1}, ', b'[1x, ', b'[nul '):
+        assert_raises(ValueError, JSONArrayParser().feed, raw)
+
+
+def test_split_batches():
+    sizes = [(10, 'a'), (1, 'b'), (5, 'c'), (7, 'd'), (3, 'e'), (9, 'f')]
+    batches = split_batches(sizes, 12)
+    assert_equals(len(batches), 3)
+    assert_equals(sorted(sum(batches, [])), sorted(item for _, item in sizes))
+    weights = [sum(size for size, item in sizes if item in batch)
+               for batch in batches]
+    assert_equals(sorted(weights), [11, 12, 12])
+
+    assert_equals(len(split_batches(sizes, 1000, min_batches=4)), 4)
+    assert_equals(len(split_batches(sizes, 1, min_batches=4)), 6)
+    assert_equals(split_batches([], 10), [])
+
+
+def test_thread_map():
+    assert_equals(thread_map(lambda x: x * 2, range(20), 4),
+                  [x * 2 for x in range(20)])
+    assert_equals(thread_map(lambda x: x, [], 4), [])
+
+
+def test_error_message():
+    assert_equals(error_message({'error': 'boom'}), 'boom')
+    assert_equals(error_message([{'error': 'boom', 'meta': ''}]), 'boom')
+
+
+def test_publish_storage():
+    test_map = (('.', ''),
+                (None, ''),
+                ('ppa/main', ''),
+                ('s3:bucket:', 's3:bucket'),
+                ('s3:bucket:dists/main', 's3:bucket'),
+                ('filesystem:web:.', 'filesystem:web'))
+    for prefix, storage in test_map:
+        assert_equals(publish_storage(prefix), storage)
+
+
+def test_interleave():
+    assert_equals(interleave([[1, 2, 3], [4], [5, 6]]), [1, 4, 5, 2, 6, 3])
+    assert_equals(interleave([]), [])
@@ -0,0 +1,60 @@
+import random
+from pyptly.version import (compare_versions, parse_version, version_key,
+                            version_ranks, sort_versions)
+from .conf import assert_equals
+
+
+def test_parse_version():
+    assert_equals(parse_version('6.0-16+deb8u2'), (0, '6.0', '16+deb8u2'))
+    assert_equals(parse_version('1:2.0-1-2'), (1, '2.0-1', '2'))
+    assert_equals(parse_version('2.0'), (0, '2.0', ''))
+
+
+def test_compare_versions():
+    test_map = (('1.0', '1.0', 0),
+                ('1.0', '1.1', -1),
+                ('1.10', '1.9', 1),
+                ('1.01', '1.1', 0),
+                ('1.0~rc1', '1.0', -1),
+                ('1.0~~', '1.0~', -1),
+                ('1.0a', '1.0', 1),
+                ('1.0+', '1.0a', 1),
+                ('1.0.', '1.0', 1),
+                ('1:0.1', '2.0', 1),
+                ('0:1.0', '1.0', 0),
+                ('1.0-1', '1.0-2', -1),
+                ('1.0-1', '1.0', 1),
+                ('1.0-0', '1.0', 0),
+                ('2.7.8-2+b1', '2.7.8-2', 1),
+                ('6.0-16+deb8u2', '6.0-16+deb8u1', 1))
+
+    for left, right, expect_val in test_map:
+        assert_equals(compare_versions(left, right), expect_val)
+        assert_equals(compare_versions(right, left), -expect_val)
+        left_key, right_key = version_key(left), version_key(right)
+        assert_equals((left_key > right_key) - (left_key < right_key),
+                      expect_val)
+
+
+def test_version_key():
+    rnd = random.Random(0)
+    alphabet = '0019~.a+Z-:'
+    for _ in range(5000):
+        left, right = [''.join(rnd.choice(alphabet)
+                               for _ in range(rnd.randint(0, 8)))
+                       for _ in range(2)]
+        expect_val = compare_versions(left, right)
+        left_key, right_key = version_key(left), version_key(right)
+        assert_equals((left_key > right_key) - (left_key < right_key),
+                      expect_val)
+
+
+def test_sort_versions():
+    versions = ['1.0', '1:0.1', '1.0~rc1', '1.00', '0.9-1', '1.0-0', '2']
+    assert_equals(sort_versions(versions),
+                  ['0.9-1', '1.0~rc1', '1.0', '1.00', '1.0-0', '2', '1:0.1'])
+    assert_equals(sort_versions(versions, reverse=True),
+                  ['1:0.1', '2', '1.0', '1.00', '1.0-0', '1.0~rc1', '0.9-1'])
+    ranks = version_ranks(versions)
+    assert_equals(ranks['1.0'], ranks['1.0-0'])
+    assert_equals(ranks['1:0.1'], 4)